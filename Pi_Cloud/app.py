@@ -1,42 +1,481 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, Response, render_template, request, jsonify, send_file
 import os
 import json
-from datetime import datetime
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from datetime import datetime, timezone
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import http_date, is_resource_modified
 from werkzeug.utils import secure_filename
 import mimetypes
+import delta
+from catalog import Catalog
+from metrics import TransferMeter, TransferMetrics
+from precompress import ENCODINGS, Precompressor, fresh_variant
+from thumbnails import Thumbnailer, background_pool
 
 app = Flask(__name__)
+transfers = TransferMetrics()
+app.wsgi_app = TransferMeter(app.wsgi_app, transfers)
 
 UPLOAD_FOLDER = ''
 MAX_FILE_SIZE = 2048 * 1024 *1024
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'jpg', 'jpeg', 'gif', 'mp4', 'mp3', 'doc', 'docx', 'zip', '7z', 'heic'}
 
+# Chunked uploads: each chunk is its own request, so a dropped connection only
+# loses the chunk in flight
+CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_EXPIRY_SECONDS = 24 * 3600
+COPY_BUFFER_SIZE = 1024 * 1024
+
+CATALOG_NAME = '.catalog.sqlite3'
+BLOB_FOLDER_NAME = '.blobs'
+THUMBNAIL_FOLDER_NAME = '.thumbnails'
+BACKGROUND_WORKERS = 1
+RESCAN_INTERVAL_SECONDS = 300
+MAX_PAGE_SIZE = 1000
+
+# Already compressed formats go into ZIPs as is; deflating them again costs
+# the Pi's CPU for nothing (docx is a zip itself)
+STORED_EXTENSIONS = {'jpg', 'jpeg', 'gif', 'mp4', 'mp3', 'zip', '7z', 'heic', 'docx'}
+# Level 1 gets most of the gain on text for a fraction of the CPU
+ZIP_COMPRESS_LEVEL = 1
+MAX_ZIP_FILES = 10000
+
+# Ranges past this many are coalesced into one, so a request can't make us
+# seek all over the disk
+MAX_RANGES = 16
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
+# Dedup mode stores each distinct content once under its sha256, filenames
+# become references to it
+app.config['DEDUP'] = os.environ.get('PI_CLOUD_DEDUP') == '1'
+# Behind Apache/lighttpd with mod_xsendfile the web server sends the file itself
+app.config['USE_X_SENDFILE'] = os.environ.get('PI_CLOUD_X_SENDFILE') == '1'
 
 CUSTOM_MIME_TYPES = {
     '.heic': 'image/heic',
-    ' docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
     '.7z': 'application/x-7z-compressed'
 }
 
+# Served gzip/zstd encoded when the client accepts it; everything else
+# allowed here is already compressed
+COMPRESSIBLE_MIME_TYPES = {'application/pdf', 'application/msword'}
+
 def get_mime_type(filepath):
     ext = os.path.splitext(filepath)[1].lower()
     return CUSTOM_MIME_TYPES.get(ext, mimetypes.guess_type(filepath)[0] or 'unknown')
 
+def is_compressible(mime):
+    return mime.startswith('text/') or mime in COMPRESSIBLE_MIME_TYPES
+
+
+def name_transfer(name):
+    """Show the transfer of the current request under name in /api/metrics"""
+    transfer = request.environ.get('pi_cloud.transfer')
+    if transfer is not None:
+        transfer.name = name
+
+def clean_folder(path):
+    """A client's folder path as stored: safe components joined by '/', ''
+    for the top level. None if a component has nothing usable in it."""
+    parts = [part for part in (path or '').split('/') if part]
+    cleaned = [secure_filename(part) for part in parts]
+    if not all(cleaned):
+        return None
+    return '/'.join(cleaned)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def get_file_info(filepath):
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+def get_catalog():
+    """The file index for the current upload folder, built on first use"""
+    folder = app.config['UPLOAD_FOLDER'] or '.'
+    with _catalogs_lock:
+        catalog = _catalogs.get(folder)
+        if catalog is None:
+            os.makedirs(folder, exist_ok=True)
+            catalog = Catalog(folder, os.path.join(folder, CATALOG_NAME), get_mime_type, allowed_file)
+            catalog.reconcile()
+            catalog.start_rescans(RESCAN_INTERVAL_SECONDS)
+            _catalogs[folder] = catalog
+    return catalog
+
+_background = {}
+
+def get_background():
+    """(thumbnailer, precompressor) for the current upload folder, sharing one worker pool"""
+    folder = app.config['UPLOAD_FOLDER'] or '.'
+    with _catalogs_lock:
+        workers = _background.get(folder)
+        if workers is None:
+            pool = background_pool(BACKGROUND_WORKERS)
+            workers = (
+                Thumbnailer(os.path.join(folder, THUMBNAIL_FOLDER_NAME), pool),
+                Precompressor(pool),
+            )
+            _background[folder] = workers
+    return workers
+
+def get_thumbnailer():
+    return get_background()[0]
+
+def get_precompressor():
+    return get_background()[1]
+
+def preview_key(name, filepath):
+    """Identifies a file's content in the preview cache: its blob hash, or for
+    plain files a digest of name, size and mtime, which is far cheaper than
+    hashing a video"""
+    blob = get_catalog().blob_for(name)
+    if blob is not None:
+        return blob
     stat = os.stat(filepath)
-    return {
-        'name': os.path.basename(filepath),
-        'filesize': stat.st_size,
-        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-        'type': mimetypes.guess_type(filepath)
+    return hashlib.sha1(f'{name}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()
+
+def schedule_preview(name):
+    """Queue preview generation for a newly stored file, never blocks or fails the upload"""
+    try:
+        mime = get_mime_type(name)
+        thumbnailer = get_thumbnailer()
+        if thumbnailer.supported(mime):
+            filepath = resolve_filepath(name)
+            thumbnailer.schedule(preview_key(name, filepath), filepath, mime)
+    except Exception:
+        app.logger.exception('Could not queue preview for %s', name)
+
+def schedule_precompress(name):
+    """Queue gzip/zstd variants of a newly stored compressible file"""
+    try:
+        if is_compressible(get_mime_type(name)):
+            filepath = resolve_filepath(name)
+            get_precompressor().schedule(filepath, os.path.getsize(filepath))
+    except Exception:
+        app.logger.exception('Could not queue compression for %s', name)
+
+def publish_file(filename, write, folder=''):
+    """Store a new file under a free variant of filename, returns the name used.
+
+    write(filepath) puts the bytes in place; the name is reserved in the
+    catalog first so concurrent uploads of the same name can't collide.
+    """
+    catalog = get_catalog()
+    name = catalog.reserve_name(filename, folder)
+    try:
+        write(os.path.join(app.config['UPLOAD_FOLDER'], name))
+    except Exception:
+        catalog.release(name)
+        raise
+    catalog.add(name)
+    schedule_preview(name)
+    schedule_precompress(name)
+    return name
+
+# Held while adding or dropping blob references, so a blob being deleted can't
+# be handed to a new upload at the same time
+blob_lock = threading.Lock()
+
+def blob_path(sha256):
+    return os.path.join(app.config['UPLOAD_FOLDER'], BLOB_FOLDER_NAME, sha256[:2], sha256)
+
+def publish_blob(filename, tmp_path, sha256, folder=''):
+    """Dedup mode: keep a hashed temp file as a blob unless one with the same
+    content exists, and reference it under a free variant of filename"""
+    size = os.path.getsize(tmp_path)
+    with blob_lock:
+        path = blob_path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        name = get_catalog().add_reference(filename, sha256, size, folder)
+    schedule_preview(name)
+    schedule_precompress(name)
+    return name
+
+def remove_blob(sha256):
+    """Delete a blob nothing references any more, and what was made from it"""
+    path = blob_path(sha256)
+    os.remove(path)
+    get_thumbnailer().remove(sha256)
+    get_precompressor().remove(path)
+    delta.remove_signature(path)
+
+def replace_file(name, tmp_path, sha256, basis_etag):
+    """Make tmp_path the new contents of an existing file, unless the file
+    changed since basis_etag. Returns whether it was replaced."""
+    catalog = get_catalog()
+    with blob_lock:
+        filepath = resolve_filepath(name)
+        if not os.path.exists(filepath) or file_etag(os.stat(filepath)) != basis_etag:
+            return False
+
+        if catalog.blob_for(name) is not None:
+            path = blob_path(sha256)
+            size = os.path.getsize(tmp_path)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            orphan = catalog.replace_blob(name, sha256, size)
+            if orphan is not None:
+                remove_blob(orphan)
+        else:
+            old_key = preview_key(name, filepath)
+            os.replace(tmp_path, filepath)
+            catalog.add(name)
+            get_thumbnailer().remove(old_key)
+    schedule_preview(name)
+    schedule_precompress(name)
+    return True
+
+def reference_existing_blob(filename, sha256, folder=''):
+    """Dedup mode: name for a new reference to already stored content, None if it isn't stored"""
+    with blob_lock:
+        size = get_catalog().blob_size(sha256)
+        if size is None or not os.path.exists(blob_path(sha256)):
+            return None
+        return get_catalog().add_reference(filename, sha256, size, folder)
+
+def resolve_filepath(name):
+    """Where a visible file's bytes are: its blob, or the file in the upload folder"""
+    blob = get_catalog().blob_for(name)
+    if blob is not None:
+        return blob_path(blob)
+    return os.path.join(app.config['UPLOAD_FOLDER'], name)
+
+def pending_uploads_dir():
+    return os.path.join(app.config['UPLOAD_FOLDER'], '.uploads')
+
+def pending_upload_path(upload_id, *parts):
+    # upload ids are uuid4 hex, anything else could escape the uploads dir
+    if len(upload_id) != 32 or not all(c in '0123456789abcdef' for c in upload_id):
+        return None
+    return os.path.join(pending_uploads_dir(), upload_id, *parts)
+
+def load_manifest(upload_id):
+    manifest_path = pending_upload_path(upload_id, 'manifest.json')
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def received_chunks(upload_id):
+    return sorted(
+        int(name.split('.')[0])
+        for name in os.listdir(pending_upload_path(upload_id))
+        if name.endswith('.part')
+    )
+
+def expected_chunk_size(manifest, index):
+    if index < manifest['total_chunks'] - 1:
+        return manifest['chunk_size']
+    return manifest['size'] - manifest['chunk_size'] * (manifest['total_chunks'] - 1)
+
+def remove_expired_uploads():
+    pending = pending_uploads_dir()
+    if not os.path.isdir(pending):
+        return
+    cutoff = time.time() - UPLOAD_EXPIRY_SECONDS
+    for upload_id in os.listdir(pending):
+        path = os.path.join(pending, upload_id)
+        if os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+def file_etag(stat):
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+def parse_ranges(header):
+    """[(start, stop or None)] from a Range header, suffix ranges as (-n, None).
+
+    Unlike werkzeug's parser this accepts overlapping and unordered ranges,
+    which browsers and download managers do send. None if malformed.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        first, sep, last = spec.strip().partition('-')
+        if not sep or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+            return None
+        if not first:
+            ranges.append((-int(last), None))
+        elif not last:
+            ranges.append((int(first), None))
+        elif int(last) < int(first):
+            return None
+        else:
+            ranges.append((int(first), int(last) + 1))
+    return ranges
+
+def resolve_ranges(ranges, length):
+    """Satisfiable (start, stop) byte ranges, sorted with overlaps merged"""
+    resolved = []
+    for start, end in ranges:
+        if end is None:
+            end = length
+            if start < 0:
+                start = max(0, start + length)
+        end = min(end, length)
+        if start < end:
+            resolved.append((start, end))
+
+    merged = []
+    for start, end in sorted(resolved):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    if len(merged) > MAX_RANGES:
+        merged = [(merged[0][0], merged[-1][1])]
+    return merged
+
+def if_range_matches(etag, stat):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return int(if_range.date.timestamp()) == int(stat.st_mtime)
+    return True
+
+def negotiate_variant(filepath, stat):
+    """(encoding, path) of the best precompressed copy the client accepts, else (None, None)"""
+    accepted = request.accept_encodings
+    best = (0, None, None)
+    for encoding in ENCODINGS:
+        quality = accepted.quality(encoding)
+        if quality > best[0]:
+            variant = fresh_variant(filepath, encoding, stat)
+            if variant is not None:
+                best = (quality, encoding, variant)
+    return best[1], best[2]
+
+def read_range(filepath, start, end):
+    """Yield bytes [start, end) of a file in COPY_BUFFER_SIZE blocks"""
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = f.read(min(COPY_BUFFER_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+def send_ranges(filepath, name, stat, mimetype, etag, ranges, disposition):
+    """206 response for ranges werkzeug doesn't handle: several ranges in one request"""
+    length = stat.st_size
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+        'Last-Modified': http_date(stat.st_mtime),
+        'Content-Disposition': f'{disposition}; filename="{name}"',
     }
 
+    ranges = resolve_ranges(ranges, length)
+    if not ranges:
+        headers['Content-Range'] = f'bytes */{length}'
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{length}'
+        headers['Content-Length'] = str(end - start)
+        return Response(read_range(filepath, start, end), status=206, mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f'\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n'
+         f'Content-Range: bytes {start}-{end - 1}/{length}\r\n\r\n').encode()
+        for start, end in ranges
+    ]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    headers['Content-Length'] = str(
+        sum(len(part) for part in part_headers) + sum(end - start for start, end in ranges) + len(closing)
+    )
+
+    def generate():
+        for part, (start, end) in zip(part_headers, ranges):
+            yield part
+            yield from read_range(filepath, start, end)
+        yield closing
+
+    return Response(generate(), status=206, headers=headers, direct_passthrough=True,
+                    content_type=f'multipart/byteranges; boundary={boundary}')
+
+class ZipStream:
+    """Write-only, unseekable file object collecting what ZipFile writes, so
+    the archive can be sent piece by piece as it is built"""
+
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def zip_chunks(entries):
+    """Yield a ZIP of (arcname, filepath) entries, holding at most one buffer of file data"""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESS_LEVEL) as zf:
+        for arcname, filepath in entries:
+            info = zipfile.ZipInfo.from_file(filepath, arcname=arcname)
+            ext = os.path.splitext(arcname)[1].lower().lstrip('.')
+            info.compress_type = zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            # sizes are known up front, so ZIP64 is only used where needed
+            with open(filepath, 'rb') as src, zf.open(info, 'w') as dest:
+                for block in iter(lambda: src.read(COPY_BUFFER_SIZE), b''):
+                    dest.write(block)
+                    data = stream.drain()
+                    if data:
+                        yield data
+            yield stream.drain()
+    yield stream.drain()
+
+def add_thumbnails(files):
+    # Previews are referenced, not waited for: the thumbnail URL answers
+    # 202 until the worker has made it
+    thumbnailer = get_thumbnailer()
+    for file in files:
+        if thumbnailer.supported(file['type']):
+            file['thumbnail'] = f"/api/thumbnail/{file['name']}?v={file['modified']}"
+
+def parse_date(value):
+    """Timestamp for an ISO date or datetime query parameter, None if absent"""
+    if not value:
+        return None
+    return datetime.fromisoformat(value).timestamp()
+
 @app.errorhandler(413)
 def file_too_big(error):
     return jsonify({'success': False, 'error': 'File too big'}), 413
@@ -59,71 +498,662 @@ def upload_file():
             return jsonify({'success': False, 'error': 'File type not allowed'}), 400
         
         filename = secure_filename(file.filename)
+        name_transfer(filename)
+        folder = clean_folder(request.form.get('folder'))
+        if folder is None:
+            return jsonify({'success': False, 'error': 'Invalid folder'}), 400
 
         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        original_filepath = filepath
-        counter = 1
-        
-        while os.path.exists(filepath):
-            name, ext = os.path.splitext(original_filepath)
-            filepath = f"{name}_{counter}{ext}"
-            counter += 1
-
-        file.save(filepath)
+        if app.config['DEDUP']:
+            # hash while writing, the blob's name is only known at the end
+            tmp_dir = os.path.join(app.config['UPLOAD_FOLDER'], BLOB_FOLDER_NAME, 'tmp')
+            os.makedirs(tmp_dir, exist_ok=True)
+            tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+            digest = hashlib.sha256()
+            with open(tmp_path, 'wb') as f:
+                for block in iter(lambda: file.stream.read(COPY_BUFFER_SIZE), b''):
+                    digest.update(block)
+                    f.write(block)
+            name = publish_blob(filename, tmp_path, digest.hexdigest(), folder)
+        else:
+            name = publish_file(filename, file.save, folder)
 
         return jsonify({
             'success': True,
             'message': 'File uploaded successfully',
-            'filename': os.path.basename(filepath)
+            'filename': name
         })
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
     
+@app.route('/api/uploads', methods=['POST'])
+def init_upload():
+    """Start a chunked upload: {filename, size, chunk_size?, sha256?} -> upload_id"""
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get('filename') or '')
+        size = data.get('size')
+        chunk_size = data.get('chunk_size') or CHUNK_SIZE
+        folder = clean_folder(data.get('folder'))
+
+        if not filename:
+            return jsonify({'success': False, 'error': 'No file provided'}), 400
+        if folder is None:
+            return jsonify({'success': False, 'error': 'Invalid folder'}), 400
+        if not allowed_file(filename):
+            return jsonify({'success': False, 'error': 'File type not allowed'}), 400
+        if not isinstance(size, int) or size < 0:
+            return jsonify({'success': False, 'error': 'Invalid size'}), 400
+        if size > MAX_FILE_SIZE:
+            return jsonify({'success': False, 'error': 'File too big'}), 413
+        if not isinstance(chunk_size, int) or not 0 < chunk_size <= MAX_CHUNK_SIZE:
+            return jsonify({'success': False, 'error': 'Invalid chunk size'}), 400
+
+        sha256 = (data.get('sha256') or '').lower() or None
+        if app.config['DEDUP'] and sha256:
+            # Content we already have: reference it, the bytes never need to be sent
+            name = reference_existing_blob(filename, sha256, folder)
+            if name is not None:
+                return jsonify({
+                    'success': True,
+                    'duplicate': True,
+                    'message': 'File uploaded successfully',
+                    'filename': name,
+                    'sha256': sha256,
+                })
+
+        remove_expired_uploads()
+
+        upload_id = uuid.uuid4().hex
+        manifest = {
+            'filename': filename,
+            'size': size,
+            'chunk_size': chunk_size,
+            'total_chunks': max(1, -(-size // chunk_size)),
+            'sha256': sha256,
+            'folder': folder,
+            'created': datetime.now().isoformat(),
+        }
+        os.makedirs(pending_upload_path(upload_id))
+        with open(pending_upload_path(upload_id, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
+        return jsonify({
+            'success': True,
+            'upload_id': upload_id,
+            'chunk_size': chunk_size,
+            'total_chunks': manifest['total_chunks'],
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """Store one chunk; chunks may arrive in any order and be resent"""
+    try:
+        manifest = load_manifest(upload_id)
+        if manifest is None:
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+        if not 0 <= index < manifest['total_chunks']:
+            return jsonify({'success': False, 'error': 'Invalid chunk index'}), 400
+        name_transfer(f"{manifest['filename']} ({index + 1}/{manifest['total_chunks']})")
+
+        expected_size = expected_chunk_size(manifest, index)
+        expected_sha256 = (request.headers.get('X-Chunk-Sha256') or '').lower()
+
+        # Stream the body to a temp file, the chunk only counts once renamed
+        chunk_path = pending_upload_path(upload_id, f'{index}.part')
+        tmp_path = f'{chunk_path}.{uuid.uuid4().hex}.tmp'
+        digest = hashlib.sha256()
+        written = 0
+        with open(tmp_path, 'wb') as f:
+            while True:
+                block = request.stream.read(COPY_BUFFER_SIZE)
+                if not block:
+                    break
+                written += len(block)
+                if written > expected_size:
+                    break
+                digest.update(block)
+                f.write(block)
+
+        if written != expected_size:
+            os.remove(tmp_path)
+            return jsonify({'success': False, 'error': f'Chunk {index} should be {expected_size} bytes'}), 400
+        if expected_sha256 and digest.hexdigest() != expected_sha256:
+            os.remove(tmp_path)
+            return jsonify({'success': False, 'error': f'Chunk {index} checksum mismatch'}), 400
+
+        os.replace(tmp_path, chunk_path)
+        return jsonify({'success': True, 'index': index})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    """Which chunks the server has, so an interrupted upload can resume"""
+    try:
+        manifest = load_manifest(upload_id)
+        if manifest is None:
+            return jsonify({'success': False, 'error': 'Upload not found'}), 404
+
+        received = received_chunks(upload_id)
+        return jsonify({
+            'success': True,
+            'filename': manifest['filename'],
+            'size': manifest['size'],
+            'chunk_size': manifest['chunk_size'],
+            'total_chunks': manifest['total_chunks'],
+            'received': received,
+            'missing': sorted(set(range(manifest['total_chunks'])) - set(received)),
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# /complete holds its upload's lock, so a client retrying after a timeout
+# waits for the first call instead of assembling the same chunks again, and
+# then gets the result the first call published. Uploads share a fixed set
+# of locks, so nothing has to be cleaned up per upload id.
+_completing_locks = [threading.Lock() for _ in range(64)]
+_completed_lock = threading.Lock()
+completed_uploads = OrderedDict()
+COMPLETED_UPLOADS_KEPT = 256
+
+def upload_lock(upload_id):
+    return _completing_locks[hash(upload_id) % len(_completing_locks)]
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Assemble the chunks, verify the sha256 if one was given and publish the file"""
+    try:
+        with upload_lock(upload_id):
+            result = completed_uploads.get(upload_id)
+            if result is None:
+                result, status = assemble_upload(upload_id)
+                if status != 200:
+                    return jsonify(result), status
+                with _completed_lock:
+                    completed_uploads[upload_id] = result
+                    while len(completed_uploads) > COMPLETED_UPLOADS_KEPT:
+                        completed_uploads.popitem(last=False)
+        return jsonify(result)
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def assemble_upload(upload_id):
+    """(response, status) of completing an upload, see complete_upload"""
+    manifest = load_manifest(upload_id)
+    if manifest is None:
+        return {'success': False, 'error': 'Upload not found'}, 404
+
+    data = request.get_json(silent=True) or {}
+    expected_sha256 = (data.get('sha256') or manifest['sha256'] or '').lower()
+
+    missing = sorted(set(range(manifest['total_chunks'])) - set(received_chunks(upload_id)))
+    if missing:
+        return {'success': False, 'error': 'Missing chunks', 'missing': missing}, 409
+
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=pending_upload_path(upload_id))
+    try:
+        digest = hashlib.sha256()
+        with open(fd, 'wb') as out:
+            for index in range(manifest['total_chunks']):
+                with open(pending_upload_path(upload_id, f'{index}.part'), 'rb') as chunk:
+                    while True:
+                        block = chunk.read(COPY_BUFFER_SIZE)
+                        if not block:
+                            break
+                        digest.update(block)
+                        out.write(block)
+
+        sha256 = digest.hexdigest()
+        if expected_sha256 and sha256 != expected_sha256:
+            return {'success': False, 'error': 'Checksum mismatch', 'sha256': sha256}, 400
+
+        if app.config['DEDUP']:
+            name = publish_blob(manifest['filename'], tmp_path, sha256, manifest.get('folder', ''))
+        else:
+            name = publish_file(manifest['filename'], lambda filepath: os.replace(tmp_path, filepath),
+                                manifest.get('folder', ''))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    shutil.rmtree(pending_upload_path(upload_id), ignore_errors=True)
+
+    return {
+        'success': True,
+        'message': 'File uploaded successfully',
+        'filename': name,
+        'sha256': sha256,
+    }, 200
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    path = pending_upload_path(upload_id)
+    if path is None or not os.path.isdir(path):
+        return jsonify({'success': False, 'error': 'Upload not found'}), 404
+
+    shutil.rmtree(path, ignore_errors=True)
+    return jsonify({'success': True, 'message': 'Upload aborted'})
+
 @app.route('/api/files', methods=['GET'])
 def list_files():
+    """Paginated listing from the catalog:
+    ?page=&per_page=&sort=modified|name|size|type&order=&type=&folder=
+
+    Without folder, files in every folder are listed.
+    """
     try:
-        if not os.path.exists(app.config['UPLOAD_FOLDER']):
-            return jsonify({'files': []})
-        
-        files = []
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-            if allowed_file(filename):
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if os.path.isfile(filepath):
-                    files.append(get_file_info(filepath))
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 100, type=int), 1), MAX_PAGE_SIZE)
+        folder = None
+        if 'folder' in request.args:
+            folder = clean_folder(request.args['folder'])
+            if folder is None:
+                return jsonify({'error': 'Invalid folder'}), 400
 
-        files.sort(key=lambda x: x['modified'], reverse=True)
+        files, total = get_catalog().list(
+            page=page,
+            per_page=per_page,
+            sort=request.args.get('sort', 'modified'),
+            order=request.args.get('order', 'desc'),
+            file_type=request.args.get('type'),
+            folder=folder,
+        )
+        add_thumbnails(files)
 
-        return jsonify({'files': files})
+        return jsonify({'files': files, 'total': total, 'page': page, 'per_page': per_page})
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search', methods=['GET'])
+def search_files():
+    """Indexed search over names and metadata:
+    ?q=&match=substring|prefix&type=&after=&before=&min_size=&max_size=&folder=
+    &page=&per_page=&sort=&order=
+
+    after/before are ISO dates; folder includes the folders inside it.
+    """
+    try:
+        started = time.perf_counter()
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 100, type=int), 1), MAX_PAGE_SIZE)
+        folder = clean_folder(request.args.get('folder'))
+        if folder is None:
+            return jsonify({'error': 'Invalid folder'}), 400
+        try:
+            after = parse_date(request.args.get('after'))
+            before = parse_date(request.args.get('before'))
+        except ValueError:
+            return jsonify({'error': 'Dates must be ISO 8601, e.g. 2024-05-31'}), 400
+
+        # stored names went through secure_filename, so search for what it would make of the query
+        query = request.args.get('q', '').strip().replace(' ', '_')
+        files, total = get_catalog().search(
+            query=query,
+            match='prefix' if request.args.get('match') == 'prefix' else 'substring',
+            file_type=request.args.get('type'),
+            after=after,
+            before=before,
+            min_size=request.args.get('min_size', type=int),
+            max_size=request.args.get('max_size', type=int),
+            folder=folder,
+            page=page,
+            per_page=per_page,
+            sort=request.args.get('sort', 'modified'),
+            order=request.args.get('order', 'desc'),
+        )
+        add_thumbnails(files)
+
+        return jsonify({
+            'files': files,
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'took_ms': round((time.perf_counter() - started) * 1000, 2),
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/folders', methods=['GET'])
+def list_folders():
+    """Folders directly inside ?parent= (default: the top level)"""
+    try:
+        parent = clean_folder(request.args.get('parent'))
+        if parent is None:
+            return jsonify({'error': 'Invalid folder'}), 400
+        catalog = get_catalog()
+        if not catalog.folder_exists(parent):
+            return jsonify({'error': 'Folder not found'}), 404
+        return jsonify({'parent': parent, 'folders': catalog.subfolders(parent)})
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/folders', methods=['POST'])
+def create_folder():
+    """Create {path}, and its parents as needed"""
+    try:
+        path = clean_folder((request.get_json(silent=True) or {}).get('path'))
+        if not path:
+            return jsonify({'success': False, 'error': 'Invalid folder'}), 400
+        if not get_catalog().create_folder(path):
+            return jsonify({'success': False, 'error': 'Folder already exists'}), 409
+        return jsonify({'success': True, 'path': path}), 201
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/folders', methods=['DELETE'])
+def delete_folder():
+    """Remove the empty folder ?path="""
+    try:
+        path = clean_folder(request.args.get('path'))
+        if not path:
+            return jsonify({'success': False, 'error': 'Invalid folder'}), 400
+        error = get_catalog().delete_folder(path)
+        if error is not None:
+            return jsonify({'success': False, 'error': error}), 404 if error == 'Folder not found' else 409
+        return jsonify({'success': True, 'message': 'Folder deleted successfully'})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/folders/move', methods=['POST'])
+def move_folder():
+    """Rename or move a folder with all it contains: {path, to}"""
+    try:
+        data = request.get_json(silent=True) or {}
+        path = clean_folder(data.get('path'))
+        new_path = clean_folder(data.get('to'))
+        if not path or not new_path:
+            return jsonify({'success': False, 'error': 'Invalid folder'}), 400
+        error = get_catalog().move_folder(path, new_path)
+        if error is not None:
+            return jsonify({'success': False, 'error': error}), 404 if error == 'Folder not found' else 409
+        return jsonify({'success': True, 'path': new_path})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/move', methods=['POST'])
+def move_files():
+    """Put files in a folder: {files: [name, ...], folder}; '' is the top level"""
+    try:
+        data = request.get_json(silent=True) or {}
+        names = [secure_filename(name) for name in data.get('files') or []]
+        folder = clean_folder(data.get('folder'))
+        if not names:
+            return jsonify({'success': False, 'error': 'No files selected'}), 400
+        if folder is None:
+            return jsonify({'success': False, 'error': 'Invalid folder'}), 400
+        moved = get_catalog().move_files(names, folder)
+        return jsonify({'success': True, 'moved': moved, 'folder': folder})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/rename/<filename>', methods=['POST'])
+def rename_file(filename):
+    """Give a file a new name: {name}. Names are unique across all folders."""
+    try:
+        name = secure_filename(filename)
+        new_name = secure_filename((request.get_json(silent=True) or {}).get('name') or '')
+        catalog = get_catalog()
+
+        if catalog.get(name) is None:
+            return jsonify({'success': False, 'error': 'File not found'}), 404
+        if not new_name or not allowed_file(new_name):
+            return jsonify({'success': False, 'error': 'File type not allowed'}), 400
+        if new_name == name:
+            return jsonify({'success': True, 'filename': name})
+
+        with blob_lock:
+            plain = catalog.blob_for(name) is None
+            if plain:
+                filepath = os.path.join(app.config['UPLOAD_FOLDER'], name)
+                key = preview_key(name, filepath)
+            if not catalog.rename(name, new_name):
+                return jsonify({'success': False, 'error': 'A file with that name exists'}), 409
+            if plain:
+                try:
+                    os.rename(filepath, os.path.join(app.config['UPLOAD_FOLDER'], new_name))
+                except Exception:
+                    catalog.rename(new_name, name)
+                    raise
+                # previews and variants of plain files go by name
+                get_thumbnailer().remove(key)
+                get_precompressor().remove(filepath)
+                delta.remove_signature(filepath)
+
+        if plain:
+            schedule_preview(new_name)
+            schedule_precompress(new_name)
+        return jsonify({'success': True, 'filename': new_name})
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
     
 @app.route('/api/download/<filename>')
 def download_file(filename):
+    """Download a file, or play it in the browser with ?inline=1.
+
+    Supports conditional requests (ETag/Last-Modified) and single or multiple
+    byte ranges, so media can seek and interrupted downloads can resume.
+    Whole files go through the server's wsgi.file_wrapper, which gunicorn
+    turns into sendfile(2); ranges are read in fixed-size blocks.
+    """
     try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
+        name = secure_filename(filename)
+        filepath = resolve_filepath(name)
 
         if not os.path.exists(filepath):
             return jsonify({'error': 'File not found'}), 404
-        
-        return send_file(filepath, as_attachment=True)
-    
+
+        stat = os.stat(filepath)
+        etag = file_etag(stat)
+        mimetype = get_mime_type(name)
+        if mimetype == 'unknown':
+            mimetype = 'application/octet-stream'
+        inline = request.args.get('inline') == '1'
+
+        ranges = parse_ranges(request.headers.get('Range'))
+        if ranges is not None and len(ranges) > 1:
+            last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                return Response(status=304, headers={'ETag': f'"{etag}"'})
+            if if_range_matches(etag, stat):
+                return send_ranges(filepath, name, stat, mimetype, etag, ranges,
+                                   'inline' if inline else 'attachment')
+            # If-Range mismatch: the file changed, send all of it
+            del request.environ['HTTP_RANGE']
+
+        vary = is_compressible(mimetype)
+        if vary and 'HTTP_RANGE' not in request.environ:
+            encoding, variant = negotiate_variant(filepath, stat)
+            if variant is not None:
+                response = send_file(variant, mimetype=mimetype, as_attachment=not inline, download_name=name,
+                                     conditional=True, etag=f'{etag}-{encoding}', last_modified=stat.st_mtime,
+                                     max_age=0)
+                response.headers['Content-Encoding'] = encoding
+                response.headers['Vary'] = 'Accept-Encoding'
+                return response
+
+        response = send_file(filepath, mimetype=mimetype, as_attachment=not inline, download_name=name,
+                             conditional=True, etag=etag, last_modified=stat.st_mtime, max_age=0)
+        if vary:
+            response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    except HTTPException as e:
+        # 416 for an unsatisfiable single range
+        return e
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
+@app.route('/api/download-zip', methods=['GET', 'POST'])
+def download_zip():
+    """Stream the files named by repeated `files` parameters as one ZIP.
+
+    Nothing is staged: no temp file, no archive in memory, so selections of
+    any size are fine.
+    """
+    try:
+        names = list(dict.fromkeys(secure_filename(name) for name in request.values.getlist('files')))
+        if not names:
+            return jsonify({'error': 'No files selected'}), 400
+        if len(names) > MAX_ZIP_FILES:
+            return jsonify({'error': f'At most {MAX_ZIP_FILES} files per archive'}), 400
+
+        entries = []
+        for name in names:
+            filepath = resolve_filepath(name)
+            if not os.path.isfile(filepath):
+                return jsonify({'error': f'File not found: {name}'}), 404
+            entries.append((name, filepath))
+
+        archive_name = secure_filename(request.values.get('name') or '') or 'pi-cloud'
+        name_transfer(f'{archive_name}.zip')
+        return Response(
+            zip_chunks(entries),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{archive_name}.zip"'},
+            direct_passthrough=True,
+        )
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/signature/<filename>')
+def file_signature(filename):
+    """Block signature of a stored file for delta uploads (see delta.py).
+
+    The ETag names the version it describes; send it back as If-Match with
+    the delta.
+    """
+    try:
+        name = secure_filename(filename)
+        filepath = resolve_filepath(name)
+
+        if not os.path.exists(filepath):
+            return jsonify({'error': 'File not found'}), 404
+
+        stat = os.stat(filepath)
+        signature = delta.fresh_signature(filepath, stat) or delta.write_signature(filepath)
+        return send_file(signature, mimetype='application/octet-stream', conditional=True,
+                         etag=file_etag(stat), last_modified=stat.st_mtime, max_age=0)
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/delta/<filename>', methods=['POST'])
+def upload_delta(filename):
+    """Replace a stored file with a new version described by a delta
+    against its signature. The new version is built beside the old one
+    and swapped in only if it is complete and the old one didn't change."""
+    tmp_path = None
+    try:
+        name = secure_filename(filename)
+        filepath = resolve_filepath(name)
+
+        if not os.path.exists(filepath):
+            return jsonify({'success': False, 'error': 'File not found'}), 404
+        basis_etag = (request.headers.get('If-Match') or '').strip('"')
+        if not basis_etag:
+            return jsonify({'success': False, 'error': 'If-Match with the signature ETag is required'}), 428
+        if file_etag(os.stat(filepath)) != basis_etag:
+            return jsonify({'success': False, 'error': 'File changed, fetch a new signature'}), 412
+
+        if get_catalog().blob_for(name) is not None:
+            tmp_dir = os.path.join(app.config['UPLOAD_FOLDER'], BLOB_FOLDER_NAME, 'tmp')
+            os.makedirs(tmp_dir, exist_ok=True)
+            tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        else:
+            tmp_path = f'{filepath}.{uuid.uuid4().hex}.tmp'
+
+        try:
+            with open(tmp_path, 'wb') as out:
+                size, sha256, copied, literal = delta.apply_delta(filepath, request.stream, out)
+        except delta.DeltaError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        expected_sha256 = (request.headers.get('X-Content-Sha256') or '').lower()
+        if expected_sha256 and sha256 != expected_sha256:
+            return jsonify({'success': False, 'error': 'Checksum mismatch, upload the whole file'}), 400
+
+        if not replace_file(name, tmp_path, sha256, basis_etag):
+            return jsonify({'success': False, 'error': 'File changed, fetch a new signature'}), 412
+
+        return jsonify({
+            'success': True,
+            'message': 'File updated successfully',
+            'filename': name,
+            'size': size,
+            'sha256': sha256,
+            'copied': copied,
+            'literal': literal,
+        })
+
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@app.route('/api/thumbnail/<filename>')
+def thumbnail(filename):
+    """Cached preview image, or 202 while it is being generated"""
+    try:
+        name = secure_filename(filename)
+        filepath = resolve_filepath(name)
+        if not os.path.exists(filepath):
+            return jsonify({'error': 'File not found'}), 404
+
+        thumbnailer = get_thumbnailer()
+        key = preview_key(name, filepath)
+        cached = thumbnailer.cached(key)
+        if cached is not None:
+            # the URL changes with the file, so the preview can be cached for long
+            return send_file(cached, mimetype='image/jpeg', max_age=7 * 24 * 3600)
+
+        if not thumbnailer.schedule(key, filepath, get_mime_type(name)):
+            return jsonify({'error': 'No preview available'}), 404
+        return jsonify({'pending': True}), 202, {'Retry-After': '2'}
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/delete/<filename>', methods=['DELETE'])
 def delete_file(filename):
     try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
+        name = secure_filename(filename)
+        catalog = get_catalog()
+
+        if catalog.blob_for(name) is not None:
+            with blob_lock:
+                orphan = catalog.remove(name)
+                if orphan is not None:
+                    remove_blob(orphan)
+            return jsonify({'success': True, 'message': 'File deleted successfully'})
 
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], name)
         if not os.path.exists(filepath):
             return jsonify({'success': False, 'error': 'File not found'}), 404
         
+        key = preview_key(name, filepath)
         os.remove(filepath)
+        catalog.remove(name)
+        get_thumbnailer().remove(key)
+        get_precompressor().remove(filepath)
+        delta.remove_signature(filepath)
         return jsonify({'success': True, 'message': 'File deleted successfully'})
     
     except Exception as e:
@@ -140,6 +1170,29 @@ def health_check():
         'upload_folder': app.config['UPLOAD_FOLDER']
     })    
 
+@app.route('/api/metrics')
+def get_metrics():
+    """Transfers in flight, throughput and totals since start, and storage
+    use per type from the catalog's running counts"""
+    try:
+        disk_usage = os.statvfs(app.config['UPLOAD_FOLDER'] or '.')
+        usage = get_catalog().usage()
+        return jsonify({
+            'transfers': transfers.snapshot(),
+            'storage': {
+                'by_type': usage,
+                'files': sum(entry['files'] for entry in usage),
+                'bytes': sum(entry['bytes'] for entry in usage),
+            },
+            'disk': {
+                'total_bytes': disk_usage.f_frsize * disk_usage.f_blocks,
+                'free_bytes': disk_usage.f_frsize * disk_usage.f_bavail,
+            },
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 
 if __name__ == '__main__':
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -0,0 +1,423 @@
+"""Async serving mode: Pi_Cloud as an ASGI app for many slow clients.
+
+With the built-in server every transfer holds a thread for its whole life,
+so a few phones streaming videos block the listing page for everyone. Here
+connections live on one event loop and only borrow a thread for a moment:
+
+- Flask still handles every /api route, in a small thread pool, and its
+  response is sent one block at a time, reading the next block only after
+  the previous one went out. A slow client costs a socket and one block of
+  memory, not a thread.
+- Request bodies are received into a spool file before Flask sees them, so
+  a slow uploader doesn't hold a thread either. Uploads skip the spool:
+  chunk PUTs are streamed straight to their .part file, and the file of a
+  multipart POST /api/upload to a temp file beside its final place, so its
+  bytes are written once and then renamed.
+
+Run with an ASGI server (pip install uvicorn):
+
+    python asgi.py
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from werkzeug.utils import secure_filename
+from werkzeug.wsgi import FileWrapper
+
+import app as pi_cloud
+from metrics import transfer_kind
+
+flask_app = pi_cloud.app
+
+# Threads only do short bursts of work: routing, catalog lookups, one block of I/O
+THREADS = 16
+# Blocks read from files and sent to clients, and spooled from request bodies
+BLOCK_SIZE = 256 * 1024
+# Request bodies up to this size stay in memory, bigger ones go to disk; also
+# the most a multipart upload's form fields may hold
+SPOOL_MEMORY_SIZE = 1024 * 1024
+SPOOL_FOLDER_NAME = '.spool'
+
+CHUNK_PUT = re.compile(r'^/api/uploads/([^/]+)/chunks/(\d+)$')
+UPLOAD_POST = '/api/upload'
+
+executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix='pi-cloud')
+
+async def run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+def header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def receive_blocks(receive, transfer=None):
+    """Yield the request body in blocks of about BLOCK_SIZE.
+
+    The next message is only received once the caller is done with a block,
+    so the server stops reading from a client that sends faster than the
+    disk writes.
+    """
+    buffer = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise ConnectionResetError('Client disconnected')
+        body = message.get('body', b'')
+        if transfer is not None:
+            pi_cloud.transfers.add(transfer, len(body))
+        buffer += body
+        more = message.get('more_body', False)
+        if len(buffer) >= BLOCK_SIZE or not more and buffer:
+            yield bytes(buffer)
+            buffer.clear()
+        if not more:
+            return
+
+async def put_chunk(scope, receive, send, upload_id, index):
+    """PUT /api/uploads/<id>/chunks/<index> without a thread per upload;
+    same checks and responses as app.upload_chunk"""
+    manifest = await run(pi_cloud.load_manifest, upload_id)
+    if manifest is None:
+        return await send_json(send, 404, {'success': False, 'error': 'Upload not found'})
+    if not 0 <= index < manifest['total_chunks']:
+        return await send_json(send, 400, {'success': False, 'error': 'Invalid chunk index'})
+
+    expected_size = pi_cloud.expected_chunk_size(manifest, index)
+    expected_sha256 = (header(scope, b'x-chunk-sha256') or '').lower()
+
+    chunk_path = pi_cloud.pending_upload_path(upload_id, f'{index}.part')
+    tmp_path = f'{chunk_path}.{uuid.uuid4().hex}.tmp'
+    digest = hashlib.sha256()
+    written = 0
+    transfer = pi_cloud.transfers.start(
+        'upload', f"{manifest['filename']} ({index + 1}/{manifest['total_chunks']})", expected_size
+    )
+    f = await run(open, tmp_path, 'wb')
+    try:
+        async for block in receive_blocks(receive, transfer):
+            written += len(block)
+            if written > expected_size:
+                break
+            digest.update(block)
+            await run(f.write, block)
+    except BaseException:
+        pi_cloud.transfers.finish(transfer, completed=False)
+        await run(f.close)
+        await run(os.remove, tmp_path)
+        raise
+    await run(f.close)
+    pi_cloud.transfers.finish(transfer, completed=written == expected_size)
+
+    if written != expected_size:
+        await run(os.remove, tmp_path)
+        return await send_json(send, 400, {'success': False, 'error': f'Chunk {index} should be {expected_size} bytes'})
+    if expected_sha256 and digest.hexdigest() != expected_sha256:
+        await run(os.remove, tmp_path)
+        return await send_json(send, 400, {'success': False, 'error': f'Chunk {index} checksum mismatch'})
+
+    await run(os.replace, tmp_path, chunk_path)
+    await send_json(send, 200, {'success': True, 'index': index})
+
+def upload_tmp_path():
+    """A fresh temp file on the same disk as where an upload ends up: the
+    blob store's tmp folder in dedup mode, the spool folder otherwise"""
+    if flask_app.config['DEDUP']:
+        folder = os.path.join(flask_app.config['UPLOAD_FOLDER'], pi_cloud.BLOB_FOLDER_NAME, 'tmp')
+    else:
+        folder = os.path.join(flask_app.config['UPLOAD_FOLDER'], SPOOL_FOLDER_NAME)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, uuid.uuid4().hex)
+
+def publish_upload(filename, tmp_path, sha256, folder):
+    if flask_app.config['DEDUP']:
+        return pi_cloud.publish_blob(filename, tmp_path, sha256, folder)
+    return pi_cloud.publish_file(filename, lambda filepath: os.replace(tmp_path, filepath), folder)
+
+async def multipart_events(receive, boundary, transfer):
+    """Yield the events of a multipart/form-data body as its blocks arrive,
+    up to the closing boundary. Raises RequestEntityTooLarge past
+    MAX_CONTENT_LENGTH."""
+    limit = flask_app.config.get('MAX_CONTENT_LENGTH')
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    size = 0
+    async for block in receive_blocks(receive, transfer):
+        size += len(block)
+        if limit is not None and size > limit:
+            raise RequestEntityTooLarge()
+        decoder.receive_data(block)
+        event = decoder.next_event()
+        while not isinstance(event, NeedData):
+            if isinstance(event, Epilogue):
+                return
+            yield event
+            event = decoder.next_event()
+
+async def post_upload(scope, receive, send):
+    """POST /api/upload with the file written to disk once, as it arrives,
+    instead of spooled and then parsed into another temp file by Flask;
+    same checks and responses as app.upload_file"""
+    limit = flask_app.config.get('MAX_CONTENT_LENGTH')
+    declared = header(scope, b'content-length')
+    if limit is not None and declared is not None and int(declared) > limit:
+        return await send_json(send, 413, {'success': False, 'error': 'File too big'})
+    mimetype, options = parse_options_header(header(scope, b'content-type'))
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        return await send_json(send, 400, {'success': False, 'error': 'Nofile provided'})
+
+    transfer = pi_cloud.transfers.start('upload', UPLOAD_POST.rsplit('/', 1)[-1],
+                                        int(declared) if declared else None)
+    completed = False
+    form = {}
+    # where the Data events of the current part go: the upload's file, a
+    # field's bytearray, or None for parts that aren't used
+    part = None
+    filename = tmp_path = f = None
+    received = False
+    digest = hashlib.sha256()
+    try:
+        try:
+            async for event in multipart_events(receive, options['boundary'], transfer):
+                if isinstance(event, File):
+                    part = None
+                    if event.name != 'file' or f is not None:
+                        continue
+                    if event.filename == '':
+                        return await send_json(send, 400, {'success': False, 'error': 'No file provided'})
+                    if not pi_cloud.allowed_file(event.filename):
+                        return await send_json(send, 400, {'success': False, 'error': 'File type not allowed'})
+                    filename = secure_filename(event.filename)
+                    transfer.name = filename
+                    tmp_path = await run(upload_tmp_path)
+                    part = f = await run(open, tmp_path, 'wb')
+                elif isinstance(event, Field):
+                    part = bytearray()
+                    form.setdefault(event.name, part)
+                elif isinstance(event, Data) and part is not None:
+                    if part is f:
+                        digest.update(event.data)
+                        await run(f.write, event.data)
+                        received = received or not event.more_data
+                    else:
+                        if len(part) + len(event.data) > SPOOL_MEMORY_SIZE:
+                            raise RequestEntityTooLarge()
+                        part += event.data
+        except RequestEntityTooLarge:
+            return await send_json(send, 413, {'success': False, 'error': 'File too big'})
+        if f is not None:
+            await run(f.close)
+
+        # like Flask, a part cut off by the end of the body doesn't count
+        if not received:
+            return await send_json(send, 400, {'success': False, 'error': 'Nofile provided'})
+        folder = pi_cloud.clean_folder(bytes(form.get('folder', b'')).decode('utf-8', 'replace'))
+        if folder is None:
+            return await send_json(send, 400, {'success': False, 'error': 'Invalid folder'})
+
+        name = await run(publish_upload, filename, tmp_path, digest.hexdigest(), folder)
+        completed = True
+    finally:
+        pi_cloud.transfers.finish(transfer, completed=completed)
+        if f is not None:
+            await run(f.close)
+            if not completed and await run(os.path.exists, tmp_path):
+                await run(os.remove, tmp_path)
+
+    await send_json(send, 200, {
+        'success': True,
+        'message': 'File uploaded successfully',
+        'filename': name
+    })
+
+def spool_file():
+    folder = os.path.join(flask_app.config['UPLOAD_FOLDER'], SPOOL_FOLDER_NAME)
+    os.makedirs(folder, exist_ok=True)
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE, dir=folder)
+
+async def spool_body(scope, receive, transfer=None):
+    """The whole request body in a rewound spool file, None if it's too big"""
+    limit = flask_app.config.get('MAX_CONTENT_LENGTH')
+    declared = header(scope, b'content-length')
+    if limit is not None and declared is not None and int(declared) > limit:
+        return None
+
+    spool = await run(spool_file)
+    try:
+        size = 0
+        async for block in receive_blocks(receive, transfer):
+            size += len(block)
+            if limit is not None and size > limit:
+                await run(spool.close)
+                return None
+            await run(spool.write, block)
+        await run(spool.seek, 0)
+    except BaseException:
+        await run(spool.close)
+        raise
+    return spool, size
+
+def wsgi_environ(scope, body, size):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        # send_file's default 8 KiB blocks would mean a thread hop per 8 KiB
+        'wsgi.file_wrapper': lambda file, buffer_size=BLOCK_SIZE: FileWrapper(file, BLOCK_SIZE),
+    }
+    server = scope.get('server') or ('localhost', 80)
+    environ['SERVER_NAME'], environ['SERVER_PORT'] = server[0], str(server[1])
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+
+    for key, value in scope['headers']:
+        name = key.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name != 'CONTENT_TYPE':
+            name = f'HTTP_{name}'
+        environ[name] = f'{environ[name]},{value}' if name in environ else value
+    return environ
+
+def call_flask(environ):
+    """Run the Flask app up to the point where it returns its body iterable"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    body = flask_app(environ, start_response)
+    return started['status'], started['headers'], body
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def bridge(scope, receive, send):
+    """Any other request: spool the body, let Flask handle it, stream its response"""
+    # uploads are counted as they arrive, not when Flask reads the spool
+    transfer = None
+    if transfer_kind({'PATH_INFO': scope['path'], 'REQUEST_METHOD': scope['method']}) == 'upload':
+        declared = header(scope, b'content-length')
+        transfer = pi_cloud.transfers.start('upload', secure_filename(scope['path'].rsplit('/', 1)[-1]),
+                                            int(declared) if declared else None)
+    try:
+        spooled = await spool_body(scope, receive, transfer)
+    except BaseException:
+        if transfer is not None:
+            pi_cloud.transfers.finish(transfer, completed=False)
+        raise
+    if spooled is None:
+        if transfer is not None:
+            pi_cloud.transfers.finish(transfer, completed=False)
+        return await send_json(send, 413, {'success': False, 'error': 'File too big'})
+    spool, size = spooled
+
+    # once the body is read, receive() only returns when the client goes away
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    body = None
+    try:
+        environ = wsgi_environ(scope, spool, size)
+        if transfer is not None:
+            environ['pi_cloud.input_metered'] = True
+            environ['pi_cloud.transfer'] = transfer
+        status, headers, body = await run(call_flask, environ)
+        if transfer is not None:
+            pi_cloud.transfers.finish(transfer, completed=status < 400)
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+
+        blocks = iter(body)
+        while not disconnected.done():
+            # one block in memory per connection: read it, send it, then the next
+            block = await run(next, blocks, None)
+            if block is None:
+                break
+            if block:
+                await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        if body is not None and hasattr(body, 'close'):
+            await run(body.close)
+        await run(spool.close)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    match = CHUNK_PUT.match(scope['path'])
+    if match and scope['method'] == 'PUT':
+        try:
+            return await put_chunk(scope, receive, send, match.group(1), int(match.group(2)))
+        except ConnectionResetError:
+            return
+        except Exception as e:
+            return await send_json(send, 500, {'success': False, 'error': str(e)})
+
+    if scope['path'] == UPLOAD_POST and scope['method'] == 'POST':
+        try:
+            return await post_upload(scope, receive, send)
+        except ConnectionResetError:
+            return
+        except Exception as e:
+            return await send_json(send, 500, {'success': False, 'error': str(e)})
+
+    try:
+        await bridge(scope, receive, send)
+    except ConnectionResetError:
+        pass
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('The async serving mode needs an ASGI server: pip install uvicorn')
+
+    os.makedirs(pi_cloud.UPLOAD_FOLDER, exist_ok=True)
+    print(f"Access via: http://pi-ip:5000")
+    uvicorn.run(app, host='0.0.0.0', port=5000)
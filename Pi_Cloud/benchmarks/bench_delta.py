@@ -0,0 +1,124 @@
+"""Delta sync versus full re-upload of a modified large file.
+
+Uploads a random file, edits it in a few typical ways and sends each new
+version twice through the app in-process: once whole with /api/upload, once
+as a delta (signature download + delta upload). Reports the bytes each one
+moves, the time spent on the Pi's side of things and what the transfer
+would take on a --mbps link.
+
+Run from Pi_Cloud/:  python benchmarks/bench_delta.py [--size 256] [--mbps 100]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import delta
+
+NAME = 'image.7z'
+
+def in_place_edits(data, rng, count=8, length=100):
+    data = bytearray(data)
+    for _ in range(count):
+        offset = rng.randrange(len(data) - length)
+        data[offset:offset + length] = rng.randbytes(length)
+    return bytes(data)
+
+def insertion(data, rng, length=4096):
+    offset = rng.randrange(len(data))
+    return data[:offset] + rng.randbytes(length) + data[offset:]
+
+def deletion(data, rng, length=4096):
+    offset = rng.randrange(len(data) - length)
+    return data[:offset] + data[offset + length:]
+
+def append(data, rng, length=1024 * 1024):
+    return data + rng.randbytes(length)
+
+SCENARIOS = {
+    'in-place edits': in_place_edits,
+    'insert 4 KiB': insertion,
+    'delete 4 KiB': deletion,
+    'append 1 MiB': append,
+}
+
+def full_upload(client, data):
+    start = time.perf_counter()
+    response = client.post('/api/upload', data={'file': (io.BytesIO(data), NAME)},
+                           content_type='multipart/form-data')
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.json
+    client.delete(f"/api/delete/{response.json['filename']}")
+    return len(data), elapsed
+
+def delta_upload(client, new_path, expected):
+    start = time.perf_counter()
+    response = client.get(f'/api/signature/{NAME}')
+    signature, etag = response.data, response.headers['ETag']
+    body = b''.join(delta.make_delta(signature, new_path))
+    response = client.post(f'/api/delta/{NAME}', data=body, headers={'If-Match': etag})
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.json
+    assert client.get(f'/api/download/{NAME}').data == expected
+    return len(signature), len(body), response.json['literal'], elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Delta sync versus full re-upload')
+    parser.add_argument('--size', type=int, default=256, help='File size in MiB')
+    parser.add_argument('--mbps', type=float, default=100, help='Link speed for the transfer estimate')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dir', default=None, help='Where to put the files (default: a temp dir)')
+    args = parser.parse_args()
+
+    import app as pi_cloud
+
+    rng = random.Random(args.seed)
+    original = rng.randbytes(args.size * 1024 * 1024)
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        pi_cloud.app.config['UPLOAD_FOLDER'] = os.path.join(directory, 'uploads')
+        client = pi_cloud.app.test_client()
+        new_path = os.path.join(directory, 'new')
+
+        for scenario, edit in SCENARIOS.items():
+            client.delete(f'/api/delete/{NAME}')
+            client.post('/api/upload', data={'file': (io.BytesIO(original), NAME)},
+                        content_type='multipart/form-data')
+            modified = edit(original, rng)
+            with open(new_path, 'wb') as f:
+                f.write(modified)
+
+            full_bytes, full_seconds = full_upload(client, modified)
+            signature_bytes, delta_bytes, literal, delta_seconds = delta_upload(client, new_path, modified)
+            delta_total = signature_bytes + delta_bytes
+            link = args.mbps * 1e6 / 8
+            results.append({
+                'scenario': scenario,
+                'full_bytes': full_bytes,
+                'delta_bytes': delta_total,
+                'signature_bytes': signature_bytes,
+                'literal_bytes': literal,
+                'bytes_saved': round(1 - delta_total / full_bytes, 4),
+                'full_seconds': round(full_seconds, 3),
+                'delta_seconds': round(delta_seconds, 3),
+                'full_seconds_on_link': round(full_seconds + full_bytes / link, 3),
+                'delta_seconds_on_link': round(delta_seconds + delta_total / link, 3),
+            })
+        shutil.rmtree(pi_cloud.app.config['UPLOAD_FOLDER'], ignore_errors=True)
+
+    for result in results:
+        print(f"{result['scenario']:>15}: {result['delta_bytes'] / 1e6:8.2f} MB instead of "
+              f"{result['full_bytes'] / 1e6:8.2f} MB, {result['delta_seconds_on_link']:7.2f}s instead of "
+              f"{result['full_seconds_on_link']:7.2f}s at {args.mbps:g} Mbit/s", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+"""Upload, download, range and listing throughput of a local Pi_Cloud.
+
+Starts Pi_Cloud on a free port with an empty temp upload folder (or uses
+--url), then runs each operation for each file size at each concurrency
+level and reports MB/s, request latency percentiles and the server's CPU
+use and peak memory. Files are synthetic and seeded, and every phase moves
+a fixed number of bytes, so runs on the same hardware are comparable.
+
+    upload     POST /api/upload, multipart: parsing + file.save
+    download   GET /api/download/<name>, whole file: send_file
+    range      GET /api/download/<name> with a random Range of --range-size
+    list       GET /api/files with --list-files files in the catalog
+
+Run from Pi_Cloud/:  python benchmarks/bench_throughput.py [--sizes 1K 1M 64M 2G]
+    [--concurrency 1 4 16] [--server flask|asgi] [--url http://pi-ip:5000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import psutil
+
+PI_CLOUD_DIR = Path(__file__).parent.parent
+
+# Not previewed or precompressed, so no background work skews the numbers
+EXTENSION = 'zip'
+GENERATE_BLOCK_SIZE = 1024 * 1024
+READ_BLOCK_SIZE = 1024 * 1024
+
+SERVER = '''
+import logging, os, sys
+sys.path.insert(0, sys.argv[1])
+import app as pi_cloud
+pi_cloud.app.config['UPLOAD_FOLDER'] = sys.argv[2]
+os.makedirs(sys.argv[2], exist_ok=True)
+port = int(sys.argv[3])
+if sys.argv[4] == 'asgi':
+    import asgi, uvicorn
+    uvicorn.run(asgi.app, host='127.0.0.1', port=port, log_level='warning')
+else:
+    from werkzeug.serving import run_simple
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    run_simple('127.0.0.1', port, pi_cloud.app, threaded=True)
+'''
+
+def parse_size(text):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text[-1].upper() in units:
+        return int(float(text[:-1]) * units[text[-1].upper()])
+    return int(text)
+
+def format_size(size):
+    for unit, scale in (('G', 1024 ** 3), ('M', 1024 ** 2), ('K', 1024)):
+        if size >= scale and size % scale == 0:
+            return f'{size // scale}{unit}'
+    return str(size)
+
+def generate(path, size, seed):
+    """Incompressible bytes, the same for the same size and seed"""
+    rng = random.Random(f'{seed}-{size}')
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            block = rng.randbytes(min(GENERATE_BLOCK_SIZE, remaining))
+            f.write(block)
+            remaining -= len(block)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(kind, folder):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-c', SERVER, str(PI_CLOUD_DIR), folder, str(port), kind],
+        stdout=subprocess.DEVNULL,
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f'Server exited with {process.returncode}')
+        try:
+            httpx.get(f'{url}/health', timeout=1)
+            return process, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    sys.exit('Server did not start')
+
+class ResourceMonitor:
+    """CPU seconds and peak RSS of the server and its worker processes during a phase"""
+
+    def __init__(self, pid, interval=0.1):
+        self.process = psutil.Process(pid) if pid else None
+        self.interval = interval
+        self.peak_rss = 0
+        self.stopped = threading.Event()
+
+    def processes(self):
+        try:
+            return [self.process, *self.process.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return []
+
+    def cpu_seconds(self):
+        total = 0.0
+        for process in self.processes():
+            try:
+                times = process.cpu_times()
+                total += times.user + times.system
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            rss = 0
+            for process in self.processes():
+                try:
+                    rss += process.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def __enter__(self):
+        if self.process is not None:
+            self.cpu_start = self.cpu_seconds()
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.process is not None:
+            self.cpu_used = self.cpu_seconds() - self.cpu_start
+            self.stopped.set()
+            self.thread.join()
+
+async def run_phase(requests, concurrency, operation):
+    """Run operation(i) for i in range(requests), concurrency at a time.
+    Returns (latencies, bytes moved, wall seconds)."""
+    latencies = []
+    moved = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal moved, next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            start = time.perf_counter()
+            count = await operation(index)
+            latencies.append(time.perf_counter() - start)
+            moved += count
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, moved, time.perf_counter() - start
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+async def upload(client, path, name):
+    with open(path, 'rb') as f:
+        response = await client.post('/api/upload', files={'file': (name, f, 'application/octet-stream')})
+    response.raise_for_status()
+    return os.path.getsize(path), response.json()['filename']
+
+async def download(client, name, headers=None):
+    received = 0
+    async with client.stream('GET', f'/api/download/{name}', headers=headers) as response:
+        response.raise_for_status()
+        async for block in response.aiter_raw(READ_BLOCK_SIZE):
+            received += len(block)
+    return received
+
+async def benchmark(args, url, pid, files):
+    results = []
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=None) as client:
+
+        async def record(operation, size, concurrency, requests, run):
+            # one request before measuring: connections, catalog, page cache
+            await run(0)
+            with ResourceMonitor(pid) as monitor:
+                latencies, moved, elapsed = await run_phase(requests, concurrency, run)
+            result = {
+                'operation': operation,
+                'size': size,
+                'concurrency': concurrency,
+                'requests': requests,
+                'mb_per_second': round(moved / elapsed / 1e6, 2),
+                'requests_per_second': round(requests / elapsed, 1),
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+                'p90_ms': round(percentile(latencies, 0.9) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+            }
+            if pid:
+                result['server_cpu_percent'] = round(monitor.cpu_used / elapsed * 100, 1)
+                result['server_peak_rss_mb'] = round(monitor.peak_rss / 1e6, 1)
+            results.append(result)
+            print(
+                f"{operation:>8} {format_size(size):>5} x{concurrency:<3} {result['mb_per_second']:>9} MB/s "
+                f"{result['requests_per_second']:>8} req/s  p50 {result['p50_ms']:>9} ms  "
+                f"p99 {result['p99_ms']:>9} ms"
+                + (f"  cpu {result['server_cpu_percent']:>6}%  rss {result['server_peak_rss_mb']:>7} MB"
+                   if pid else ''),
+                file=sys.stderr,
+            )
+
+        for size, path in files.items():
+            # a fixed byte budget per phase keeps runs comparable; at least
+            # one request per connection
+            for concurrency in args.concurrency:
+                requests = max(concurrency, min(args.requests, args.budget // size))
+                uploaded = []
+
+                async def run_upload(index):
+                    moved, name = await upload(client, path, f'bench-{format_size(size)}.{EXTENSION}')
+                    uploaded.append(name)
+                    return moved
+
+                if 'upload' in args.operations:
+                    await record('upload', size, concurrency, requests, run_upload)
+                if not uploaded:
+                    await run_upload(0)
+                name = uploaded[0]
+
+                if 'download' in args.operations:
+                    await record('download', size, concurrency, requests,
+                                 lambda index: download(client, name))
+
+                if 'range' in args.operations and size > args.range_size:
+                    rng = random.Random(args.seed)
+                    offsets = [rng.randrange(size - args.range_size) for _ in range(args.requests + 1)]
+                    await record('range', size, concurrency, args.requests, lambda index: download(
+                        client, name, {'Range': f'bytes={offsets[index]}-{offsets[index] + args.range_size - 1}'}))
+
+                for uploaded_name in uploaded:
+                    await client.delete(f'/api/delete/{uploaded_name}')
+
+        if 'list' in args.operations:
+            seed_path = files[min(files)]
+            names = []
+            for index in range(args.list_files):
+                names.append((await upload(client, seed_path, f'list-{index}.{EXTENSION}'))[1])
+
+            async def run_list(index):
+                response = await client.get('/api/files', params={'page': 1, 'per_page': args.page_size})
+                response.raise_for_status()
+                return len(response.content)
+
+            for concurrency in args.concurrency:
+                await record('list', args.page_size, concurrency, args.requests, run_list)
+            for name in names:
+                await client.delete(f'/api/delete/{name}')
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Pi_Cloud throughput benchmark')
+    parser.add_argument('--sizes', nargs='+', default=['1K', '1M', '64M'], help='File sizes, e.g. 1K 1M 2G')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--operations', nargs='+', default=['upload', 'download', 'range', 'list'],
+                        choices=['upload', 'download', 'range', 'list'])
+    parser.add_argument('--requests', type=int, default=200, help='Most requests per phase')
+    parser.add_argument('--budget', type=parse_size, default=parse_size('1G'),
+                        help='Most bytes per upload/download phase')
+    parser.add_argument('--range-size', type=parse_size, default=parse_size('64K'))
+    parser.add_argument('--list-files', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask')
+    parser.add_argument('--url', default=None, help='Benchmark a running instance instead (no CPU/memory figures)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dir', default=None, help='Where to put files and uploads (default: a temp dir)')
+    args = parser.parse_args()
+
+    sizes = sorted(parse_size(size) for size in args.sizes)
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        files = {}
+        for size in sizes:
+            files[size] = os.path.join(directory, f'{size}.{EXTENSION}')
+            generate(files[size], size, args.seed)
+
+        process = None
+        url = args.url
+        if url is None:
+            process, url = start_server(args.server, os.path.join(directory, 'uploads'))
+        try:
+            results = asyncio.run(benchmark(args, url, process.pid if process else None, files))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    print(json.dumps({
+        'environment': {
+            'server': args.server if args.url is None else args.url,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'seed': args.seed,
+        },
+        'results': results,
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,521 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# reservations older than this belong to uploads that died
+PENDING_EXPIRY_SECONDS = 24 * 3600
+
+SORT_COLUMNS = {
+    'modified': 'mtime',
+    'name': 'name',
+    'size': 'size',
+    'type': 'mime',
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    mime TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    pending INTEGER NOT NULL DEFAULT 0,
+    -- content hash when the bytes live in the blob store (dedup mode)
+    blob TEXT,
+    -- virtual folder the file is shown in, 'a/b' or '' for the top level;
+    -- the bytes stay where they are, so names are unique across folders
+    folder TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS files_mtime ON files (pending, mtime);
+CREATE INDEX IF NOT EXISTS files_size ON files (pending, size);
+CREATE INDEX IF NOT EXISTS files_mime ON files (pending, mime);
+CREATE INDEX IF NOT EXISTS files_ext ON files (pending, ext);
+
+CREATE TABLE IF NOT EXISTS folders (
+    path TEXT PRIMARY KEY,
+    created REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL
+);
+
+-- next numeric suffix to try for each taken filename
+CREATE TABLE IF NOT EXISTS name_counters (
+    name TEXT PRIMARY KEY,
+    next INTEGER NOT NULL
+);
+'''
+
+# Trigram index over file names: substring and prefix LIKE queries look up
+# trigrams instead of scanning every name
+SEARCH_SCHEMA = '''
+CREATE VIRTUAL TABLE files_search USING fts5(
+    name, content='files', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER files_search_insert AFTER INSERT ON files BEGIN
+    INSERT INTO files_search (rowid, name) VALUES (new.rowid, new.name);
+END;
+CREATE TRIGGER files_search_delete AFTER DELETE ON files BEGIN
+    INSERT INTO files_search (files_search, rowid, name) VALUES ('delete', old.rowid, old.name);
+END;
+CREATE TRIGGER files_search_rename AFTER UPDATE OF name ON files BEGIN
+    INSERT INTO files_search (files_search, rowid, name) VALUES ('delete', old.rowid, old.name);
+    INSERT INTO files_search (rowid, name) VALUES (new.rowid, new.name);
+END;
+INSERT INTO files_search (files_search) VALUES ('rebuild');
+'''
+
+# Files and bytes per MIME type, kept up to date by triggers on every change
+# to files instead of being summed up on request
+USAGE_SCHEMA = '''
+CREATE TABLE usage (
+    mime TEXT PRIMARY KEY,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE TRIGGER usage_insert AFTER INSERT ON files WHEN new.pending = 0 BEGIN
+    INSERT INTO usage (mime, files, bytes) VALUES (new.mime, 1, new.size)
+    ON CONFLICT (mime) DO UPDATE SET files = files + 1, bytes = bytes + new.size;
+END;
+CREATE TRIGGER usage_delete AFTER DELETE ON files WHEN old.pending = 0 BEGIN
+    UPDATE usage SET files = files - 1, bytes = bytes - old.size WHERE mime = old.mime;
+END;
+CREATE TRIGGER usage_update AFTER UPDATE OF size, mime, pending ON files BEGIN
+    UPDATE usage SET files = files - 1, bytes = bytes - old.size WHERE mime = old.mime AND old.pending = 0;
+    INSERT INTO usage (mime, files, bytes) SELECT new.mime, 1, new.size WHERE new.pending = 0
+    ON CONFLICT (mime) DO UPDATE SET files = files + 1, bytes = bytes + new.size;
+END;
+INSERT INTO usage (mime, files, bytes)
+    SELECT mime, COUNT(*), SUM(size) FROM files WHERE pending = 0 GROUP BY mime;
+'''
+
+# Both an INSERT for new names and an in-place UPDATE for known ones, so
+# the row keeps its folder and its place in the search index. A blob-backed
+# name is left alone: clearing its blob would leak the blob's reference.
+UPSERT_FILE = '''
+INSERT INTO files (name, size, mtime, mime, ext, pending) VALUES (:name, :size, :mtime, :mime, :ext, 0)
+ON CONFLICT (name) DO UPDATE SET
+    size = excluded.size, mtime = excluded.mtime, mime = excluded.mime, ext = excluded.ext,
+    pending = 0
+WHERE files.blob IS NULL
+'''
+
+def folder_range(path):
+    """Bounds of the paths strictly inside folder path, for range scans
+    ('0' sorts right after '/')"""
+    return (f'{path}/', f'{path}0') if path else ('', '\U0010ffff')
+
+def parent_folders(path):
+    """'a/b/c' -> ['a', 'a/b', 'a/b/c']"""
+    parts = path.split('/') if path else []
+    return ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+class Catalog:
+    """SQLite index of the files in the upload folder.
+
+    Kept up to date by the upload and delete handlers, and reconciled with
+    the folder by a periodic rescan that picks up files copied in or
+    removed behind the app's back.
+    """
+
+    def __init__(self, folder, db_path, get_mime_type, allowed_file):
+        self.folder = folder
+        self.db_path = db_path
+        self.get_mime_type = get_mime_type
+        self.allowed_file = allowed_file
+        self.local = threading.local()
+        # sqlite serialises writers anyway; this keeps reserve_name atomic
+        self.write_lock = threading.Lock()
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(files)')}
+            if 'blob' not in columns:
+                conn.execute('ALTER TABLE files ADD COLUMN blob TEXT')
+            if 'folder' not in columns:
+                conn.execute("ALTER TABLE files ADD COLUMN folder TEXT NOT NULL DEFAULT ''")
+            conn.execute('CREATE INDEX IF NOT EXISTS files_folder ON files (folder, pending, mtime)')
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'files_search'").fetchone():
+                conn.executescript(SEARCH_SCHEMA)
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'usage'").fetchone():
+                conn.executescript(USAGE_SCHEMA)
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def file_row(self, name, size, mtime):
+        return {
+            'name': name,
+            'size': size,
+            'mtime': mtime,
+            'mime': self.get_mime_type(name),
+            'ext': os.path.splitext(name)[1].lower().lstrip('.'),
+        }
+
+    def reserve_name(self, filename, folder=''):
+        """A filename nobody has, recorded as pending until add() or release()"""
+        conn = self.connection()
+        with self.write_lock, conn:
+            candidate = self.free_name(conn, filename)
+            self.insert_folders(conn, folder)
+            conn.execute(
+                "INSERT INTO files (name, size, mtime, mime, ext, pending, folder) VALUES (?, 0, ?, '', '', 1, ?)",
+                (candidate, time.time(), folder),
+            )
+        return candidate
+
+    def free_name(self, conn, filename):
+        """filename, or the first free filename_N.
+
+        Taken names remember the next suffix to try, so a popular name costs
+        one lookup instead of probing name_1, name_2, ... on disk.
+        """
+        if not self.taken(conn, filename):
+            return filename
+
+        stem, ext = os.path.splitext(filename)
+        row = conn.execute('SELECT next FROM name_counters WHERE name = ?', (filename,)).fetchone()
+        counter = row['next'] if row else 1
+        candidate = f'{stem}_{counter}{ext}'
+        while self.taken(conn, candidate):
+            counter += 1
+            candidate = f'{stem}_{counter}{ext}'
+        conn.execute(
+            'INSERT INTO name_counters (name, next) VALUES (?, ?) '
+            'ON CONFLICT (name) DO UPDATE SET next = excluded.next',
+            (filename, counter + 1),
+        )
+        return candidate
+
+    def taken(self, conn, name):
+        if conn.execute('SELECT 1 FROM files WHERE name = ?', (name,)).fetchone():
+            return True
+        # files copied in since the last rescan
+        return os.path.lexists(os.path.join(self.folder, name))
+
+    def add(self, name):
+        """Index a file that is now in the folder (new or replaced)"""
+        stat = os.stat(os.path.join(self.folder, name))
+        row = self.file_row(name, stat.st_size, stat.st_mtime)
+        with self.write_lock, self.connection() as conn:
+            conn.execute(UPSERT_FILE, row)
+
+    def release(self, name):
+        """Give up a reserved name whose upload failed"""
+        with self.write_lock, self.connection() as conn:
+            conn.execute('DELETE FROM files WHERE name = ? AND pending = 1', (name,))
+
+    def remove(self, name):
+        """Drop a file, returns the hash of its blob if that was the last reference"""
+        with self.write_lock, self.connection() as conn:
+            row = conn.execute('SELECT blob FROM files WHERE name = ?', (name,)).fetchone()
+            conn.execute('DELETE FROM files WHERE name = ?', (name,))
+            if row is None or row['blob'] is None:
+                return None
+            return self.drop_reference(conn, row['blob'])
+
+    def drop_reference(self, conn, blob):
+        conn.execute('UPDATE blobs SET refs = refs - 1 WHERE hash = ?', (blob,))
+        if conn.execute('SELECT refs FROM blobs WHERE hash = ?', (blob,)).fetchone()['refs'] > 0:
+            return None
+        conn.execute('DELETE FROM blobs WHERE hash = ?', (blob,))
+        return blob
+
+    def add_reference(self, filename, blob, size, folder=''):
+        """Make a free variant of filename point at a stored blob, returns the name used"""
+        conn = self.connection()
+        with self.write_lock, conn:
+            name = self.free_name(conn, filename)
+            self.insert_folders(conn, folder)
+            conn.execute(
+                'INSERT INTO blobs (hash, size, refs) VALUES (?, ?, 1) '
+                'ON CONFLICT (hash) DO UPDATE SET refs = refs + 1',
+                (blob, size),
+            )
+            conn.execute(
+                'INSERT INTO files (name, size, mtime, mime, ext, pending, blob, folder) '
+                'VALUES (:name, :size, :mtime, :mime, :ext, 0, :blob, :folder)',
+                {**self.file_row(name, size, time.time()), 'blob': blob, 'folder': folder},
+            )
+        return name
+
+    def replace_blob(self, name, blob, size):
+        """Point an existing name at other content, returns the hash of its
+        old blob if that was the last reference"""
+        with self.write_lock, self.connection() as conn:
+            old = conn.execute('SELECT blob FROM files WHERE name = ?', (name,)).fetchone()['blob']
+            conn.execute(
+                'INSERT INTO blobs (hash, size, refs) VALUES (?, ?, 1) '
+                'ON CONFLICT (hash) DO UPDATE SET refs = refs + 1',
+                (blob, size),
+            )
+            conn.execute('UPDATE files SET blob = ?, size = ?, mtime = ? WHERE name = ?',
+                         (blob, size, time.time(), name))
+            return self.drop_reference(conn, old)
+
+    def blob_size(self, blob):
+        """Size of a stored blob, None if there is no such blob"""
+        row = self.connection().execute('SELECT size FROM blobs WHERE hash = ?', (blob,)).fetchone()
+        return None if row is None else row['size']
+
+    def blob_for(self, name):
+        row = self.connection().execute('SELECT blob FROM files WHERE name = ?', (name,)).fetchone()
+        return None if row is None else row['blob']
+
+    def get(self, name):
+        row = self.connection().execute(
+            'SELECT * FROM files WHERE name = ? AND pending = 0', (name,)
+        ).fetchone()
+        return None if row is None else self.to_info(row)
+
+    def list(self, page=1, per_page=100, sort='modified', order='desc', file_type=None, folder=None):
+        """(page of file infos, total matching) straight from the index.
+        folder=None lists every folder."""
+        where, params = self.type_filter(file_type)
+        if folder is not None:
+            where.append('folder = ?')
+            params.append(folder)
+        return self.page(where, params, page, per_page, sort, order)
+
+    def search(self, query='', match='substring', file_type=None, after=None, before=None,
+               min_size=None, max_size=None, folder=None, page=1, per_page=100,
+               sort='modified', order='desc'):
+        """(page of file infos, total matching) for names containing query, or
+        starting with it when match='prefix'. after/before are timestamps;
+        folder limits the search to that folder and the ones inside it."""
+        where, params = self.type_filter(file_type)
+        query = query.lower()
+        if query:
+            # the trigram index narrows it down; its LIKE treats '_' as a
+            # wildcard, which the exact test on the name takes care of
+            pattern = f'{query}%' if match == 'prefix' else f'%{query}%'
+            where.append('rowid IN (SELECT rowid FROM files_search WHERE name LIKE ?)')
+            params.append(pattern)
+            if match == 'prefix':
+                where.append('substr(lower(name), 1, ?) = ?')
+                params.extend([len(query), query])
+            else:
+                where.append('instr(lower(name), ?) > 0')
+                params.append(query)
+        for condition, value in (('mtime >= ?', after), ('mtime < ?', before),
+                                 ('size >= ?', min_size), ('size <= ?', max_size)):
+            if value is not None:
+                where.append(condition)
+                params.append(value)
+        if folder:
+            low, high = folder_range(folder)
+            where.append('(folder = ? OR folder > ? AND folder < ?)')
+            params.extend([folder, low, high])
+        return self.page(where, params, page, per_page, sort, order)
+
+    def type_filter(self, file_type):
+        where = ['pending = 0']
+        params = []
+        if file_type:
+            if '/' in file_type:
+                where.append('mime = ?')
+                params.append(file_type)
+            elif file_type in ('image', 'video', 'audio', 'text', 'application'):
+                where.append('mime LIKE ?')
+                params.append(f'{file_type}/%')
+            else:
+                where.append('ext = ?')
+                params.append(file_type.lower().lstrip('.'))
+        return where, params
+
+    def page(self, where, params, page, per_page, sort, order):
+        where_sql = ' AND '.join(where)
+        column = SORT_COLUMNS.get(sort, 'mtime')
+        direction = 'ASC' if order == 'asc' else 'DESC'
+
+        conn = self.connection()
+        total = conn.execute(f'SELECT COUNT(*) FROM files WHERE {where_sql}', params).fetchone()[0]
+        rows = conn.execute(
+            f'SELECT * FROM files WHERE {where_sql} ORDER BY {column} {direction}, name {direction} '
+            'LIMIT ? OFFSET ?',
+            params + [per_page, (page - 1) * per_page],
+        ).fetchall()
+        return [self.to_info(row) for row in rows], total
+
+    def rename(self, name, new_name):
+        """Give a file another name; False if new_name is taken"""
+        conn = self.connection()
+        with self.write_lock, conn:
+            if self.taken(conn, new_name):
+                return False
+            row = self.file_row(new_name, 0, 0)
+            conn.execute(
+                'UPDATE files SET name = ?, mime = ?, ext = ? WHERE name = ? AND pending = 0',
+                (new_name, row['mime'], row['ext'], name),
+            )
+        return True
+
+    def move_files(self, names, folder):
+        """Put files in a folder, returns how many of them exist"""
+        conn = self.connection()
+        with self.write_lock, conn:
+            self.insert_folders(conn, folder)
+            return conn.executemany(
+                'UPDATE files SET folder = ? WHERE name = ? AND pending = 0', [(folder, name) for name in names]
+            ).rowcount
+
+    def insert_folders(self, conn, path):
+        """Create folder path and its parents as needed, returns whether path is new"""
+        now = time.time()
+        created = False
+        for folder in parent_folders(path):
+            created = conn.execute(
+                'INSERT INTO folders (path, created) VALUES (?, ?) ON CONFLICT (path) DO NOTHING', (folder, now)
+            ).rowcount > 0
+        return created
+
+    def create_folder(self, path):
+        """False if it already exists"""
+        with self.write_lock, self.connection() as conn:
+            return self.insert_folders(conn, path)
+
+    def folder_exists(self, path):
+        return not path or self.connection().execute(
+            'SELECT 1 FROM folders WHERE path = ?', (path,)
+        ).fetchone() is not None
+
+    def subfolders(self, parent=''):
+        """Folders directly inside parent, with how many files each holds"""
+        low, high = folder_range(parent)
+        conn = self.connection()
+        paths = [
+            row['path'] for row in conn.execute(
+                'SELECT path FROM folders WHERE path > ? AND path < ? ORDER BY path', (low, high)
+            )
+            if '/' not in row['path'][len(low):]
+        ]
+        counts = dict(conn.execute(
+            'SELECT folder, COUNT(*) FROM files WHERE pending = 0 AND folder > ? AND folder < ? GROUP BY folder',
+            (low, high),
+        ).fetchall())
+        return [
+            {'name': path.rsplit('/', 1)[-1], 'path': path, 'files': counts.get(path, 0)}
+            for path in paths
+        ]
+
+    def move_folder(self, path, new_path):
+        """Rename or move a folder with everything in it.
+        Returns None on success, else why not."""
+        low, high = folder_range(path)
+        conn = self.connection()
+        with self.write_lock, conn:
+            if not self.folder_exists(path):
+                return 'Folder not found'
+            if self.folder_exists(new_path):
+                return 'A folder with that name exists'
+            if new_path.startswith(low):
+                return 'Cannot move a folder into itself'
+
+            for table, column in (('folders', 'path'), ('files', 'folder')):
+                conn.execute(
+                    f'UPDATE {table} SET {column} = ? || substr({column}, ?) '
+                    f'WHERE {column} = ? OR {column} > ? AND {column} < ?',
+                    (new_path, len(path) + 1, path, low, high),
+                )
+            self.insert_folders(conn, new_path.rpartition('/')[0])
+        return None
+
+    def delete_folder(self, path):
+        """Remove an empty folder. Returns None on success, else why not."""
+        low, high = folder_range(path)
+        conn = self.connection()
+        with self.write_lock, conn:
+            if not self.folder_exists(path):
+                return 'Folder not found'
+            if conn.execute(
+                'SELECT 1 FROM files WHERE folder = ? OR folder > ? AND folder < ? LIMIT 1', (path, low, high)
+            ).fetchone() or conn.execute(
+                'SELECT 1 FROM folders WHERE path > ? AND path < ? LIMIT 1', (low, high)
+            ).fetchone():
+                return 'Folder is not empty'
+            conn.execute('DELETE FROM folders WHERE path = ?', (path,))
+        return None
+
+    def usage(self):
+        """[{type, files, bytes}] per MIME type, largest first"""
+        rows = self.connection().execute(
+            'SELECT mime, files, bytes FROM usage WHERE files > 0 ORDER BY bytes DESC'
+        ).fetchall()
+        return [{'type': row['mime'], 'files': row['files'], 'bytes': row['bytes']} for row in rows]
+
+    def to_info(self, row):
+        return {
+            'name': row['name'],
+            'filesize': row['size'],
+            'modified': datetime.fromtimestamp(row['mtime']).isoformat(),
+            'type': row['mime'],
+            'folder': row['folder'],
+        }
+
+    def reconcile(self):
+        """Bring the index in line with the folder, returns (added or changed, removed)"""
+        on_disk = {}
+        if os.path.isdir(self.folder):
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    if entry.is_file() and self.allowed_file(entry.name):
+                        on_disk[entry.name] = entry.stat()
+
+        conn = self.connection()
+        indexed = {
+            row['name']: (row['size'], row['mtime'], row['pending'])
+            # blob-backed names have no file of their own in the folder
+            for row in conn.execute('SELECT name, size, mtime, pending FROM files WHERE blob IS NULL')
+        }
+
+        # a stray file named like a blob-backed entry doesn't replace it
+        blob_backed = {row['name'] for row in conn.execute('SELECT name FROM files WHERE blob IS NOT NULL')}
+
+        changed = []
+        for name, stat in on_disk.items():
+            if name in blob_backed:
+                continue
+            known = indexed.get(name)
+            # pending names belong to uploads in flight, leave them alone
+            if known is None or not known[2] and known[:2] != (stat.st_size, stat.st_mtime):
+                changed.append(self.file_row(name, stat.st_size, stat.st_mtime))
+
+        abandoned = time.time() - PENDING_EXPIRY_SECONDS
+        removed = [
+            (name,)
+            for name, (_, mtime, pending) in indexed.items()
+            if name not in on_disk and (not pending or mtime < abandoned)
+            # uploaded while we were scanning
+            and not os.path.lexists(os.path.join(self.folder, name))
+        ]
+
+        with self.write_lock, conn:
+            conn.executemany(UPSERT_FILE, changed)
+            conn.executemany('DELETE FROM files WHERE name = ?', removed)
+        return len(changed), len(removed)
+
+    def start_rescans(self, interval):
+        """Reconcile every interval seconds in a daemon thread"""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.reconcile()
+                except Exception:
+                    logger.exception('Catalog rescan failed')
+
+        threading.Thread(target=run, name='catalog-rescan', daemon=True).start()
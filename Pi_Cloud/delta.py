@@ -0,0 +1,289 @@
+"""rsync-style delta sync: resend only what changed in a large file.
+
+The server publishes a signature of the stored file: per block, a weak
+Adler-32 checksum that the client can roll along its new version one byte
+at a time, and a strong BLAKE2b digest to confirm a weak match. The client
+answers with a delta, a list of "copy blocks i..j from the stored file"
+and "literal bytes" instructions, which the server applies to write the new
+version next to the old one before swapping it in.
+
+Signature, all big-endian:
+    b'PCSG', block size (u32), file size (u64), then per block:
+    weak checksum (u32), strong digest (16 bytes)
+
+Delta:
+    b'PCDL', block size (u32), then instructions:
+    b'C' first block (u32), block count (u32)
+    b'L' length (u32), literal bytes
+    b'E' end of delta
+
+Sync a local file with one on the server from the command line:
+
+    python delta.py http://pi-ip:5000 disk.img [name-on-server]
+"""
+import hashlib
+import math
+import mmap
+import os
+import struct
+import zlib
+
+SIGNATURE_MAGIC = b'PCSG'
+DELTA_MAGIC = b'PCDL'
+SIGNATURE_HEADER = struct.Struct('>4sIQ')
+SIGNATURE_ENTRY = struct.Struct('>I16s')
+DELTA_HEADER = struct.Struct('>4sI')
+COPY = struct.Struct('>II')
+LITERAL = struct.Struct('>I')
+STRONG_DIGEST_SIZE = 16
+
+# About sqrt(size) like rsync: small blocks find more matches, big ones keep
+# the signature small. A 4 GB image gets 64 KiB blocks and a 1.3 MB signature.
+MIN_BLOCK_SIZE = 4 * 1024
+MAX_BLOCK_SIZE = 1024 * 1024
+MAX_LITERAL_SIZE = 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+SIGNATURE_SUFFIX = '.sig'
+ADLER_MOD = 65521
+
+class DeltaError(ValueError):
+    """A malformed delta or one that doesn't fit the stored file"""
+
+def block_size_for(size):
+    block = 1 << max(0, math.isqrt(size).bit_length() - 1)
+    return min(MAX_BLOCK_SIZE, max(MIN_BLOCK_SIZE, block))
+
+def strong_digest(block):
+    return hashlib.blake2b(block, digest_size=STRONG_DIGEST_SIZE).digest()
+
+def signature_path(filepath):
+    return filepath + SIGNATURE_SUFFIX
+
+def fresh_signature(filepath, stat):
+    """filepath's cached signature if it is for the current contents, else None.
+
+    Like precompressed variants, signatures carry the original's mtime.
+    """
+    path = signature_path(filepath)
+    try:
+        signature_stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return path if signature_stat.st_mtime_ns == stat.st_mtime_ns else None
+
+def write_signature(filepath):
+    """Compute and cache filepath's signature, returns its path"""
+    stat = os.stat(filepath)
+    block_size = block_size_for(stat.st_size)
+    dest = signature_path(filepath)
+    tmp = f'{dest}.{os.getpid()}.tmp'
+    try:
+        with open(filepath, 'rb') as src, open(tmp, 'wb') as out:
+            out.write(SIGNATURE_HEADER.pack(SIGNATURE_MAGIC, block_size, stat.st_size))
+            for block in iter(lambda: src.read(block_size), b''):
+                out.write(SIGNATURE_ENTRY.pack(zlib.adler32(block), strong_digest(block)))
+        os.utime(tmp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp, dest)
+        return dest
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def remove_signature(filepath):
+    path = signature_path(filepath)
+    if os.path.exists(path):
+        os.remove(path)
+
+def read_exact(stream, size):
+    data = bytearray()
+    while len(data) < size:
+        block = stream.read(size - len(data))
+        if not block:
+            raise DeltaError('Delta ends early')
+        data += block
+    return bytes(data)
+
+def apply_delta(basis_path, stream, out):
+    """Write the file described by the delta in stream to out.
+
+    Returns (size, sha256 hex, bytes copied from the basis, literal bytes).
+    """
+    basis_size = os.path.getsize(basis_path)
+    block_size = block_size_for(basis_size)
+    block_count = -(-basis_size // block_size)
+
+    magic, delta_block_size = DELTA_HEADER.unpack(read_exact(stream, DELTA_HEADER.size))
+    if magic != DELTA_MAGIC:
+        raise DeltaError('Not a delta')
+    if delta_block_size != block_size:
+        raise DeltaError(f'Delta is for {delta_block_size} byte blocks, the stored file uses {block_size}')
+
+    digest = hashlib.sha256()
+    copied = literal = 0
+    with open(basis_path, 'rb') as basis:
+        while True:
+            op = read_exact(stream, 1)
+            if op == b'E':
+                return copied + literal, digest.hexdigest(), copied, literal
+
+            if op == b'C':
+                first, count = COPY.unpack(read_exact(stream, COPY.size))
+                if count == 0 or first + count > block_count:
+                    raise DeltaError(f'Blocks {first}+{count} are not in the stored file')
+                start = first * block_size
+                remaining = min((first + count) * block_size, basis_size) - start
+                basis.seek(start)
+                copied += remaining
+                while remaining > 0:
+                    block = basis.read(min(COPY_BUFFER_SIZE, remaining))
+                    remaining -= len(block)
+                    digest.update(block)
+                    out.write(block)
+
+            elif op == b'L':
+                (length,) = LITERAL.unpack(read_exact(stream, LITERAL.size))
+                if length > MAX_LITERAL_SIZE:
+                    raise DeltaError('Literal too long')
+                block = read_exact(stream, length)
+                literal += length
+                digest.update(block)
+                out.write(block)
+
+            else:
+                raise DeltaError(f'Unknown instruction {op!r}')
+
+def parse_signature(data):
+    """(block size, file size, {weak: [block index, ...]}, [strong digest, ...])"""
+    magic, block_size, size = SIGNATURE_HEADER.unpack_from(data)
+    if magic != SIGNATURE_MAGIC:
+        raise DeltaError('Not a signature')
+    blocks = {}
+    strong = []
+    for index, (weak, digest) in enumerate(SIGNATURE_ENTRY.iter_unpack(memoryview(data)[SIGNATURE_HEADER.size:])):
+        blocks.setdefault(weak, []).append(index)
+        strong.append(digest)
+    return block_size, size, blocks, strong
+
+def make_delta(signature, path):
+    """Yield the delta turning the signed file into the file at path.
+
+    Aligned unchanged blocks cost one checksum each; only around changes
+    does the weak checksum roll byte by byte until blocks line up again.
+    """
+    block_size, basis_size, blocks, strong = parse_signature(signature)
+    last_length = basis_size - (len(strong) - 1) * block_size if strong else 0
+    yield DELTA_HEADER.pack(DELTA_MAGIC, block_size)
+
+    size = os.path.getsize(path)
+    if size == 0:
+        yield b'E'
+        return
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        pending_copy = None  # (first block, count), merged while consecutive
+        literal_start = pos = 0
+        weak = None
+
+        def match(window_start, window_end, checksum):
+            length = window_end - window_start
+            digest = None
+            for index in blocks.get(checksum, ()):
+                expected = last_length if index == len(strong) - 1 else block_size
+                if expected != length:
+                    continue
+                if digest is None:
+                    digest = strong_digest(data[window_start:window_end])
+                if strong[index] == digest:
+                    return index
+            return None
+
+        def flush_literal(end):
+            for start in range(literal_start, end, MAX_LITERAL_SIZE):
+                chunk = data[start:min(end, start + MAX_LITERAL_SIZE)]
+                yield b'L' + LITERAL.pack(len(chunk)) + chunk
+
+        def flush_copy():
+            if pending_copy is not None:
+                yield b'C' + COPY.pack(*pending_copy)
+
+        while pos + block_size <= size:
+            if weak is None:
+                weak = zlib.adler32(data[pos:pos + block_size])
+            index = match(pos, pos + block_size, weak)
+            if index is not None:
+                if literal_start < pos:
+                    yield from flush_copy()
+                    pending_copy = None
+                    yield from flush_literal(pos)
+                if pending_copy is not None and sum(pending_copy) == index:
+                    pending_copy = (pending_copy[0], pending_copy[1] + 1)
+                else:
+                    yield from flush_copy()
+                    pending_copy = (index, 1)
+                pos += block_size
+                literal_start = pos
+                weak = None
+                continue
+
+            if pos + block_size == size:
+                pos += 1
+                break
+            # roll Adler-32 one byte forward
+            out_byte, in_byte = data[pos], data[pos + block_size]
+            a = ((weak & 0xffff) - out_byte + in_byte) % ADLER_MOD
+            b = ((weak >> 16) - block_size * out_byte + a - 1) % ADLER_MOD
+            weak = (b << 16) | a
+            pos += 1
+            if pos - literal_start >= MAX_LITERAL_SIZE:
+                yield from flush_copy()
+                pending_copy = None
+                yield from flush_literal(pos)
+                literal_start = pos
+
+        # a short last block can only match the stored file's short last block
+        if literal_start < size and size - literal_start == last_length != block_size:
+            if match(literal_start, size, zlib.adler32(data[literal_start:size])) == len(strong) - 1:
+                yield from flush_copy()
+                pending_copy = (len(strong) - 1, 1)
+                literal_start = size
+
+        yield from flush_copy()
+        yield from flush_literal(size)
+    yield b'E'
+
+def sync(base_url, path, name=None):
+    """Upload path as a new version of name on the server, sending only a delta.
+
+    Returns the server's response.
+    """
+    import json
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+
+    name = urllib.parse.quote(name or os.path.basename(path))
+    with urllib.request.urlopen(f'{base_url}/api/signature/{name}') as response:
+        etag = response.headers['ETag']
+        signature = response.read()
+
+    with open(path, 'rb') as f:
+        sha256 = hashlib.file_digest(f, 'sha256').hexdigest()
+    request = urllib.request.Request(
+        f'{base_url}/api/delta/{name}',
+        data=make_delta(signature, path),
+        method='POST',
+        # a generator body is sent with chunked transfer encoding
+        headers={'If-Match': etag, 'X-Content-Sha256': sha256, 'Content-Type': 'application/octet-stream'},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        return json.load(e)
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) not in (3, 4):
+        sys.exit('usage: python delta.py http://pi-ip:5000 FILE [NAME]')
+    print(sync(*sys.argv[1:]))
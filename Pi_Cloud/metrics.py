@@ -0,0 +1,237 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+from werkzeug.utils import secure_filename
+
+# Aggregate throughput is averaged over this many recent seconds
+RATE_WINDOW_SECONDS = 10
+
+class Transfer:
+    """One upload or download in flight"""
+
+    def __init__(self, transfer_id, kind, name, total):
+        self.id = transfer_id
+        self.kind = kind
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+
+    def to_info(self, now):
+        elapsed = max(now - self.started, 1e-6)
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'name': self.name,
+            'bytes': self.done,
+            'total': self.total,
+            'progress': round(self.done / self.total, 4) if self.total else None,
+            'bytes_per_second': round(self.done / elapsed),
+            'seconds': round(elapsed, 1),
+        }
+
+class TransferMetrics:
+    """Live uploads and downloads, plus running totals and recent throughput.
+
+    Counting happens per block as bytes move, so it costs a lock and two
+    additions per block rather than anything per byte.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.active = {}
+        self.totals = {kind: {'bytes': 0, 'completed': 0, 'failed': 0} for kind in ('upload', 'download')}
+        # (second, bytes) per kind, newest last
+        self.recent = {kind: deque() for kind in ('upload', 'download')}
+        self.started = time.time()
+
+    def start(self, kind, name, total=None):
+        transfer = Transfer(next(self.ids), kind, name, total)
+        with self.lock:
+            self.active[transfer.id] = transfer
+        return transfer
+
+    def add(self, transfer, count):
+        second = int(time.monotonic())
+        with self.lock:
+            transfer.done += count
+            self.totals[transfer.kind]['bytes'] += count
+            recent = self.recent[transfer.kind]
+            if recent and recent[-1][0] == second:
+                recent[-1][1] += count
+            else:
+                recent.append([second, count])
+                while recent[0][0] <= second - RATE_WINDOW_SECONDS:
+                    recent.popleft()
+
+    def finish(self, transfer, completed=True):
+        with self.lock:
+            if self.active.pop(transfer.id, None) is not None:
+                self.totals[transfer.kind]['completed' if completed else 'failed'] += 1
+
+    def snapshot(self):
+        now = time.monotonic()
+        second = int(now)
+        with self.lock:
+            transfers = [transfer.to_info(now) for transfer in self.active.values()]
+            throughput = {
+                kind: round(sum(count for at, count in recent if at > second - RATE_WINDOW_SECONDS)
+                            / RATE_WINDOW_SECONDS)
+                for kind, recent in self.recent.items()
+            }
+            totals = {kind: dict(counts) for kind, counts in self.totals.items()}
+        return {
+            'active': sorted(transfers, key=lambda transfer: transfer['id']),
+            'bytes_per_second': throughput,
+            'totals': totals,
+            'uptime_seconds': round(time.time() - self.started),
+        }
+
+class MeteredInput:
+    """wsgi.input that counts what the app reads from it"""
+
+    def __init__(self, stream, metrics, transfer):
+        self.stream = stream
+        self.metrics = metrics
+        self.transfer = transfer
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.metrics.add(self.transfer, len(data))
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.metrics.add(self.transfer, len(data))
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+class MeteredBody:
+    """Response iterable that counts what the server sends.
+
+    It takes the place of the app's iterable, so it's only used for bodies
+    the server would iterate anyway; see meter_file_wrapper for the others.
+    """
+
+    def __init__(self, body, metrics, transfer):
+        self.body = body
+        self.metrics = metrics
+        self.transfer = transfer
+        self.completed = False
+
+    def __iter__(self):
+        for block in self.body:
+            self.metrics.add(self.transfer, len(block))
+            yield block
+        self.completed = True
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.metrics.finish(self.transfer, self.completed)
+
+def meter_file_wrapper(body, metrics, transfer):
+    """Count a response the server may send with sendfile(2), which it only
+    does for an instance of its own wsgi.file_wrapper.
+
+    The wrapper is handed back as it is, so nothing is seen while the bytes
+    go out; they are counted when the server closes it. A server that read
+    through the wrapper moved the file offset that far; sendfile leaves the
+    offset alone, and then the whole Content-Length went out.
+    """
+    file = getattr(body, 'filelike', None)
+    try:
+        start = file.tell()
+    except Exception:
+        start = None
+    close = getattr(body, 'close', None)
+
+    def metered_close():
+        completed = False
+        try:
+            sent = 0
+            if start is not None and not file.closed:
+                sent = file.tell() - start
+            if sent <= 0:
+                sent = transfer.total or 0
+            metrics.add(transfer, sent)
+            completed = transfer.total is None or sent >= transfer.total
+            if close is not None:
+                close()
+        finally:
+            metrics.finish(transfer, completed)
+
+    body.close = metered_close
+    return body
+
+def transfer_kind(environ):
+    """'upload', 'download' or None for requests not worth tracking"""
+    path = environ.get('PATH_INFO', '')
+    method = environ.get('REQUEST_METHOD')
+    if method == 'GET' and path.startswith('/api/download') or path == '/api/download-zip':
+        return 'download'
+    if method in ('POST', 'PUT') and (
+        path == '/api/upload' or path.startswith('/api/delta/')
+        or path.startswith('/api/uploads/') and '/chunks/' in path
+    ):
+        return 'upload'
+    return None
+
+class TransferMeter:
+    """WSGI middleware feeding TransferMetrics.
+
+    The transfer is put in the environ as 'pi_cloud.transfer', so handlers
+    can give it a better name once they know one. A server that counted the
+    request body itself sets 'pi_cloud.input_metered'.
+    """
+
+    def __init__(self, wsgi_app, metrics):
+        self.wsgi_app = wsgi_app
+        self.metrics = metrics
+
+    def __call__(self, environ, start_response):
+        kind = transfer_kind(environ)
+        if kind is None:
+            return self.wsgi_app(environ, start_response)
+
+        # shown on the page, so never the raw path
+        name = secure_filename(environ.get('PATH_INFO', '').rsplit('/', 1)[-1])
+        if kind == 'upload':
+            if environ.get('pi_cloud.input_metered'):
+                return self.wsgi_app(environ, start_response)
+            transfer = self.metrics.start(kind, name, int(environ.get('CONTENT_LENGTH') or 0) or None)
+            environ['wsgi.input'] = MeteredInput(environ['wsgi.input'], self.metrics, transfer)
+        else:
+            transfer = self.metrics.start(kind, name)
+
+        environ['pi_cloud.transfer'] = transfer
+        status = {}
+
+        def metered_start_response(status_line, headers, exc_info=None):
+            status['code'] = int(status_line.split(' ', 1)[0])
+            if kind == 'download':
+                length = dict((key.lower(), value) for key, value in headers).get('content-length')
+                transfer.total = int(length) if length else None
+            return start_response(status_line, headers, exc_info)
+
+        try:
+            body = self.wsgi_app(environ, metered_start_response)
+        except Exception:
+            self.metrics.finish(transfer, completed=False)
+            raise
+
+        if kind == 'upload' or status.get('code', 500) >= 400:
+            # uploads have been read by the time the app returns
+            self.metrics.finish(transfer, completed=status.get('code', 500) < 400)
+            return body
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            return meter_file_wrapper(body, self.metrics, transfer)
+        return MeteredBody(body, self.metrics, transfer)
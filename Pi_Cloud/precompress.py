@@ -0,0 +1,96 @@
+import gzip
+import logging
+import os
+import shutil
+import threading
+
+try:
+    import zstandard
+except ImportError:  # zstd variants need the zstandard package
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Best first; the client's Accept-Encoding picks among these
+ENCODINGS = ('zstd', 'gzip') if zstandard is not None else ('gzip',)
+SUFFIXES = {'zstd': '.zst', 'gzip': '.gz'}
+
+# Compressed once in the background, so spend the CPU on ratio
+GZIP_LEVEL = 9
+ZSTD_LEVEL = 15
+MIN_SIZE = 1024
+MAX_SIZE = 512 * 1024 * 1024
+# Variants saving less than this are not worth keeping
+MIN_SAVING = 0.1
+COPY_BUFFER_SIZE = 1024 * 1024
+
+def variant_path(filepath, encoding):
+    return filepath + SUFFIXES[encoding]
+
+def fresh_variant(filepath, encoding, stat):
+    """The encoded copy of filepath if there is one for its current contents.
+
+    Variants carry the original's mtime, so a replaced original leaves a
+    stale variant that is simply ignored.
+    """
+    path = variant_path(filepath, encoding)
+    try:
+        variant_stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return path if variant_stat.st_mtime_ns == stat.st_mtime_ns else None
+
+def compress(filepath, encoding):
+    """Runs in a worker process: write filepath's variant, returns whether it was kept"""
+    stat = os.stat(filepath)
+    dest = variant_path(filepath, encoding)
+    tmp = f'{dest}.{os.getpid()}.tmp'
+    try:
+        with open(filepath, 'rb') as src, open(tmp, 'wb') as raw:
+            if encoding == 'zstd':
+                zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, raw, size=stat.st_size)
+            else:
+                with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=GZIP_LEVEL, mtime=0) as out:
+                    shutil.copyfileobj(src, out, COPY_BUFFER_SIZE)
+
+        if os.path.getsize(tmp) > stat.st_size * (1 - MIN_SAVING):
+            return False
+        os.utime(tmp, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        os.replace(tmp, dest)
+        return True
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+class Precompressor:
+    """Makes gzip/zstd copies of compressible files on a background executor,
+    so downloads can send them without compressing on the request path"""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.pending = set()
+
+    def schedule(self, filepath, size):
+        if not MIN_SIZE <= size <= MAX_SIZE:
+            return
+        for encoding in ENCODINGS:
+            key = (filepath, encoding)
+            with self.lock:
+                if key in self.pending:
+                    continue
+                self.pending.add(key)
+            future = self.executor.submit(compress, filepath, encoding)
+            future.add_done_callback(lambda f, key=key: self.done(key, f))
+
+    def done(self, key, future):
+        with self.lock:
+            self.pending.discard(key)
+        if future.exception() is not None:
+            logger.warning('Compressing %s with %s failed: %s', key[0], key[1], future.exception())
+
+    def remove(self, filepath):
+        for encoding in SUFFIXES:
+            path = variant_path(filepath, encoding)
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,142 @@
+import hashlib
+import io
+import os
+import zipfile
+import pytest
+import app as pi_cloud
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(pi_cloud.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(pi_cloud.app.config, 'DEDUP', False)
+    return pi_cloud.app.test_client()
+
+def upload(client, name, data, folder=None):
+    form = {'file': (io.BytesIO(data), name)}
+    if folder is not None:
+        form['folder'] = folder
+    response = client.post('/api/upload', data=form)
+    assert response.status_code == 200, response.json
+    return response.json['filename']
+
+def test_parse_ranges():
+    assert pi_cloud.parse_ranges('bytes=0-9') == [(0, 10)]
+    assert pi_cloud.parse_ranges('bytes=10-, -5') == [(10, None), (-5, None)]
+    assert pi_cloud.parse_ranges('bytes=5-9,0-6') == [(5, 10), (0, 7)]
+    for header in (None, '', 'items=0-1', 'bytes=5-2', 'bytes=a-b', 'bytes=-', 'bytes=1'):
+        assert pi_cloud.parse_ranges(header) is None
+
+    assert pi_cloud.resolve_ranges([(5, 10), (0, 7)], 100) == [(0, 10)]
+    assert pi_cloud.resolve_ranges([(-5, None)], 100) == [(95, 100)]
+    assert pi_cloud.resolve_ranges([(-500, None)], 100) == [(0, 100)]
+    assert pi_cloud.resolve_ranges([(90, 200)], 100) == [(90, 100)]
+    assert pi_cloud.resolve_ranges([(100, None)], 100) == []
+
+def test_download_ranges(client):
+    data = os.urandom(10000)
+    upload(client, 'clip.7z', data)
+
+    response = client.get('/api/download/clip.7z', headers={'Range': 'bytes=10-19'})
+    assert response.status_code == 206
+    assert response.data == data[10:20]
+    assert response.headers['Content-Range'] == 'bytes 10-19/10000'
+
+    response = client.get('/api/download/clip.7z', headers={'Range': 'bytes=20000-'})
+    assert response.status_code == 416
+
+    response = client.get('/api/download/clip.7z', headers={'Range': 'bytes=0-1,100-102'})
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert b'Content-Range: bytes 0-1/10000\r\n\r\n' + data[0:2] in response.data
+    assert b'Content-Range: bytes 100-102/10000\r\n\r\n' + data[100:103] in response.data
+
+    etag = client.get('/api/download/clip.7z').headers['ETag']
+    assert client.get('/api/download/clip.7z', headers={'If-None-Match': etag}).status_code == 304
+
+def test_chunked_upload_resume_and_checksum(client):
+    data = os.urandom(2500)
+    sha256 = hashlib.sha256(data).hexdigest()
+    response = client.post('/api/uploads', json={'filename': 'big.7z', 'size': len(data), 'chunk_size': 1000})
+    assert response.json['total_chunks'] == 3
+    upload_id = response.json['upload_id']
+    chunks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+
+    response = client.put(f'/api/uploads/{upload_id}/chunks/0', data=chunks[0][:10])
+    assert response.status_code == 400
+    response = client.put(f'/api/uploads/{upload_id}/chunks/0', data=chunks[0],
+                          headers={'X-Chunk-Sha256': '0' * 64})
+    assert response.status_code == 400
+    for index in (2, 0):
+        response = client.put(f'/api/uploads/{upload_id}/chunks/{index}', data=chunks[index],
+                              headers={'X-Chunk-Sha256': hashlib.sha256(chunks[index]).hexdigest()})
+        assert response.status_code == 200
+
+    assert client.get(f'/api/uploads/{upload_id}').json['missing'] == [1]
+    response = client.post(f'/api/uploads/{upload_id}/complete', json={})
+    assert response.status_code == 409
+    assert response.json['missing'] == [1]
+
+    client.put(f'/api/uploads/{upload_id}/chunks/1', data=chunks[1])
+    response = client.post(f'/api/uploads/{upload_id}/complete', json={'sha256': '0' * 64})
+    assert response.status_code == 400
+    assert response.json['sha256'] == sha256
+    # the chunks are kept, so the client can complete again
+    assert client.get(f'/api/uploads/{upload_id}').json['missing'] == []
+
+    response = client.post(f'/api/uploads/{upload_id}/complete', json={'sha256': sha256})
+    assert response.status_code == 200
+    assert response.json['filename'] == 'big.7z'
+    # a retry gets the same result instead of a second copy
+    assert client.post(f'/api/uploads/{upload_id}/complete', json={}).json == response.json
+    assert client.get('/api/download/big.7z').data == data
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+
+def test_download_zip_streams_selected_files(client):
+    first, second = os.urandom(3000), b'hello ' * 500
+    upload(client, 'one.7z', first)
+    upload(client, 'two.txt', second, folder='docs')
+
+    response = client.get('/api/download-zip', query_string=[('files', 'one.7z'), ('files', 'two.txt'),
+                                                             ('name', 'bundle')])
+    assert response.status_code == 200
+    assert 'bundle.zip' in response.headers['Content-Disposition']
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    assert archive.testzip() is None
+    assert archive.read('one.7z') == first
+    assert archive.read('two.txt') == second
+
+    assert client.get('/api/download-zip').status_code == 400
+    assert client.get('/api/download-zip', query_string={'files': 'missing.txt'}).status_code == 404
+
+def test_dedup_references_release_their_blob(client, monkeypatch):
+    monkeypatch.setitem(pi_cloud.app.config, 'DEDUP', True)
+    data = os.urandom(5000)
+    sha256 = hashlib.sha256(data).hexdigest()
+    catalog = pi_cloud.get_catalog()
+
+    assert [upload(client, name, data) for name in ('a.7z', 'b.7z')] == ['a.7z', 'b.7z']
+    assert catalog.blob_for('a.7z') == catalog.blob_for('b.7z') == sha256
+    assert os.path.exists(pi_cloud.blob_path(sha256))
+
+    response = client.post('/api/rename/a.7z', json={'name': 'c.7z'})
+    assert response.json == {'success': True, 'filename': 'c.7z'}
+    assert catalog.blob_for('c.7z') == sha256
+    assert client.get('/api/download/c.7z').data == data
+
+    client.delete('/api/delete/b.7z')
+    assert os.path.exists(pi_cloud.blob_path(sha256))
+    client.delete('/api/delete/c.7z')
+    assert not os.path.exists(pi_cloud.blob_path(sha256))
+    assert catalog.blob_size(sha256) is None
+
+def test_rescan_keeps_blob_backed_names(client, monkeypatch, tmp_path):
+    monkeypatch.setitem(pi_cloud.app.config, 'DEDUP', True)
+    data = os.urandom(5000)
+    upload(client, 'a.7z', data)
+    (tmp_path / 'a.7z').write_bytes(b'stray copy')
+
+    catalog = pi_cloud.get_catalog()
+    catalog.reconcile()
+    assert catalog.blob_for('a.7z') == hashlib.sha256(data).hexdigest()
+    assert client.get('/api/download/a.7z').data == data
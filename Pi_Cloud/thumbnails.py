@@ -0,0 +1,136 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # previews for images need Pillow
+    Image = None
+
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORT = True
+except ImportError:
+    HEIF_SUPPORT = False
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = shutil.which('ffmpeg')
+
+THUMBNAIL_SIZE = 256
+VIDEO_FRAME_SECONDS = 1
+FFMPEG_TIMEOUT_SECONDS = 60
+# Files past this many waiting are skipped; they get queued again when the
+# UI asks for their preview
+MAX_PENDING = 1000
+
+def lower_priority():
+    """Worker process initializer: never compete with uploads for the CPU"""
+    os.nice(19)
+
+def render_image(source, dest, size):
+    with Image.open(source) as image:
+        # JPEG can decode straight to a fraction of full size, much cheaper
+        # than decoding a 12 MP photo and scaling it down
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        image.convert('RGB').save(dest, 'JPEG', quality=80)
+
+def render_video(source, dest, size):
+    subprocess.run(
+        [FFMPEG, '-loglevel', 'error', '-y', '-ss', str(VIDEO_FRAME_SECONDS), '-i', source,
+         '-frames:v', '1', '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+         '-f', 'image2', dest],
+        check=True,
+        timeout=FFMPEG_TIMEOUT_SECONDS,
+        stdin=subprocess.DEVNULL,
+    )
+
+def render(source, dest, mime, size):
+    """Runs in a worker process; writes the preview to dest atomically"""
+    tmp = f'{dest}.{os.getpid()}.tmp'
+    try:
+        if mime.startswith('video/'):
+            render_video(source, tmp, size)
+        else:
+            render_image(source, tmp, size)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def background_pool(workers):
+    """Low-priority worker processes for previews and other post-upload work"""
+    # spawn: forking a threaded web server is asking for trouble
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=lower_priority,
+    )
+
+class Thumbnailer:
+    """Generates previews on a pool of low-priority worker processes.
+
+    Previews are cached as <cache_dir>/<key>-<size>.jpg, where key identifies
+    the file's content, so a preview is made once per distinct file.
+    """
+
+    def __init__(self, cache_dir, executor, size=THUMBNAIL_SIZE):
+        self.cache_dir = cache_dir
+        self.executor = executor
+        self.size = size
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.failed = set()
+
+    def supported(self, mime):
+        if mime.startswith('video/'):
+            return FFMPEG is not None
+        if mime == 'image/heic':
+            return Image is not None and HEIF_SUPPORT
+        return mime.startswith('image/') and Image is not None
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}-{self.size}.jpg')
+
+    def cached(self, key):
+        path = self.cache_path(key)
+        return path if os.path.exists(path) else None
+
+    def schedule(self, key, source, mime):
+        """Queue a preview unless it exists, is queued, failed before or isn't supported.
+        Returns whether one is (or will be) available."""
+        if not self.supported(mime):
+            return False
+        with self.lock:
+            if key in self.failed:
+                return False
+            if key in self.pending or self.cached(key):
+                return True
+            if len(self.pending) >= MAX_PENDING:
+                return True
+            self.pending.add(key)
+
+        future = self.executor.submit(render, source, self.cache_path(key), mime, self.size)
+        future.add_done_callback(lambda f: self.done(key, f))
+        return True
+
+    def done(self, key, future):
+        with self.lock:
+            self.pending.discard(key)
+            if future.exception() is not None:
+                # corrupt or unreadable files: don't retry on every page view
+                self.failed.add(key)
+                logger.warning('Preview failed for %s: %s', key, future.exception())
+
+    def remove(self, key):
+        path = self.cache_path(key)
+        if os.path.exists(path):
+            os.remove(path)
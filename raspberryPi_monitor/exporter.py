@@ -0,0 +1,147 @@
+"""HTTP exporter for the monitor's sampler.
+
+    GET /metrics        Prometheus text format
+    GET /metrics.json   the newest sample of every group as JSON
+
+Responses come from a body cached per content type and rendered again only
+after the sampler has taken a new sample, so a scrape never calls psutil or
+starts a subprocess, however often it comes.
+"""
+import itertools
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+JSON_CONTENT_TYPE = 'application/json'
+
+# (name, type, help, group, value of the group's sample)
+METRICS = [
+    ('pi_uptime_seconds', 'gauge', 'Seconds since boot', 'system', lambda values: values['uptime_seconds']),
+    ('pi_cpu_usage_percent', 'gauge', 'CPU use since the previous sample', 'cpu', lambda values: values['percent']),
+    ('pi_cpu_frequency_mhz', 'gauge', 'Current CPU frequency', 'cpu', lambda values: values['frequency']),
+    ('pi_cpu_temperature_celsius', 'gauge', 'CPU temperature', 'temperature', lambda values: values['celsius']),
+    ('pi_memory_total_bytes', 'gauge', 'Total memory', 'memory', lambda values: values['total']),
+    ('pi_memory_used_bytes', 'gauge', 'Used memory', 'memory', lambda values: values['used']),
+    ('pi_memory_available_bytes', 'gauge', 'Available memory', 'memory', lambda values: values['available']),
+    ('pi_swap_total_bytes', 'gauge', 'Total swap', 'memory', lambda values: values['swap_total']),
+    ('pi_swap_used_bytes', 'gauge', 'Used swap', 'memory', lambda values: values['swap_used']),
+    ('pi_network_sent_bytes_total', 'counter', 'Bytes sent on all interfaces', 'network',
+     lambda values: values['bytes_sent']),
+    ('pi_network_received_bytes_total', 'counter', 'Bytes received on all interfaces', 'network',
+     lambda values: values['bytes_recv']),
+]
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(**pairs):
+    return '{' + ','.join(f'{key}="{escape_label(value)}"' for key, value in pairs.items()) + '}'
+
+def render_prometheus(snapshot):
+    """Prometheus text exposition of a sampler snapshot; groups not sampled
+    yet, or whose last sample failed, are left out"""
+    def values(group):
+        entry = snapshot.get(group)
+        if entry is None or 'error' in entry[1]:
+            return None
+        return entry[1]
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        samples = [(label, value) for label, value in samples if value is not None]
+        if samples:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(f'{name}{label} {value}' for label, value in samples)
+
+    for name, kind, help_text, group, extract in METRICS:
+        group_values = values(group)
+        metric(name, kind, help_text, [('', extract(group_values))] if group_values else [])
+
+    system = values('system')
+    if system:
+        metric('pi_load_average', 'gauge', 'System load average',
+               [(labels(period=period), system[f'load{period}']) for period in (1, 5, 15)])
+
+    disk = values('disk')
+    partitions = [partition for partition in disk['partitions'] if 'percent' in partition] if disk else []
+    for field, help_text in (('total', 'Size'), ('used', 'Used space'), ('free', 'Free space')):
+        metric(f'pi_filesystem_{field}_bytes', 'gauge', f'{help_text} of the filesystem', [
+            (labels(device=partition['device'], mountpoint=partition['mountpoint']), partition[field])
+            for partition in partitions
+        ])
+
+    services = values('services')
+    if services:
+        metric('pi_service_active', 'gauge', '1 if systemctl reports the service active', [
+            (labels(service=service), int(status == 'active')) for service, status in services.items()
+        ])
+
+    metric('pi_sample_timestamp_seconds', 'gauge', 'When each metric group was last sampled', [
+        (labels(group=group), round(entry[0], 3)) for group, entry in sorted(snapshot.items())
+    ])
+    return '\n'.join(lines) + '\n'
+
+def render_json(snapshot):
+    return json.dumps({group: {'timestamp': timestamp, **values} for group, (timestamp, values) in snapshot.items()})
+
+class Exporter:
+    """Serves a Sampler's snapshots, re-rendering them only after new samples"""
+
+    RENDERERS = {
+        '/metrics': (PROMETHEUS_CONTENT_TYPE, render_prometheus),
+        '/metrics.json': (JSON_CONTENT_TYPE, render_json),
+    }
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.lock = threading.Lock()
+        self.samples = itertools.count(1)
+        self.version = 0
+        # path -> (version, body)
+        self.cache = {}
+        sampler.listeners.append(self.sampled)
+
+    def sampled(self, group, timestamp, values):
+        # all a sample costs the exporter; next() on a count is atomic
+        self.version = next(self.samples)
+
+    def body(self, path):
+        """(content type, body bytes) for path, None if it isn't served"""
+        if path not in self.RENDERERS:
+            return None
+        content_type, render = self.RENDERERS[path]
+        version = self.version
+        cached = self.cache.get(path)
+        if cached is None or cached[0] != version:
+            with self.lock:
+                cached = self.cache.get(path)
+                if cached is None or cached[0] != version:
+                    cached = (version, render(self.sampler.snapshot()).encode())
+                    self.cache[path] = cached
+        return content_type, cached[1]
+
+    def serve(self, host, port):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                found = exporter.body(self.path.split('?', 1)[0])
+                if found is None:
+                    self.send_error(404)
+                    return
+                content_type, body = found
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
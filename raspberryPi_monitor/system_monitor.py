@@ -5,8 +5,57 @@ import os
 import subprocess
 import datetime
 import argparse
+import threading
+from collections import deque
 from pathlib import Path
 
+from exporter import Exporter
+from timeseries import DEFAULT_ARCHIVES, RoundRobinStore, parse_archive
+
+# Seconds between samples of each metric group: cheap counters often,
+# subprocesses and filesystem calls rarely
+DEFAULT_RATES = {
+    'system': 5.0,
+    'cpu': 1.0,
+    'temperature': 5.0,
+    'memory': 2.0,
+    'disk': 30.0,
+    'network': 1.0,
+    'services': 30.0,
+}
+# Samples kept per group
+HISTORY_SIZE = 300
+# cpu_percent needs this long between readings to mean anything
+MIN_CPU_INTERVAL = 0.1
+# What --store keeps: {group: {metric: function of the group's sample}}
+STORED_METRICS = {
+    'system': {
+        'load1': lambda values: values['load1'],
+        'load5': lambda values: values['load5'],
+        'load15': lambda values: values['load15'],
+    },
+    'cpu': {
+        'cpu_percent': lambda values: values['percent'],
+        'cpu_frequency_mhz': lambda values: values['frequency'],
+    },
+    'temperature': {
+        'cpu_temperature_celsius': lambda values: values['celsius'],
+    },
+    'memory': {
+        'memory_percent': lambda values: values['percent'],
+        'memory_used_bytes': lambda values: values['used'],
+        'swap_percent': lambda values: values['swap_percent'],
+    },
+    'disk': {
+        'root_disk_percent': lambda values: next(
+            (partition.get('percent') for partition in values['partitions'] if partition['mountpoint'] == '/'), None),
+    },
+    'network': {
+        'network_send_bytes_per_second': lambda values: values['send_rate'],
+        'network_recv_bytes_per_second': lambda values: values['recv_rate'],
+    },
+}
+
 class Colors:
     HEADER = '\033[95m'
     BLUE = '\033[94m'
@@ -41,10 +90,13 @@ def get_cpu_temp():
             return None
     return None
 
+def get_uptime_seconds():
+    with open('/proc/uptime', 'r') as f:
+        return float(f.readline().split()[0])
+
 def get_uptime():
     """get system uptime"""
-    with open('/proc/uptime', 'r') as f:
-        uptime_seconds = float(f.readline().split()[0])
+    uptime_seconds = get_uptime_seconds()
 
     days, remainder = divmod(uptime_seconds, 86400)
     hours, remainder = divmod(remainder, 3600)
@@ -69,75 +121,246 @@ def check_services(services):
             results[service] = f"Error: {str(e)}"
     return results
 
-def display_system_info(log_file=None, services_to_check=None):
-    """Display system info"""
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    output = []
-    output.append(f"{Colors.HEADER}{Colors.BOLD}=== SYSTEM MONITOR - {now} ==={Colors.ENDC}")
-
-    output.append(f"\n{Colors.BOLD}SYSTEM:{Colors.ENDC}")
-    output.append(f"Uptime: {get_uptime()}")
+def sample_system():
     load1, load5, load15 = get_load_average()
-    output.append(f"Load Average: {load1:.2f}, {load5:.2f}, {load15:.2f} (1, 5, 15 min)")
+    return {"uptime": get_uptime(), "uptime_seconds": get_uptime_seconds(),
+            "load1": load1, "load5": load5, "load15": load15}
 
-    output.append(f"\n{Colors.BOLD}CPU:{Colors.ENDC}")
-    cpu_percent = psutil.cpu_percent(interval=1)
-    cpu_color = Colors.GREEN if cpu_percent < 70 else Colors.YELLOW if cpu_percent < 90 else Colors.RED
-    output.append(f"Usage: {cpu_color}{cpu_percent}%{Colors.ENDC}")
+class CpuSampler:
+    """cpu_percent since the previous sample, without blocking for an interval"""
 
-    cpu_freq = psutil.cpu_freq()
-    if cpu_freq:
-        output.append(f"Frequency: Current={cpu_freq.current:.1f}MHz")
+    def __init__(self):
+        # the first reading only sets the baseline
+        psutil.cpu_percent(interval=None)
+        self.last = time.monotonic()
 
-    cpu_temp = get_cpu_temp()
-    if cpu_temp is not None:
-        temp_color = Colors.GREEN if cpu_temp < 60 else Colors.YELLOW if cpu_temp < 90 else Colors.RED
-        output.append(f"Temperature: {temp_color}{cpu_temp:.1f}°C{Colors.ENDC}")
+    def __call__(self):
+        wait = MIN_CPU_INTERVAL - (time.monotonic() - self.last)
+        if wait > 0:
+            time.sleep(wait)
+        self.last = time.monotonic()
+        cpu_freq = psutil.cpu_freq()
+        return {
+            "percent": psutil.cpu_percent(interval=None),
+            "frequency": cpu_freq.current if cpu_freq else None,
+        }
 
-    output.append(f"\n{Colors.BOLD}MEMORY:{Colors.ENDC}")
-    svmem = psutil.virtual_memory()
-    memory_percent = svmem.percent
-    memory_color = Colors.Green if memory_percent < 70 else Colors.YELLOW if memory_percent < 90 else Colors.RED
-    output.append(f"Total: {get_size(svmem.total)}")
-    output.append(f"Used: {get_size(svmem.used)} ({memory_color}{memory_percent}%{Colors.ENDC})")
-    output.append(f"Free: {get_size(svmem.available)}")
+def sample_temperature():
+    return {"celsius": get_cpu_temp()}
 
+def sample_memory():
+    svmem = psutil.virtual_memory()
     swap = psutil.swap_memory()
-    output.append(f"\n{Colors.BOLD}SWAP:{Colors.ENDC}")
-    swap_percent = swap.percent
-    swap_color = Colors.GREEN if swap_percent < 70 else Colors.YELLOW if swap_percent < 90 else Colors.RED
-    output.append(f"Total: {get_size(swap.total)}")
-    output.append(f"Used: {get_size(swap.used)} ({swap_color}{swap_percent}%{Colors.ENDC})")
-    output.append(f"Free: {get_size(swap.free)}")
-
-    output.append(f"\n{Colors.BOLD}DISK USAGE:{Colors.ENDC}")
-    partitions = psutil.disk_partitions()
-    for partition in partitions:
+    return {
+        "total": svmem.total, "used": svmem.used, "available": svmem.available, "percent": svmem.percent,
+        "swap_total": swap.total, "swap_used": swap.used, "swap_free": swap.free, "swap_percent": swap.percent,
+    }
+
+def sample_disk():
+    partitions = []
+    for partition in psutil.disk_partitions():
         if partition.fstype:
+            entry = {"device": partition.device, "mountpoint": partition.mountpoint}
             try:
                 partition_usage = psutil.disk_usage(partition.mountpoint)
-                disk_percent = partition_usage.percent
-                disk_color = Colors.GREEN if disk_percent < 70 else Colors.YELLOW if disk_percent< 90 else Colors.RED
-                output.append(f"=== {partition.device} ({partition.mountpoint}) ===")
-                output.append(f"Total: {get_size(partition_usage.total)}")
-                output.append(f"Used: {get_size(partition_usage.used)} ({disk_color}{disk_percent}%{Colors.ENDC})")
-                output.append(f"Free: {get_size(partition_usage.free)}")
+                entry.update(total=partition_usage.total, used=partition_usage.used,
+                             free=partition_usage.free, percent=partition_usage.percent)
             except PermissionError:
-                output.append(f"=== {partition.device} ({partition.mountpoint}) === [No access]")
+                pass
+            partitions.append(entry)
+    return {"partitions": partitions}
+
+class NetworkSampler:
+    """Network totals, and bytes per second since the previous sample"""
 
-    output.append(f"\n{Colors.BOLD}NETWORK:{Colors.ENDC}")
-    net_io = psutil.net_io_counters()
-    output.append(f"Total sent: {get_size(net_io.bytes_sent)}")
-    output.append(f"Total received: {get_size(net_io.bytes_recv)}")
+    def __init__(self):
+        self.previous = None
 
+    def __call__(self):
+        now = time.monotonic()
+        net_io = psutil.net_io_counters()
+        sample = {"bytes_sent": net_io.bytes_sent, "bytes_recv": net_io.bytes_recv,
+                  "send_rate": None, "recv_rate": None}
+        if self.previous is not None:
+            then, sent, received = self.previous
+            elapsed = max(now - then, 1e-6)
+            sample["send_rate"] = max(0, net_io.bytes_sent - sent) / elapsed
+            sample["recv_rate"] = max(0, net_io.bytes_recv - received) / elapsed
+        self.previous = (now, net_io.bytes_sent, net_io.bytes_recv)
+        return sample
+
+def metric_groups(services_to_check=None):
+    """{group name: function returning a fresh sample of that group}"""
+    groups = {
+        "system": sample_system,
+        "cpu": CpuSampler(),
+        "temperature": sample_temperature,
+        "memory": sample_memory,
+        "disk": sample_disk,
+        "network": NetworkSampler(),
+    }
     if services_to_check:
+        groups["services"] = lambda: check_services(services_to_check)
+    return groups
+
+class Sampler:
+    """Samples each metric group on its own thread at its own rate.
+
+    Every sample goes into the group's ring buffer of the last `history`
+    samples, and the newest one into the snapshot, so readers never wait
+    for psutil or a subprocess: a slow `systemctl` delays only the services
+    group.
+    """
+
+    def __init__(self, groups, rates=None, history=HISTORY_SIZE):
+        self.groups = groups
+        self.rates = {name: (rates or {}).get(name, DEFAULT_RATES.get(name, 1.0)) for name in groups}
+        self.buffers = {name: deque(maxlen=history) for name in groups}
+        self.latest = {}
+        self.stopped = threading.Event()
+        self.ready = threading.Event()
+        self.threads = []
+        # called with (group, timestamp, values) after every sample
+        self.listeners = []
+
+    def run(self, name):
+        sample, rate = self.groups[name], self.rates[name]
+        next_due = time.monotonic()
+        while not self.stopped.is_set():
+            try:
+                values = sample()
+            except Exception as e:
+                values = {"error": str(e)}
+            entry = (time.time(), values)
+            self.buffers[name].append(entry)
+            # replacing a key is atomic, so snapshot() needs no lock
+            self.latest[name] = entry
+            if len(self.latest) == len(self.groups):
+                self.ready.set()
+            for listener in self.listeners:
+                listener(name, *entry)
+            # keep to the schedule, but don't catch up on missed samples
+            next_due = max(next_due + rate, time.monotonic())
+            self.stopped.wait(next_due - time.monotonic())
+
+    def start(self):
+        for name in self.groups:
+            thread = threading.Thread(target=self.run, args=(name,), name=f"sampler-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def wait_ready(self, timeout=None):
+        """Wait until every group has been sampled once"""
+        return self.ready.wait(timeout)
+
+    def snapshot(self):
+        """{group: (timestamp, values)} with the newest sample of each group"""
+        return dict(self.latest)
+
+    def history(self, name):
+        """The buffered samples of a group, oldest first"""
+        return list(self.buffers[name])
+
+class StoreRecorder:
+    """Sampler listener that puts every sample of the stored metrics into a RoundRobinStore"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def __call__(self, group, timestamp, values):
+        metrics = STORED_METRICS.get(group)
+        if not metrics or "error" in values:
+            return
+        self.store.update(timestamp, {name: extract(values) for name, extract in metrics.items()})
+
+def stored_metric_names():
+    return [name for metrics in STORED_METRICS.values() for name in metrics]
+
+def level_color(percent, warning=70, critical=90):
+    return Colors.GREEN if percent < warning else Colors.YELLOW if percent < critical else Colors.RED
+
+def render(snapshot):
+    """The report for a snapshot as a list of lines; groups not sampled yet are left out"""
+    def values(name):
+        entry = snapshot.get(name)
+        if entry is None or "error" in entry[1]:
+            return None
+        return entry[1]
+
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    output = []
+    output.append(f"{Colors.HEADER}{Colors.BOLD}=== SYSTEM MONITOR - {now} ==={Colors.ENDC}")
+
+    system = values("system")
+    if system:
+        output.append(f"\n{Colors.BOLD}SYSTEM:{Colors.ENDC}")
+        output.append(f"Uptime: {system['uptime']}")
+        output.append(f"Load Average: {system['load1']:.2f}, {system['load5']:.2f}, {system['load15']:.2f} (1, 5, 15 min)")
+
+    cpu = values("cpu")
+    temperature = values("temperature")
+    if cpu:
+        output.append(f"\n{Colors.BOLD}CPU:{Colors.ENDC}")
+        cpu_percent = cpu["percent"]
+        output.append(f"Usage: {level_color(cpu_percent)}{cpu_percent}%{Colors.ENDC}")
+        if cpu["frequency"] is not None:
+            output.append(f"Frequency: Current={cpu['frequency']:.1f}MHz")
+        if temperature and temperature["celsius"] is not None:
+            cpu_temp = temperature["celsius"]
+            output.append(f"Temperature: {level_color(cpu_temp, 60)}{cpu_temp:.1f}°C{Colors.ENDC}")
+
+    memory = values("memory")
+    if memory:
+        output.append(f"\n{Colors.BOLD}MEMORY:{Colors.ENDC}")
+        memory_percent = memory["percent"]
+        output.append(f"Total: {get_size(memory['total'])}")
+        output.append(f"Used: {get_size(memory['used'])} ({level_color(memory_percent)}{memory_percent}%{Colors.ENDC})")
+        output.append(f"Free: {get_size(memory['available'])}")
+
+        output.append(f"\n{Colors.BOLD}SWAP:{Colors.ENDC}")
+        swap_percent = memory["swap_percent"]
+        output.append(f"Total: {get_size(memory['swap_total'])}")
+        output.append(f"Used: {get_size(memory['swap_used'])} ({level_color(swap_percent)}{swap_percent}%{Colors.ENDC})")
+        output.append(f"Free: {get_size(memory['swap_free'])}")
+
+    disk = values("disk")
+    if disk:
+        output.append(f"\n{Colors.BOLD}DISK USAGE:{Colors.ENDC}")
+        for partition in disk["partitions"]:
+            if "percent" not in partition:
+                output.append(f"=== {partition['device']} ({partition['mountpoint']}) === [No access]")
+                continue
+            disk_percent = partition["percent"]
+            output.append(f"=== {partition['device']} ({partition['mountpoint']}) ===")
+            output.append(f"Total: {get_size(partition['total'])}")
+            output.append(f"Used: {get_size(partition['used'])} ({level_color(disk_percent)}{disk_percent}%{Colors.ENDC})")
+            output.append(f"Free: {get_size(partition['free'])}")
+
+    network = values("network")
+    if network:
+        output.append(f"\n{Colors.BOLD}NETWORK:{Colors.ENDC}")
+        output.append(f"Total sent: {get_size(network['bytes_sent'])}")
+        output.append(f"Total received: {get_size(network['bytes_recv'])}")
+        if network["send_rate"] is not None:
+            output.append(f"Rate: {get_size(network['send_rate'])}/s sent, {get_size(network['recv_rate'])}/s received")
+
+    service_status = values("services")
+    if service_status:
         output.append(f"\n{Colors.BOLD}SERVICES:{Colors.ENDC}")
-        service_status = check_services(services_to_check)
         for service, status in service_status.items():
             status_color = Colors.GREEN if status == "active" else Colors.RED
             output.append(f"{service}: {status_color}{status}{Colors.ENDC}")
-    
+
+    return output
+
+def display_system_info(snapshot, log_file=None):
+    """Display system info from a sampler snapshot"""
+    output = render(snapshot)
     print("\n".join(output))
 
     if log_file:
@@ -151,23 +374,78 @@ def display_system_info(log_file=None, services_to_check=None):
         with open(log_file, "a") as f:
             f.write(clean_output + "\n\n")
 
+def parse_rate(text):
+    """'cpu=0.5' -> ('cpu', 0.5)"""
+    name, _, seconds = text.partition('=')
+    if name not in DEFAULT_RATES:
+        raise argparse.ArgumentTypeError(f"unknown metric group '{name}' (choose from {', '.join(DEFAULT_RATES)})")
+    try:
+        seconds = float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' should look like {name}=SECONDS")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(f"the rate of '{name}' must be positive")
+    return name, seconds
+
+def parse_address(text):
+    """'9100' or 'HOST:9100' -> (host, port); all interfaces by default"""
+    host, _, port = text.rpartition(':')
+    try:
+        return host or '0.0.0.0', int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{text}' should be PORT or HOST:PORT")
+
 def main():
     parser = argparse.ArgumentParser(description='System resourse monitor for Raspberry Pi')
-    parser.add_argument('-i', '--interval', type=int, default=60, help='Monitoring interval in seconds (default: 60)')
+    parser.add_argument('-i', '--interval', type=float, default=60, help='Monitoring interval in seconds (default: 60)')
     parser.add_argument('-l', '--log', type=str, default=None, help='log file path (default: None)')
     parser.add_argument('-s', '--services', type=str, nargs='+', default=None, help='Services to monitor (e.g. nginx, postgresql ...)')
+    parser.add_argument('-r', '--rate', type=parse_rate, nargs='+', default=[], metavar='GROUP=SECONDS',
+                        help=f"Sampling rate per metric group, e.g. cpu=0.5 disk=60 (groups: {', '.join(DEFAULT_RATES)})")
+    parser.add_argument('--history', type=int, default=HISTORY_SIZE, help=f'Samples kept in memory per group (default: {HISTORY_SIZE})')
+    parser.add_argument('--store', type=str, default=None,
+                        help='Round-robin history file: every sample at several resolutions in a fixed size (query with timeseries.py)')
+    parser.add_argument('--archives', type=parse_archive, nargs='+', default=DEFAULT_ARCHIVES, metavar='STEP:SPAN',
+                        help='Resolutions kept by --store (default: 1s:1h 1m:7d 1h:365d)')
+    parser.add_argument('--serve', type=parse_address, default=None, metavar='[HOST:]PORT',
+                        help='Also serve metrics over HTTP at /metrics (Prometheus) and /metrics.json')
     args = parser.parse_args()
 
     print(f"System monitor started. Press Ctrl+C to exit")
     print(f"Monitoring every {args.interval} seconds")
+    if args.serve:
+        print(f"Serving metrics on http://{args.serve[0]}:{args.serve[1]}/metrics")
     if args.log:
         print(f"Logging to {args.log}")
     
+    sampler = Sampler(metric_groups(args.services), dict(args.rate), args.history)
+    store = None
+    if args.store:
+        try:
+            store = RoundRobinStore(args.store, stored_metric_names(), args.archives)
+        except ValueError as e:
+            parser.error(str(e))
+        sampler.listeners.append(StoreRecorder(store))
+        print(f"Recording history to {args.store}")
+    server = Exporter(sampler).serve(*args.serve) if args.serve else None
+    sampler.start()
+    if server:
+        # scrapes are answered from the exporter's cache, so the server's
+        # thread never waits on the display loop or the other way round
+        threading.Thread(target=server.serve_forever, name='exporter', daemon=True).start()
     try:
+        # every group once before the first report; a stuck one doesn't hold it up forever
+        sampler.wait_ready(timeout=5)
         while True:
-            display_system_info(args.log, args.services)
+            display_system_info(sampler.snapshot(), args.log)
             time.sleep(args.interval)
     except KeyboardInterrupt:
+        if server:
+            server.shutdown()
+            server.server_close()
+        sampler.stop()
+        if store:
+            store.flush()
         print("\nMonitoring stopped")
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Fixed-size round-robin store for monitor history.
+
+One file holds every metric at several resolutions, each a ring of rows
+that wraps around, so the file never grows: the defaults keep 1 second
+for an hour, 1 minute for a week and 1 hour for a year in a few MB. Each
+row holds, per metric, the sample count and the average, minimum and
+maximum of the samples in its step. Samples are consolidated into the
+current row of every archive as they arrive, so the coarse archives are
+always up to date and a restart picks up where it left off.
+
+The file is memory-mapped: a sample changes a few bytes in the current row
+of each archive, and the kernel writes dirty pages back in batches. Rows
+are written in time order, so writes sweep through each ring.
+
+Layout, little-endian:
+    b'PIRR', version (u16), metric count (u16), archive count (u16),
+    per archive: step seconds (u32), rows (u32),
+    metric names joined by '\\n' (u32 length + UTF-8),
+    then page-aligned per archive, rows of:
+    bucket start (i64, 0 for never written),
+    per metric: samples (u32), average, minimum, maximum (f32)
+
+Query a store from the command line:
+
+    python timeseries.py monitor.rrd cpu_percent --since 1d --cf max
+"""
+import argparse
+import datetime
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'PIRR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHH')
+ARCHIVE = struct.Struct('<II')
+NAMES_LENGTH = struct.Struct('<I')
+PAGE_SIZE = mmap.PAGESIZE
+
+# (step seconds, rows): 1s for an hour, 1min for a week, 1h for a year
+DEFAULT_ARCHIVES = [(1, 3600), (60, 7 * 24 * 60), (3600, 365 * 24)]
+CONSOLIDATIONS = ('avg', 'min', 'max')
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400, 'y': 365 * 86400}
+
+def parse_duration(text):
+    """'90', '5m', '7d' -> seconds"""
+    text = text.strip().lower()
+    if text and text[-1] in DURATION_UNITS:
+        return int(float(text[:-1]) * DURATION_UNITS[text[-1]])
+    return int(text)
+
+def parse_archive(text):
+    """'1m:7d' -> (60, 10080): one row per step for the span"""
+    step, _, span = text.partition(':')
+    step, span = parse_duration(step), parse_duration(span)
+    if step <= 0 or span < step:
+        raise ValueError(f"'{text}' should be STEP:SPAN with 0 < STEP <= SPAN")
+    return step, span // step
+
+def align(offset):
+    return -(-offset // PAGE_SIZE) * PAGE_SIZE
+
+def consolidate(cells, samples):
+    """Add [(metric index, value)] to a row's [count, sum, min, max] cells"""
+    for i, value in samples:
+        cell = cells[i]
+        cell[0] += 1
+        cell[1] += value
+        cell[2] = min(cell[2], value)
+        cell[3] = max(cell[3], value)
+
+class RoundRobinStore:
+    """A store file, created with the given metrics and archives if missing.
+
+    An existing file has to have been created with the same metrics and
+    archives; the layout of a round-robin file can't change in place.
+    """
+
+    def __init__(self, path, metrics, archives=DEFAULT_ARCHIVES):
+        self.path = path
+        self.metrics = list(metrics)
+        self.archives = sorted((int(step), int(rows)) for step, rows in archives)
+        self.index = {name: i for i, name in enumerate(self.metrics)}
+        self.row = struct.Struct('<q' + 'Ifff' * len(self.metrics))
+        self.lock = threading.Lock()
+
+        names = '\n'.join(self.metrics).encode()
+        header = (HEADER.pack(MAGIC, VERSION, len(self.metrics), len(self.archives))
+                  + b''.join(ARCHIVE.pack(step, rows) for step, rows in self.archives)
+                  + NAMES_LENGTH.pack(len(names)) + names)
+        self.offsets = []
+        offset = align(len(header))
+        for step, rows in self.archives:
+            self.offsets.append(offset)
+            offset = align(offset + rows * self.row.size)
+        size = offset
+
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(header)
+                # sparse until written; zeroed rows read as never written
+                f.truncate(size)
+        self.file = open(path, 'r+b')
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        if self.map[:len(header)] != header or len(self.map) != size:
+            stored_metrics, stored_archives = read_layout(self.map)
+            self.close()
+            raise ValueError(
+                f'{path} was created for metrics {stored_metrics} and archives {stored_archives}; '
+                'use another file or delete it to start over'
+            )
+
+        # per archive: [bucket, per metric [count, sum, min, max]] of the row
+        # being filled
+        self.current = [None] * len(self.archives)
+
+    def row_offset(self, archive, bucket):
+        step, rows = self.archives[archive]
+        return self.offsets[archive] + (bucket // step) % rows * self.row.size
+
+    def read_row(self, archive, bucket):
+        """[bucket, cells] of the row that bucket maps to, None if it holds another bucket"""
+        fields = self.row.unpack_from(self.map, self.row_offset(archive, bucket))
+        if fields[0] != bucket:
+            return None
+        cells = []
+        for i in range(len(self.metrics)):
+            count, average, minimum, maximum = fields[1 + 4 * i:5 + 4 * i]
+            cells.append([count, average * count, minimum, maximum] if count else [0, 0.0, math.inf, -math.inf])
+        return [bucket, cells]
+
+    def empty_row(self, bucket):
+        return [bucket, [[0, 0.0, math.inf, -math.inf] for _ in self.metrics]]
+
+    def write_row(self, archive, current):
+        bucket, cells = current
+        fields = [bucket]
+        for count, total, minimum, maximum in cells:
+            fields += [count, total / count, minimum, maximum] if count else [0, math.nan, math.nan, math.nan]
+        self.row.pack_into(self.map, self.row_offset(archive, bucket), *fields)
+
+    def update(self, timestamp, values):
+        """Consolidate {metric: value} sampled at timestamp into every archive.
+        Metrics this store doesn't have and None values are ignored."""
+        samples = [(self.index[name], float(value)) for name, value in values.items()
+                   if name in self.index and value is not None]
+        if not samples:
+            return
+        second = int(timestamp)
+        with self.lock:
+            for archive, (step, rows) in enumerate(self.archives):
+                bucket = second // step * step
+                current = self.current[archive]
+                if current is not None and bucket < current[0]:
+                    # late, e.g. a slow group's sample after a faster group
+                    # started the next bucket: its row is still in the ring
+                    # unless the ring has wrapped around since
+                    if current[0] - bucket < step * rows:
+                        late = self.read_row(archive, bucket) or self.empty_row(bucket)
+                        consolidate(late[1], samples)
+                        self.write_row(archive, late)
+                    continue
+                if current is None or current[0] != bucket:
+                    # a row already written for this bucket, e.g. before a restart, is continued
+                    current = self.read_row(archive, bucket) or self.empty_row(bucket)
+                    self.current[archive] = current
+                consolidate(current[1], samples)
+                self.write_row(archive, current)
+
+    def fetch(self, metric, start, end=None, consolidation='avg'):
+        """[(bucket start, value)] of metric between start and end, from the
+        finest archive that reaches back to start; buckets without samples
+        are left out"""
+        end = time.time() if end is None else end
+        i = self.index[metric]
+        field = 2 + 4 * i + CONSOLIDATIONS.index(consolidation)
+        archive = next((a for a, (step, rows) in enumerate(self.archives) if step * rows >= end - start),
+                       len(self.archives) - 1)
+        step, rows = self.archives[archive]
+
+        points = []
+        first = max(int(start) // step * step, (int(end) // step - rows + 1) * step)
+        with self.lock:
+            for bucket in range(first, int(end) + 1, step):
+                fields = self.row.unpack_from(self.map, self.row_offset(archive, bucket))
+                if fields[0] == bucket and fields[1 + 4 * i]:
+                    points.append((bucket, fields[field]))
+        return points
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        if not self.map.closed:
+            self.map.close()
+        self.file.close()
+
+def read_layout(data):
+    """(metric names, archives) from a store's header"""
+    magic, version, metric_count, archive_count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return None, None
+    offset = HEADER.size
+    archives = []
+    for _ in range(archive_count):
+        archives.append(ARCHIVE.unpack_from(data, offset))
+        offset += ARCHIVE.size
+    (length,) = NAMES_LENGTH.unpack_from(data, offset)
+    offset += NAMES_LENGTH.size
+    names = bytes(data[offset:offset + length]).decode().split('\n')
+    return names, archives
+
+def open_store(path):
+    """Open an existing store with the layout in its header"""
+    with open(path, 'rb') as f:
+        metrics, archives = read_layout(f.read(PAGE_SIZE))
+    if metrics is None:
+        raise ValueError(f'{path} is not a monitor history store')
+    return RoundRobinStore(path, metrics, archives)
+
+def main():
+    parser = argparse.ArgumentParser(description='Query a monitor history store')
+    parser.add_argument('store', help='Store file written by system_monitor.py --store')
+    parser.add_argument('metric', nargs='?', help='Metric to print (default: list the metrics)')
+    parser.add_argument('--since', type=parse_duration, default=parse_duration('1h'), help='How far back, e.g. 90m, 7d (default: 1h)')
+    parser.add_argument('--cf', choices=CONSOLIDATIONS, default='avg', help='Consolidation function (default: avg)')
+    args = parser.parse_args()
+
+    store = open_store(args.store)
+    try:
+        if args.metric is None:
+            print('\n'.join(store.metrics))
+            return
+        if args.metric not in store.index:
+            parser.error(f"no metric '{args.metric}' in {args.store}")
+        for bucket, value in store.fetch(args.metric, time.time() - args.since, consolidation=args.cf):
+            print(f"{datetime.datetime.fromtimestamp(bucket):%Y-%m-%d %H:%M:%S} {value:.2f}")
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,42 @@
+from typing import Iterator, Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
 from app import models, schemas
 from app.core.security import pwd_context
+from app.core.sharding import todo_session
 from app.config import settings
 from app.database import get_db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
-def get_current_user(
-        db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
-) -> models.User:
-    """Get current user based on JWT token"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-
+def get_user_from_token(db: Session, token: str) -> Optional[models.User]:
+    """Resolve a JWT to its user, None if the token is invalid or the user is gone"""
     try:
         payload = jwt.decode(
             token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
         )
         email: str = payload.get("sub")
         if email is None:
-            raise credentials_exception
+            return None
         token_data = schemas.TokenData(email=email)
     except JWTError:
-        raise credentials_exception
-    
-    user = db.query(models.User).filter(models.User.email == token_data.email).first()
+        return None
+
+    return db.query(models.User).filter(models.User.email == token_data.email).first()
+
+def get_current_user(
+        db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
+) -> models.User:
+    """Get current user based on JWT token"""
+    user = get_user_from_token(db, token)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
     return user
 
@@ -40,4 +44,11 @@ def get_current_active_user(current_user: models.User = Depends(get_current_user
     """Get current active user"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user
\ No newline at end of file
+    return current_user
+
+def get_todo_db(
+    db: Session = Depends(get_db), current_user: models.User = Depends(get_current_active_user)
+) -> Iterator[Session]:
+    """Session for the current user's todos: their shard in sharded mode, else the main database"""
+    with todo_session(current_user, db) as todo_db:
+        yield todo_db
\ No newline at end of file
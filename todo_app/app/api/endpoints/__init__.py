@@ -1 +1 @@
-from app.api.endpoints import auth, todos
\ No newline at end of file
+from app.api.endpoints import auth, metrics, todo_events, todos
\ No newline at end of file
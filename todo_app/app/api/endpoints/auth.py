@@ -3,7 +3,7 @@ from typing import Any
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from app import models, schemas
+from app import database, models, schemas
 from app.api import deps
 from app.core import security
 from app.config import settings
@@ -23,6 +23,9 @@ def register(user_in: schemas.UserCreate, db: Session = Depends(get_db)) -> Any:
     
     user = models.User(email= user_in.email, hashed_password=security.get_password_hash(user_in.password))
     db.add(user)
+    if database.sharding_enabled():
+        db.flush()
+        user.shard_id = database.shard_for_user_id(user.id, len(database.shard_sessions))
     db.commit()
     db.refresh(user)
 
@@ -0,0 +1,21 @@
+from typing import Any
+from fastapi import APIRouter, Depends, HTTPException, status
+from app import models
+from app.api import deps
+from app.config import settings
+from app.core import instrumentation
+
+router = APIRouter()
+
+@router.get("/db")
+def read_db_metrics(
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """Aggregate SQL statistics per route since startup.
+
+    Statement text and timings describe the whole deployment, so the
+    endpoint only exists when DB_METRICS_ENABLED is set.
+    """
+    if not settings.DB_METRICS_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    return {"routes": instrumentation.metrics.snapshot()}
@@ -0,0 +1,161 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, Depends, Header, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from app import models
+from app.api import deps
+from app.core import changes, events, serialization, sharding
+from app.database import get_db
+
+router = APIRouter()
+
+HEARTBEAT_SECONDS = 15
+REPLAY_BATCH_SIZE = 1000
+
+def _replay(db: Session, owner_id: int, since: int) -> List[dict]:
+    """Everything in the change log after `since`, as events"""
+    replayed = []
+    while True:
+        rows, has_more = changes.changes_since(db, owner_id, since, REPLAY_BATCH_SIZE)
+        replayed.extend(events.replay_event(change, todo) for change, todo in rows)
+        if not has_more:
+            return replayed
+        since = rows[-1][0].id
+
+def _catch_up(db: Session, owner_id: int, since: int, live: Dict[int, dict]) -> List[dict]:
+    """Changes after `since` from the log, preferring the live event (with its
+    exact type) where the log still has it. Reads in a session of its own,
+    closed right after, so an idle stream holds no read transaction open."""
+    with Session(bind=db.get_bind()) as log_db:
+        return [live.get(event["id"], event) for event in _replay(log_db, owner_id, since)]
+
+async def _next_events(db: Session, owner_id: int, last_sent: int, first: Optional[dict], subscription):
+    """Events to send after a wakeup, in change log order; None once the subscription overflowed.
+
+    Writers commit in change id order (SQLite has one writer at a time) but
+    publish after committing, so two of them can deliver their events out of
+    order. Filtering on id > last_sent would then drop the later-delivered
+    lower id for good, so the live events only signal that something
+    changed, and the log is re-read from last_sent.
+    """
+    live = {}
+    for event in [first, *subscription.drain()]:
+        if event is None:
+            return None
+        live[event["id"]] = event
+    if max(live) <= last_sent:
+        return []
+    return await run_in_threadpool(_catch_up, db, owner_id, last_sent, live)
+
+async def _subscribe_and_replay(db: Session, owner_id: int, last_event_id: Optional[int]):
+    """Subscribe first, then replay, so nothing committed in between is missed.
+
+    Without a last event id the client only wants what changes from now on,
+    so the cursor starts at the newest change already in the log.
+    """
+    hub = events.get_hub()
+    subscription = hub.subscribe(owner_id)
+    if last_event_id is None:
+        return hub, subscription, [], await run_in_threadpool(changes.latest_change_id, db, owner_id)
+    replayed = await run_in_threadpool(_replay, db, owner_id, last_event_id)
+    last_sent = replayed[-1]["id"] if replayed else last_event_id
+    return hub, subscription, replayed, last_sent
+
+@router.get("/events")
+async def stream_events(
+    *,
+    db: Session = Depends(deps.get_todo_db),
+    last_event_id: Optional[int] = Query(None, ge=0),
+    last_event_id_header: Optional[int] = Header(None, alias="Last-Event-ID"),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """Server-sent events for the user's todo changes.
+
+    Browsers resend Last-Event-ID on reconnect; missed changes are replayed
+    from the change log before live events.
+    """
+    since = last_event_id_header if last_event_id_header is not None else last_event_id
+    hub, subscription, replayed, last_sent = await _subscribe_and_replay(db, current_user.id, since)
+
+    async def generate():
+        nonlocal last_sent
+        try:
+            for event in replayed:
+                yield events.format_sse(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                pending = await _next_events(db, current_user.id, last_sent, event, subscription)
+                if pending is None:
+                    return
+                for event in pending:
+                    last_sent = event["id"]
+                    yield events.format_sse(event)
+        finally:
+            hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.websocket("/ws")
+async def websocket_events(
+    websocket: WebSocket,
+    token: str = Query(...),
+    last_event_id: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(get_db),
+):
+    """WebSocket variant of /events. Browsers can't set headers on a
+    WebSocket, so the access token is passed as a query parameter."""
+    user = await run_in_threadpool(deps.get_user_from_token, db, token)
+    if user is None or not user.is_active:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    with sharding.todo_session(user, db) as todo_db:
+        await _websocket_stream(websocket, todo_db, user.id, last_event_id)
+
+async def _websocket_stream(websocket: WebSocket, db: Session, owner_id: int, last_event_id: Optional[int]):
+    # subscribed before accepting, so once connected a client gets every later change
+    hub, subscription, replayed, last_sent = await _subscribe_and_replay(db, owner_id, last_event_id)
+    receiver = getter = None
+    try:
+        await websocket.accept()
+        receiver = asyncio.ensure_future(websocket.receive())
+        for event in replayed:
+            await websocket.send_text(serialization.dumps(event).decode())
+
+        while True:
+            if getter is None:
+                getter = asyncio.ensure_future(subscription.get())
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+
+            if receiver in done:
+                if receiver.result()["type"] == "websocket.disconnect":
+                    return
+                # clients have nothing to say, keep listening for the disconnect
+                receiver = asyncio.ensure_future(websocket.receive())
+
+            if getter in done:
+                pending = await _next_events(db, owner_id, last_sent, getter.result(), subscription)
+                getter = None
+                if pending is None:
+                    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                    return
+                for event in pending:
+                    last_sent = event["id"]
+                    await websocket.send_text(serialization.dumps(event).decode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in (getter, receiver):
+            if task is not None and not task.done():
+                task.cancel()
+        hub.unsubscribe(subscription)
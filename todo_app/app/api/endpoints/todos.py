@@ -1,109 +1,261 @@
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+from typing import Any, List, Optional
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from app import models, schemas
 from app.api import deps
-from app.database import get_db
+from app.core import archive, changes, events, search, serialization, stats, transfer
 
 router = APIRouter()
 
 @router.get("/", response_model=List[schemas.Todo])
 def read_todos(
-    db: Session = Depends(get_db),
+    request: Request,
+    db: Session = Depends(deps.get_todo_db),
     skip: int = 0,
     limit: int =100,
+    include_archived: bool = False,
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
-    """Retrieve todos for current user"""
-    todos = (
-        db.query(models.Todo)
-        .filter(models.Todo.owner_id == current_user.id)
-        .offset(skip)
-        .limit(limit)
-        .all()
+    """Retrieve todos for current user, archived ones too with include_archived"""
+    cursor, archived = archive.list_version(db, current_user.id)
+    etag = changes.make_etag("todos", cursor, archived, skip, limit, int(include_archived))
+    if changes.etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    # Plain column rows encoded directly: no ORM identity map, no per-item validation
+    if include_archived:
+        todos = archive.todo_rows(current_user.id)
+        rows = db.execute(select(todos).order_by(todos.c.id).offset(skip).limit(limit)).all()
+    else:
+        rows = (
+            db.query(*serialization.TODO_COLUMNS)
+            .filter(models.Todo.owner_id == current_user.id)
+            .order_by(models.Todo.id)
+            .offset(skip)
+            .limit(limit)
+            .all()
+        )
+    return Response(
+        content=serialization.todo_rows_to_json(rows),
+        media_type="application/json",
+        headers={"ETag": etag},
     )
-    return todos
 
 @router.post("/", response_model=schemas.Todo, status_code=status.HTTP_201_CREATED)
 def create_todo(
     *,
-    db: Session = Depends(get_db),
+    db: Session = Depends(deps.get_todo_db),
     todo_in: schemas.ToDoCreate,
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
     """Create todo"""
     todo = models.Todo(**todo_in.model_dump(), owner_id=current_user.id)
     db.add(todo)
+    db.flush()
+    stats.todo_created(db, todo)
+    event = events.todo_event("create", changes.record_change(db, todo), todo)
     db.commit()
+    events.publish(event)
     db.refresh(todo)
     return todo
 
+@router.get("/search", response_model=schemas.TodoSearchResults)
+def search_todos(
+    *,
+    db: Session = Depends(deps.get_todo_db),
+    q: str = Query(..., min_length=1),
+    completed: Optional[bool] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    prefix: bool = True,
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """Full-text search over title and description, best matches first"""
+    try:
+        items, next_cursor = search.search_todos(
+            db,
+            current_user.id,
+            q,
+            completed=completed,
+            created_after=created_after,
+            created_before=created_before,
+            cursor=cursor,
+            limit=limit,
+            prefix=prefix,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.get("/stats", response_model=schemas.TodoStats)
+def read_stats(
+    *,
+    db: Session = Depends(deps.get_todo_db),
+    days: int = Query(30, ge=1, le=366),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """Total/completed/open counts and completions per day over the last `days` days"""
+    return stats.get_stats(db, current_user.id, days=days)
+
+@router.get("/export")
+def export_todos(
+    *,
+    db: Session = Depends(deps.get_todo_db),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """Stream all of the user's todos as NDJSON or CSV"""
+    owner_id = current_user.id
+    bind = db.get_bind()
+
+    def generate():
+        # Own session: the request-scoped one may be closed before streaming ends
+        export_db = Session(bind=bind)
+        try:
+            yield from transfer.export_todos(export_db, owner_id, format)
+        finally:
+            export_db.close()
+
+    return StreamingResponse(
+        generate(),
+        media_type=transfer.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="todos.{format}"'},
+    )
+
+@router.post("/import", response_model=schemas.TodoImportResult)
+def import_todos(
+    *,
+    db: Session = Depends(deps.get_todo_db),
+    file: UploadFile = File(...),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """Create todos from an NDJSON or CSV upload, in batched transactions"""
+    return transfer.import_todos(db, current_user.id, file.file, format)
+
+@router.get("/changes", response_model=schemas.TodoChanges)
+def read_changes(
+    *,
+    db: Session = Depends(deps.get_todo_db),
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=1000),
+    current_user: models.User = Depends(deps.get_current_active_user),
+) -> Any:
+    """Todos created, updated or deleted after the `since` cursor.
+
+    Pass the returned cursor back as `since` on the next call; keep paging
+    while `has_more` is true. Deleted todos come back as tombstones.
+    """
+    rows, has_more = changes.changes_since(db, current_user.id, since, limit)
+
+    return {
+        "changes": [
+            {
+                "id": change.todo_id,
+                "revision": change.revision,
+                "deleted": change.deleted,
+                "changed_at": change.changed_at,
+                "todo": None if change.deleted else todo,
+            }
+            for change, todo in rows
+        ],
+        "cursor": rows[-1][0].id if rows else since,
+        "has_more": has_more,
+    }
+
 @router.get("/{todo_id}", response_model=schemas.Todo)
 def read_todo(
     *,
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(deps.get_todo_db),
     todo_id: int,
+    include_archived: bool = False,
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
     """get todo by id"""
-    todo = db.query(models.Todo).filter(models.Todo.id == todo_id, models.Todo.owner_id == current_user.id).first()
+    todo = archive.get_todo(db, current_user.id, todo_id, include_archived=include_archived)
     if not todo:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Todo not found")
-    
+
+    etag = changes.make_etag("todo", todo.id, todo.revision)
+    if changes.etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
     return todo
 
 @router.put("/{todo_id}", response_model=schemas.Todo)
 def update_todo(
     *,
-    db: Session = Depends(get_db),
+    db: Session = Depends(deps.get_todo_db),
     todo_id: int,
     todo_in: schemas.TodoUpdate,
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
     """update todo"""
-    todo = db.query(models.Todo).filter(models.Todo.id, models.Todo.owner_id == current_user.id).first()
+    todo = archive.get_todo_for_update(db, current_user.id, todo_id)
     if not todo:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Todo not found")
     
     update_data = todo_in.model_dump(exclude_unset=True)
+    completed = update_data.pop("completed", None)
+    if completed is not None:
+        stats.set_completed(db, todo, completed)
     for field, value in update_data.items():
         setattr(todo, field, value)
+    todo.revision += 1
 
     db.add(todo)
+    event = events.todo_event("update", changes.record_change(db, todo), todo)
     db.commit()
+    events.publish(event)
     db.refresh(todo)
     return todo
 
-@router.delete("/{todo_id}", response_model=schemas.Todo)
+@router.delete("/{todo_id}", status_code=status.HTTP_204_NO_CONTENT, response_model=None)
 def delete_todo(
     *,
-    db: Session = Depends(get_db),
+    db: Session = Depends(deps.get_todo_db),
     todo_id: int,
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
-    todo = db.query(models.Todo).filter(models.Todo.id, models.Todo.owner_id == current_user.id).first()
+    todo = archive.get_todo_for_update(db, current_user.id, todo_id)
     if not todo:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Todo not found")
     
+    todo.revision += 1
+    event = events.todo_event("delete", changes.record_change(db, todo, deleted=True), None)
+    stats.todo_deleted(db, todo)
     db.delete(todo)
     db.commit()
+    events.publish(event)
     return None
 
 @router.patch("/{todo_id}/toggle", response_model=schemas.Todo)
 def toggle_todo_completed(
     *,
-    db: Session = Depends(get_db),
+    db: Session = Depends(deps.get_todo_db),
     todo_id: int,
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
-    """Toggle todo completed status"""
-    todo = db.query(models.Todo).filter(models.Todo.id, models.Todo.owner_id == current_user.id).first()
+    """Toggle todo completed status, un-completing an archived todo restores it"""
+    todo = archive.get_todo_for_update(db, current_user.id, todo_id)
     if not todo:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Todo not found")
     
-    todo.completed = not todo.completed
+    stats.set_completed(db, todo, not todo.completed)
+    todo.revision += 1
 
     db.add(todo)
+    event = events.todo_event("toggle", changes.record_change(db, todo), todo)
     db.commit()
+    events.publish(event)
     db.refresh(todo)
     return todo
\ No newline at end of file
@@ -7,10 +7,25 @@ class Settings(BaseSettings):
 
     DATABASE_NAME: str = "todo.db"
 
+    # 0 keeps everything in DATABASE_NAME; N > 0 spreads todos over N files
+    SHARD_COUNT: int = 0
+    SHARD_DATABASE_TEMPLATE: str = "todo_shard_{shard}.db"
+
+    # Completed todos older than this move to archived_todos, e.g. 30; 0 (the
+    # default) disables it, archived todos are only visible with include_archived
+    ARCHIVE_AFTER_DAYS: int = 0
+    ARCHIVE_INTERVAL_SECONDS: int = 3600
+    ARCHIVE_BATCH_SIZE: int = 500
+
     SECRET_KEY: str = "THE_SECRET_KEY"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    SQL_SLOW_QUERY_MS: float = 100.0
+    SQL_N_PLUS_ONE_THRESHOLD: int = 5
+    # Serve per-route SQL statistics, statement text included, at /metrics/db
+    DB_METRICS_ENABLED: bool = False
+
     class Config:
         case_sensitive = True
 
@@ -0,0 +1,170 @@
+"""Hot/cold archival of completed todos.
+
+Completed todos older than ARCHIVE_AFTER_DAYS are moved from todos into the
+compact archived_todos table in batches, each batch in its own transaction,
+so list queries and indexes only cover live data. Archived todos keep their
+ids and still count in the stats; writing to one restores it first.
+
+Archiving is off unless ARCHIVE_AFTER_DAYS is set; once on, clients only
+see archived todos by asking for include_archived. Run an archival pass by
+hand with:
+
+    ARCHIVE_AFTER_DAYS=30 python -m app.core.archive
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import delete, func, insert, select, union_all
+from sqlalchemy.orm import Session
+from app import database, models
+from app.config import settings
+from app.core import serialization, stats
+
+logger = logging.getLogger("app.archive")
+
+ARCHIVED_COLUMNS = tuple(getattr(models.ArchivedTodo, field) for field in serialization.TODO_FIELDS)
+
+# Columns copied between todos and archived_todos
+_COPIED = [column.name for column in models.Todo.__table__.columns]
+
+def archive_completed(
+    db: Session,
+    older_than: timedelta,
+    batch_size: int = 500,
+    now: Optional[datetime] = None,
+) -> int:
+    """Move todos completed before now - older_than to the archive, returns how many moved"""
+    cutoff = (now or datetime.now()) - older_than
+    moved = 0
+    last_id = 0
+    while True:
+        rows = (
+            db.query(models.Todo.id, models.Todo.owner_id)
+            .filter(
+                models.Todo.completed.is_(True),
+                models.Todo.completed_at < cutoff,
+                models.Todo.id > last_id,
+            )
+            .order_by(models.Todo.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return moved
+
+        # the conditions are checked again in the statements that move the
+        # rows: a todo reopened or deleted since the select above stays put
+        ids = [todo_id for todo_id, _ in rows]
+        still_archivable = (
+            models.Todo.id.in_(ids),
+            models.Todo.completed.is_(True),
+            models.Todo.completed_at < cutoff,
+        )
+        db.execute(
+            insert(models.ArchivedTodo).from_select(
+                _COPIED,
+                select(*(models.Todo.__table__.c[name] for name in _COPIED)).where(*still_archivable),
+            )
+        )
+        # the insert took SQLite's write lock, so this deletes exactly the rows it copied
+        owners = db.execute(
+            delete(models.Todo).where(*still_archivable).returning(models.Todo.owner_id)
+        ).scalars().all()
+        for owner_id, count in Counter(owners).items():
+            stats.todos_archived(db, owner_id, count)
+        db.commit()
+
+        moved += len(owners)
+        last_id = ids[-1]
+
+def restore(db: Session, owner_id: int, todo_id: int) -> Optional[models.Todo]:
+    """Move an archived todo back into todos, in the caller's transaction"""
+    archived = (
+        db.query(models.ArchivedTodo)
+        .filter(models.ArchivedTodo.id == todo_id, models.ArchivedTodo.owner_id == owner_id)
+        .first()
+    )
+    if archived is None:
+        return None
+
+    todo = models.Todo(**{name: getattr(archived, name) for name in _COPIED})
+    db.delete(archived)
+    db.add(todo)
+    db.flush()
+    stats.todos_archived(db, owner_id, -1)
+    return todo
+
+def get_todo(db: Session, owner_id: int, todo_id: int, include_archived: bool = False):
+    """The user's todo by id, falling back to the archive when include_archived"""
+    todo = db.query(models.Todo).filter(models.Todo.id == todo_id, models.Todo.owner_id == owner_id).first()
+    if todo is None and include_archived:
+        todo = (
+            db.query(models.ArchivedTodo)
+            .filter(models.ArchivedTodo.id == todo_id, models.ArchivedTodo.owner_id == owner_id)
+            .first()
+        )
+    return todo
+
+def get_todo_for_update(db: Session, owner_id: int, todo_id: int) -> Optional[models.Todo]:
+    """The user's live todo by id, restoring it from the archive if needed"""
+    todo = get_todo(db, owner_id, todo_id)
+    if todo is None:
+        todo = restore(db, owner_id, todo_id)
+    return todo
+
+def todo_rows(owner_id: int):
+    """Live and archived todos of a user as one subquery with TODO_FIELDS columns"""
+    return union_all(
+        select(*serialization.TODO_COLUMNS).where(models.Todo.owner_id == owner_id),
+        select(*ARCHIVED_COLUMNS).where(models.ArchivedTodo.owner_id == owner_id),
+    ).subquery()
+
+def list_version(db: Session, owner_id: int) -> Tuple[int, int]:
+    """(latest change cursor, archived count) in one query, for list ETags.
+
+    Archiving doesn't touch the change log, the archived count covers it.
+    """
+    cursor = (
+        select(func.max(models.TodoChange.id)).where(models.TodoChange.owner_id == owner_id).scalar_subquery()
+    )
+    archived = select(models.TodoStats.archived).where(models.TodoStats.owner_id == owner_id).scalar_subquery()
+    row = db.execute(select(cursor, archived)).one()
+    return row[0] or 0, row[1] or 0
+
+def archive_all() -> int:
+    """One archival pass over every database holding todos; nothing moves
+    unless ARCHIVE_AFTER_DAYS is set"""
+    if settings.ARCHIVE_AFTER_DAYS <= 0:
+        return 0
+    moved = 0
+    for make_session in database.todo_sessionmakers():
+        db = make_session()
+        try:
+            moved += archive_completed(
+                db, timedelta(days=settings.ARCHIVE_AFTER_DAYS), batch_size=settings.ARCHIVE_BATCH_SIZE
+            )
+        finally:
+            db.close()
+    return moved
+
+async def run_periodically() -> None:
+    """Background archiver, started with the app when ARCHIVE_AFTER_DAYS is set"""
+    while True:
+        await asyncio.sleep(settings.ARCHIVE_INTERVAL_SECONDS)
+        try:
+            moved = await run_in_threadpool(archive_all)
+        except Exception:
+            logger.exception("Archival pass failed")
+        else:
+            if moved:
+                logger.info("Archived %d completed todos", moved)
+
+if __name__ == "__main__":
+    from app.database import Base, engine, shard_engines
+
+    for bind in [engine, *shard_engines]:
+        Base.metadata.create_all(bind=bind)
+    print(f"Archived {archive_all()} todos")
@@ -0,0 +1,85 @@
+from typing import List, Optional, Tuple
+from fastapi import Request
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from app import models
+
+def record_change(db: Session, todo: models.Todo, deleted: bool = False) -> models.TodoChange:
+    """Log a change to a todo in the caller's transaction.
+
+    Earlier entries for the same todo are superseded, so the log holds at most
+    one row per todo (a tombstone once it is deleted). The todo must already
+    have an id, i.e. the caller flushes new rows first. The entry is flushed
+    so its id can be used as the event id before committing.
+    """
+    db.query(models.TodoChange).filter(
+        models.TodoChange.owner_id == todo.owner_id,
+        models.TodoChange.todo_id == todo.id,
+    ).delete(synchronize_session=False)
+
+    change = models.TodoChange(
+        owner_id=todo.owner_id,
+        todo_id=todo.id,
+        revision=todo.revision,
+        deleted=deleted,
+    )
+    db.add(change)
+    db.flush()
+    return change
+
+def record_created_bulk(db: Session, owner_id: int, todo_ids: List[int]) -> None:
+    """Log a batch of freshly inserted todos (revision 1, nothing to supersede)"""
+    db.execute(
+        insert(models.TodoChange),
+        [{"owner_id": owner_id, "todo_id": todo_id, "revision": 1, "deleted": False} for todo_id in todo_ids],
+    )
+
+def latest_change_id(db: Session, owner_id: int) -> int:
+    """Id of the user's newest change log entry, 0 if there is none"""
+    latest = db.query(func.max(models.TodoChange.id)).filter(models.TodoChange.owner_id == owner_id).scalar()
+    return latest or 0
+
+def changes_since(
+    db: Session, owner_id: int, since: int, limit: int
+) -> Tuple[List[Tuple[models.TodoChange, Optional[models.Todo]]], bool]:
+    """Changes after the cursor in log order, each paired with the todo (None for tombstones).
+
+    Archived todos are still live for clients, so they are looked up too.
+    """
+    rows = (
+        db.query(models.TodoChange, models.Todo, models.ArchivedTodo)
+        .outerjoin(
+            models.Todo,
+            (models.Todo.id == models.TodoChange.todo_id) & (models.Todo.owner_id == models.TodoChange.owner_id),
+        )
+        .outerjoin(
+            models.ArchivedTodo,
+            (models.ArchivedTodo.id == models.TodoChange.todo_id)
+            & (models.ArchivedTodo.owner_id == models.TodoChange.owner_id),
+        )
+        .filter(models.TodoChange.owner_id == owner_id, models.TodoChange.id > since)
+        .order_by(models.TodoChange.id)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    return [(change, todo or archived) for change, todo, archived in rows[:limit]], has_more
+
+def make_etag(*parts) -> str:
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match header matches etag (weak comparison)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set
+from app import models
+from app.core import serialization
+
+# Subscribers that fall this far behind are cut off; they reconnect and resume
+# from their last event id via the change log.
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+def todo_event(event_type: str, change: models.TodoChange, todo: Optional[models.Todo]) -> dict:
+    """Event payload for a change that has been flushed but not yet committed.
+
+    The event id is the change log id, so a client can resume from the last
+    id it saw through GET /todos/changes or the Last-Event-ID replay.
+    """
+    return {
+        "id": change.id,
+        "type": event_type,
+        "owner_id": change.owner_id,
+        "todo_id": change.todo_id,
+        "revision": change.revision,
+        "todo": None if todo is None else {field: getattr(todo, field) for field in serialization.TODO_FIELDS},
+    }
+
+def replay_event(change: models.TodoChange, todo: Optional[models.Todo]) -> dict:
+    """Event for a change log entry. The log keeps only the latest change per
+    todo, so replayed updates and toggles are both reported as "update"."""
+    if change.deleted:
+        event_type = "delete"
+    elif change.revision == 1:
+        event_type = "create"
+    else:
+        event_type = "update"
+    return todo_event(event_type, change, None if change.deleted else todo)
+
+class Subscription:
+    """One connected client's queue, bound to the event loop serving it"""
+
+    def __init__(self, owner_id: int, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.owner_id = owner_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, event: dict) -> None:
+        """Runs on self.loop"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # None tells the reader to drop the connection so the client resumes
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self) -> Optional[dict]:
+        return await self.queue.get()
+
+    def drain(self) -> List[Optional[dict]]:
+        """Whatever else is queued, without waiting"""
+        pending = []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        return pending
+
+class EventHub(ABC):
+    """Fan-out of committed todo changes to a user's connected clients.
+
+    The in-process hub only reaches clients connected to the same worker.
+    When running several workers, install a broker-backed implementation
+    (e.g. Redis pub/sub) with set_hub(); endpoints only use this interface.
+    Delivery may be out of order: endpoints treat events as wakeups and
+    send what the change log holds.
+    """
+
+    @abstractmethod
+    def subscribe(self, owner_id: int) -> Subscription:
+        ...
+
+    @abstractmethod
+    def unsubscribe(self, subscription: Subscription) -> None:
+        ...
+
+    @abstractmethod
+    def publish(self, owner_id: int, event: dict) -> None:
+        """Thread-safe; called from the sync endpoints after commit"""
+
+class InProcessHub(EventHub):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers: Dict[int, Set[Subscription]] = {}
+
+    def subscribe(self, owner_id: int) -> Subscription:
+        subscription = Subscription(owner_id)
+        with self.lock:
+            self.subscribers.setdefault(owner_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.owner_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.owner_id]
+
+    def publish(self, owner_id: int, event: dict) -> None:
+        with self.lock:
+            subscribers: List[Subscription] = list(self.subscribers.get(owner_id, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # loop already closed, the connection is going away
+                self.unsubscribe(subscription)
+
+_hub: EventHub = InProcessHub()
+
+def get_hub() -> EventHub:
+    return _hub
+
+def set_hub(hub: EventHub) -> None:
+    global _hub
+    _hub = hub
+
+def publish(event: dict) -> None:
+    """Fan out a todo_event to its owner's subscribers, once its transaction has committed"""
+    _hub.publish(event["owner_id"], event)
+
+def format_sse(event: dict) -> bytes:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: ".encode() + serialization.dumps(event) + b"\n\n"
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.config import settings
+
+slow_query_logger = logging.getLogger("app.sql.slow")
+n_plus_one_logger = logging.getLogger("app.sql.n_plus_one")
+
+class QueryStats:
+    """SQL statements issued while handling one request (or one track_queries block)"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.total_time += duration
+        self.statements[statement] += 1
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = statement
+
+    def repeated_statements(self, threshold: int) -> Dict[str, int]:
+        """Statements run at least threshold times, the usual N+1 signature"""
+        return {statement: count for statement, count in self.statements.items() if count >= threshold}
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+class QueryMetrics:
+    """Process-wide aggregates per route, served by /metrics/db"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes: Dict[str, dict] = {}
+
+    def observe(self, route: str, stats: QueryStats) -> None:
+        with self.lock:
+            entry = self.routes.setdefault(route, {
+                "requests": 0,
+                "queries": 0,
+                "db_time_ms": 0.0,
+                "max_queries": 0,
+                "max_db_time_ms": 0.0,
+                "n_plus_one_suspects": 0,
+                # the single slowest statement seen on this route
+                "slowest_statement": None,
+                "slowest_statement_ms": 0.0,
+            })
+            entry["requests"] += 1
+            entry["queries"] += stats.count
+            entry["db_time_ms"] += stats.total_time * 1000
+            entry["max_queries"] = max(entry["max_queries"], stats.count)
+            entry["max_db_time_ms"] = max(entry["max_db_time_ms"], stats.total_time * 1000)
+            if stats.repeated_statements(settings.SQL_N_PLUS_ONE_THRESHOLD):
+                entry["n_plus_one_suspects"] += 1
+            if stats.slowest_statement is not None and stats.slowest_time * 1000 > entry["slowest_statement_ms"]:
+                entry["slowest_statement"] = stats.slowest_statement
+                entry["slowest_statement_ms"] = stats.slowest_time * 1000
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self.lock:
+            return {
+                route: {
+                    **entry,
+                    "db_time_ms": round(entry["db_time_ms"], 3),
+                    "max_db_time_ms": round(entry["max_db_time_ms"], 3),
+                    "slowest_statement_ms": round(entry["slowest_statement_ms"], 3),
+                    "avg_queries": round(entry["queries"] / entry["requests"], 2),
+                }
+                for route, entry in sorted(self.routes.items())
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.routes.clear()
+
+metrics = QueryMetrics()
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.record(statement, duration)
+
+    if duration * 1000 >= settings.SQL_SLOW_QUERY_MS:
+        slow_query_logger.warning("Slow query (%.1f ms): %s", duration * 1000, statement)
+
+def start_tracking() -> QueryStats:
+    """Collect statements for the current context (request) from here on"""
+    stats = QueryStats()
+    _current_stats.set(stats)
+    return stats
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Count statements issued inside the block, e.g. around a test client call"""
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+def finish_request(route: str, stats: QueryStats) -> None:
+    """Fold a finished request into the aggregates and flag likely N+1 patterns"""
+    metrics.observe(route, stats)
+
+    repeated = stats.repeated_statements(settings.SQL_N_PLUS_ONE_THRESHOLD)
+    for statement, count in repeated.items():
+        n_plus_one_logger.warning("Possible N+1 on %s: statement ran %d times: %s", route, count, statement)
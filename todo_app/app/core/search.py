@@ -0,0 +1,91 @@
+import base64
+import json
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import column, func, literal_column, table, text
+from sqlalchemy.orm import Session
+from app import models
+
+# Matches in the title weigh more than matches in the description
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+todos_fts = table("todos_fts", column("rowid"))
+
+def build_match_query(q: str, prefix: bool = True) -> Optional[str]:
+    """Turn free text into a safe FTS5 MATCH expression (implicit AND of terms)"""
+    terms = re.findall(r"\w+", q, re.UNICODE)
+    if not terms:
+        return None
+
+    suffix = "*" if prefix else ""
+    return " ".join(f'"{term}"{suffix}' for term in terms)
+
+def encode_cursor(offset: int) -> str:
+    """Opaque cursor for the page starting at offset"""
+    raw = json.dumps([offset]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> int:
+    """Inverse of encode_cursor, raises ValueError on malformed input"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        (offset,) = json.loads(base64.urlsafe_b64decode(padded))
+        offset = int(offset)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
+
+def search_todos(
+    db: Session,
+    owner_id: int,
+    q: str,
+    *,
+    completed: Optional[bool] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    prefix: bool = True,
+) -> Tuple[List[models.Todo], Optional[str]]:
+    """Ranked full-text search over a user's todos.
+
+    Results are ordered by bm25 relevance (best first) then id, and paginated
+    by position. bm25 uses statistics over every user's todos, so any insert
+    shifts all the ranks: a cursor holding the last rank would skip or repeat
+    rows, while the order of one user's results rarely changes. Ordering by
+    rank scores every match anyway, so a keyset wouldn't make deep pages
+    cheaper.
+    """
+    match = build_match_query(q, prefix=prefix)
+    if match is None:
+        return [], None
+
+    rank = func.bm25(literal_column("todos_fts"), TITLE_WEIGHT, DESCRIPTION_WEIGHT)
+
+    query = (
+        db.query(models.Todo, rank.label("rank"))
+        .join(todos_fts, todos_fts.c.rowid == models.Todo.id)
+        .filter(text("todos_fts MATCH :match").bindparams(match=match))
+        .filter(models.Todo.owner_id == owner_id)
+    )
+
+    if completed is not None:
+        query = query.filter(models.Todo.completed == completed)
+    if created_after is not None:
+        query = query.filter(models.Todo.created_at >= created_after)
+    if created_before is not None:
+        query = query.filter(models.Todo.created_at < created_before)
+    offset = decode_cursor(cursor) if cursor is not None else 0
+
+    rows = query.order_by(rank, models.Todo.id).offset(offset).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(offset + limit)
+
+    return [todo for todo, _ in rows], next_cursor
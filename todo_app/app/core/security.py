@@ -23,7 +23,7 @@ def create_access_token(data: dict, expires_delta:Optional[timedelta] = None) ->
     else:
         expire = datetime.now() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
 
-    to_encode.update({"exp: expire"})
+    to_encode.update({"exp": expire})
     encode_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
 
     return encode_jwt
\ No newline at end of file
@@ -0,0 +1,45 @@
+import json
+from datetime import datetime
+from typing import Iterable, Sequence
+from app import models
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# Same fields, in the same order, as schemas.Todo
+TODO_FIELDS = (
+    "title",
+    "description",
+    "id",
+    "completed",
+    "created_at",
+    "updated_at",
+    "revision",
+    "owner_id",
+)
+
+TODO_COLUMNS = tuple(getattr(models.Todo, field) for field in TODO_FIELDS)
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(data) -> bytes:
+    """Encode to compact JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, default=_default, separators=(",", ":")).encode()
+
+def todo_row_to_dict(row: Sequence) -> dict:
+    return dict(zip(TODO_FIELDS, row))
+
+def todo_rows_to_json(rows: Iterable[Sequence]) -> bytes:
+    """Encode rows selected with TODO_COLUMNS as a JSON list matching List[schemas.Todo].
+
+    Skips per-object pydantic validation, so the rows must come straight from
+    the todos table.
+    """
+    return dumps([todo_row_to_dict(row) for row in rows])
@@ -0,0 +1,177 @@
+"""Shard placement and rebalancing for the optional sharded storage mode.
+
+Move a user to another shard with:
+
+    python -m app.core.sharding move <user_id> <target_shard>
+    python -m app.core.sharding status
+"""
+import sys
+from contextlib import contextmanager
+from typing import Dict, Iterator
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from app import database, models
+from app.core import stats
+
+def resolve_shard(user: models.User) -> int:
+    """Shard holding the user's todos: the directory entry, else the stable hash"""
+    shard_count = len(database.shard_sessions)
+    if user.shard_id is not None and 0 <= user.shard_id < shard_count:
+        return user.shard_id
+    return database.shard_for_user_id(user.id, shard_count)
+
+@contextmanager
+def todo_session(user: models.User, db: Session) -> Iterator[Session]:
+    """Session for the user's todo data; the directory session itself when not sharded"""
+    if not database.sharding_enabled():
+        yield db
+        return
+
+    shard_db = database.shard_sessions[resolve_shard(user)]()
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+def _bump_change_sequence(target: Session, minimum: int) -> None:
+    """Make the target's next change ids exceed any cursor a client got from the source"""
+    row = target.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'todo_changes'")).first()
+    if row is None:
+        target.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('todo_changes', :seq)"), {"seq": minimum})
+    elif row.seq < minimum:
+        target.execute(text("UPDATE sqlite_sequence SET seq = :seq WHERE name = 'todo_changes'"), {"seq": minimum})
+
+def _replace_changes(target: Session, user_id: int, entries: list) -> None:
+    """Log (todo_id, revision, deleted) entries, superseding earlier ones for the same ids"""
+    if not entries:
+        return
+    target.query(models.TodoChange).filter(
+        models.TodoChange.owner_id == user_id,
+        models.TodoChange.todo_id.in_([todo_id for todo_id, _, _ in entries]),
+    ).delete(synchronize_session=False)
+    target.add_all(
+        models.TodoChange(owner_id=user_id, todo_id=todo_id, revision=revision, deleted=deleted)
+        for todo_id, revision, deleted in entries
+    )
+    target.flush()
+
+def move_user(db: Session, user_id: int, target_shard: int, batch_size: int = 1000) -> int:
+    """Move a user's todos from their current shard to target_shard, returns rows moved.
+
+    Todo ids are per shard, so moved todos get new ids. The target's change
+    log gets tombstones for the old ids and creates for the new ones, numbered
+    above the user's last cursor on the source, so syncing clients converge
+    through /todos/changes. The user is deactivated while moving, which makes
+    their requests fail fast instead of writing to the old shard.
+    """
+    user = db.get(models.User, user_id)
+    if user is None:
+        raise ValueError(f"No user {user_id}")
+    if not 0 <= target_shard < len(database.shard_sessions):
+        raise ValueError(f"No shard {target_shard}")
+    source_shard = resolve_shard(user)
+    if source_shard == target_shard:
+        return 0
+
+    was_active = user.is_active
+    user.is_active = False
+    db.commit()
+
+    source = database.shard_sessions[source_shard]()
+    target = database.shard_sessions[target_shard]()
+    try:
+        last_cursor = (
+            source.query(func.max(models.TodoChange.id)).filter(models.TodoChange.owner_id == user_id).scalar() or 0
+        )
+        _bump_change_sequence(target, last_cursor)
+
+        old_ids = set()
+        new_ids = set()
+        moved = 0
+        columns = [column.name for column in models.Todo.__table__.columns if column.name != "id"]
+        # Archived todos come back as live ones; the next archival pass on the
+        # target puts them away again
+        for model in (models.Todo, models.ArchivedTodo):
+            last_id = 0
+            while True:
+                todos = (
+                    source.query(model)
+                    .filter(model.owner_id == user_id, model.id > last_id)
+                    .order_by(model.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not todos:
+                    break
+
+                copies = [models.Todo(**{name: getattr(todo, name) for name in columns}) for todo in todos]
+                target.add_all(copies)
+                target.flush()
+                batch_ids = [copy.id for copy in copies]
+                _replace_changes(target, user_id, [(copy.id, copy.revision, False) for copy in copies])
+
+                old_ids.update(todo.id for todo in todos)
+                new_ids.update(batch_ids)
+                moved += len(todos)
+                last_id = todos[-1].id
+                source.expunge_all()
+
+        # Old ids that weren't reused by the copies are gone for the client
+        _replace_changes(target, user_id, [(todo_id, 0, True) for todo_id in sorted(old_ids - new_ids)])
+        target.commit()
+        stats.rebuild_stats(target, user_id)
+
+        user.shard_id = target_shard
+        user.is_active = was_active
+        db.commit()
+
+        for model in (models.Todo, models.ArchivedTodo, models.TodoChange, models.TodoStats, models.TodoCompletionDay):
+            source.query(model).filter(model.owner_id == user_id).delete(synchronize_session=False)
+        source.commit()
+        return moved
+    except Exception:
+        target.rollback()
+        source.rollback()
+        db.rollback()
+        user.is_active = was_active
+        db.commit()
+        raise
+    finally:
+        source.close()
+        target.close()
+
+def shard_usage(db: Session) -> Dict[int, dict]:
+    """Users and todos per shard"""
+    usage = {shard: {"users": 0, "todos": 0} for shard in range(len(database.shard_sessions))}
+    for user in db.query(models.User):
+        usage[resolve_shard(user)]["users"] += 1
+    for shard, make_session in enumerate(database.shard_sessions):
+        shard_db = make_session()
+        try:
+            usage[shard]["todos"] = shard_db.query(func.count(models.Todo.id)).scalar()
+        finally:
+            shard_db.close()
+    return usage
+
+if __name__ == "__main__":
+    from app.database import Base, SessionLocal, engine, shard_engines
+
+    if not database.sharding_enabled():
+        sys.exit("Sharding is disabled, set SHARD_COUNT")
+
+    Base.metadata.create_all(bind=engine)
+    for shard_engine in shard_engines:
+        Base.metadata.create_all(bind=shard_engine)
+
+    db = SessionLocal()
+    try:
+        if len(sys.argv) == 4 and sys.argv[1] == "move":
+            moved = move_user(db, int(sys.argv[2]), int(sys.argv[3]))
+            print(f"Moved {moved} todos")
+        elif len(sys.argv) == 2 and sys.argv[1] == "status":
+            for shard, usage in shard_usage(db).items():
+                print(f"shard {shard}: {usage['users']} users, {usage['todos']} todos")
+        else:
+            sys.exit("usage: python -m app.core.sharding [move <user_id> <target_shard> | status]")
+    finally:
+        db.close()
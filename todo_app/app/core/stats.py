@@ -0,0 +1,209 @@
+"""Incrementally maintained per-user todo statistics.
+
+The write endpoints call the hooks below before committing, so the counters
+change in the same transaction as the todo itself. Counters are bumped with
+an atomic upsert rather than read-modify-write, so concurrent requests don't
+lose updates.
+
+Archived todos still count; recompute everything from the todos and
+archived_todos tables with:
+
+    python -m app.core.stats rebuild
+    python -m app.core.stats check
+"""
+import sys
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+from sqlalchemy import Integer, cast, func
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from app import models
+
+def _bump(db: Session, model, key: dict, **deltas: int) -> None:
+    table = model.__table__
+    stmt = insert(table).values(**key, **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={name: table.c[name] + delta for name, delta in deltas.items()},
+    )
+    db.execute(stmt)
+
+def _bump_completion_day(db: Session, owner_id: int, completed_at: Optional[datetime], delta: int) -> None:
+    if completed_at is None:
+        return
+    _bump(db, models.TodoCompletionDay, {"owner_id": owner_id, "day": completed_at.date()}, count=delta)
+
+def todo_created(db: Session, todo: models.Todo) -> None:
+    completed = 1 if todo.completed else 0
+    _bump(db, models.TodoStats, {"owner_id": todo.owner_id}, total=1, completed=completed)
+    if completed:
+        _bump_completion_day(db, todo.owner_id, todo.completed_at, 1)
+
+def todo_deleted(db: Session, todo: models.Todo) -> None:
+    completed = 1 if todo.completed else 0
+    _bump(db, models.TodoStats, {"owner_id": todo.owner_id}, total=-1, completed=-completed)
+    if completed:
+        _bump_completion_day(db, todo.owner_id, todo.completed_at, -1)
+
+def todos_created_bulk(db: Session, owner_id: int, todos: List[dict]) -> None:
+    """Counter update for a batch of inserted todo rows, one upsert per counter"""
+    completed_days = Counter(
+        todo["completed_at"].date()
+        for todo in todos
+        if todo.get("completed") and todo.get("completed_at") is not None
+    )
+    completed = sum(1 for todo in todos if todo.get("completed"))
+    _bump(db, models.TodoStats, {"owner_id": owner_id}, total=len(todos), completed=completed)
+    for day, count in completed_days.items():
+        _bump(db, models.TodoCompletionDay, {"owner_id": owner_id, "day": day}, count=count)
+
+def todos_archived(db: Session, owner_id: int, count: int) -> None:
+    """Adjust the archived counter, negative count for restored todos"""
+    _bump(db, models.TodoStats, {"owner_id": owner_id}, archived=count)
+
+def set_completed(db: Session, todo: models.Todo, completed: bool) -> None:
+    """Set todo.completed/completed_at and adjust the counters if it changed"""
+    if bool(todo.completed) == completed:
+        todo.completed = completed
+        return
+
+    if completed:
+        todo.completed_at = datetime.now()
+        _bump(db, models.TodoStats, {"owner_id": todo.owner_id}, completed=1)
+        _bump_completion_day(db, todo.owner_id, todo.completed_at, 1)
+    else:
+        _bump(db, models.TodoStats, {"owner_id": todo.owner_id}, completed=-1)
+        _bump_completion_day(db, todo.owner_id, todo.completed_at, -1)
+        todo.completed_at = None
+    todo.completed = completed
+
+def get_stats(db: Session, owner_id: int, days: int = 30) -> dict:
+    row = db.get(models.TodoStats, owner_id)
+    total = row.total if row else 0
+    completed = row.completed if row else 0
+    archived = row.archived if row else 0
+
+    since = date.today() - timedelta(days=days - 1)
+    per_day = (
+        db.query(models.TodoCompletionDay.day, models.TodoCompletionDay.count)
+        .filter(
+            models.TodoCompletionDay.owner_id == owner_id,
+            models.TodoCompletionDay.day >= since,
+            models.TodoCompletionDay.count != 0,
+        )
+        .order_by(models.TodoCompletionDay.day)
+        .all()
+    )
+
+    return {
+        "total": total,
+        "completed": completed,
+        "open": total - completed,
+        "archived": archived,
+        "completions_per_day": [{"day": day, "count": count} for day, count in per_day],
+    }
+
+def _computed(db: Session, owner_id: Optional[int] = None):
+    """Stats recomputed from the todos and archive tables:
+    ({owner: (total, completed, archived)}, {(owner, day): count})"""
+    counters: Dict = {}
+    per_day: Counter = Counter()
+    for model in (models.Todo, models.ArchivedTodo):
+        archived = model is models.ArchivedTodo
+        totals = db.query(
+            model.owner_id,
+            func.count(model.id),
+            func.coalesce(func.sum(cast(model.completed, Integer)), 0),
+        )
+        days = db.query(
+            model.owner_id, func.date(model.completed_at), func.count(model.id)
+        ).filter(model.completed.is_(True), model.completed_at.isnot(None))
+        if owner_id is not None:
+            totals = totals.filter(model.owner_id == owner_id)
+            days = days.filter(model.owner_id == owner_id)
+
+        for owner, total, done in totals.group_by(model.owner_id):
+            previous = counters.get(owner, (0, 0, 0))
+            counters[owner] = (
+                previous[0] + total,
+                previous[1] + int(done),
+                previous[2] + (total if archived else 0),
+            )
+        for owner, day, count in days.group_by(model.owner_id, func.date(model.completed_at)):
+            per_day[(owner, date.fromisoformat(day))] += count
+    return counters, per_day
+
+def rebuild_stats(db: Session, owner_id: Optional[int] = None) -> None:
+    """Recompute counters from scratch for one user or everyone, and commit"""
+    counters, per_day = _computed(db, owner_id)
+
+    for model in (models.TodoStats, models.TodoCompletionDay):
+        query = db.query(model)
+        if owner_id is not None:
+            query = query.filter(model.owner_id == owner_id)
+        query.delete(synchronize_session=False)
+
+    db.add_all(
+        models.TodoStats(owner_id=owner, total=total, completed=done, archived=archived)
+        for owner, (total, done, archived) in counters.items()
+    )
+    db.add_all(
+        models.TodoCompletionDay(owner_id=owner, day=day, count=count)
+        for (owner, day), count in per_day.items()
+    )
+    db.commit()
+
+def check_stats(db: Session, owner_id: Optional[int] = None) -> List[str]:
+    """Differences between the maintained counters and a full recount, empty when consistent"""
+    counters, per_day = _computed(db, owner_id)
+
+    stored_query = db.query(models.TodoStats)
+    days_query = db.query(models.TodoCompletionDay).filter(models.TodoCompletionDay.count != 0)
+    if owner_id is not None:
+        stored_query = stored_query.filter(models.TodoStats.owner_id == owner_id)
+        days_query = days_query.filter(models.TodoCompletionDay.owner_id == owner_id)
+
+    stored: Dict = {row.owner_id: (row.total, row.completed, row.archived) for row in stored_query}
+    stored_days: Dict = {(row.owner_id, row.day): row.count for row in days_query}
+
+    problems = []
+    for owner in sorted(set(counters) | set(stored)):
+        expected = counters.get(owner, (0, 0, 0))
+        actual = stored.get(owner, (0, 0, 0))
+        if expected != actual:
+            problems.append(f"user {owner}: (total, completed, archived) is {actual}, expected {expected}")
+    for key in sorted(set(per_day) | set(stored_days)):
+        expected = per_day.get(key, 0)
+        actual = stored_days.get(key, 0)
+        if expected != actual:
+            problems.append(f"user {key[0]} on {key[1]}: completions is {actual}, expected {expected}")
+    return problems
+
+if __name__ == "__main__":
+    from app.database import Base, engine, shard_engines, todo_sessionmakers
+
+    for bind in [engine, *shard_engines]:
+        Base.metadata.create_all(bind=bind)
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    if command not in ("rebuild", "check"):
+        sys.exit("usage: python -m app.core.stats [rebuild|check]")
+
+    problems = []
+    for make_session in todo_sessionmakers():
+        db = make_session()
+        try:
+            if command == "rebuild":
+                rebuild_stats(db)
+            else:
+                problems.extend(check_stats(db))
+        finally:
+            db.close()
+
+    if command == "rebuild":
+        print("Stats rebuilt")
+    else:
+        for problem in problems:
+            print(problem)
+        print("Stats consistent" if not problems else f"{len(problems)} inconsistencies")
+        sys.exit(1 if problems else 0)
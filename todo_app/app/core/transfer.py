@@ -0,0 +1,137 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import IO, Iterator, List, Optional
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+from app import models, schemas
+from app.core import archive, changes, serialization, stats
+
+EXPORT_CHUNK_SIZE = 1000
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def _export_chunks(db: Session, owner_id: int, chunk_size: int) -> Iterator[list]:
+    """Keyset-paginated row chunks, so only one chunk is ever held in memory.
+    Archived todos are exported along with the live ones."""
+    todos = archive.todo_rows(owner_id)
+    last_id = 0
+    while True:
+        rows = db.execute(
+            select(todos).where(todos.c.id > last_id).order_by(todos.c.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+def _csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def export_todos(db: Session, owner_id: int, fmt: str, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the user's todos as NDJSON or CSV, one encoded chunk at a time"""
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(serialization.TODO_FIELDS)
+        for rows in _export_chunks(db, owner_id, chunk_size):
+            writer.writerows([_csv_value(value) for value in row] for row in rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    else:
+        for rows in _export_chunks(db, owner_id, chunk_size):
+            yield b"".join(
+                serialization.dumps(serialization.todo_row_to_dict(row)) + b"\n" for row in rows
+            )
+
+def _parse_records(upload: IO[bytes], fmt: str) -> Iterator[tuple]:
+    """(line number, record dict or parse error) for each record, read incrementally"""
+    text = io.TextIOWrapper(upload, encoding="utf-8", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for record in reader:
+            # CSV can't tell empty from missing, treat both as unset
+            yield reader.line_num, {
+                key: value for key, value in record.items() if key is not None and value not in ("", None)
+            }
+    else:
+        for line_num, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except ValueError as e:
+                yield line_num, e
+
+def _flush_batch(db: Session, owner_id: int, batch: List[dict]) -> None:
+    todo_ids = db.scalars(insert(models.Todo).returning(models.Todo.id), batch).all()
+    changes.record_created_bulk(db, owner_id, todo_ids)
+    stats.todos_created_bulk(db, owner_id, batch)
+    db.commit()
+
+def import_todos(
+    db: Session, owner_id: int, upload: IO[bytes], fmt: str, batch_size: int = IMPORT_BATCH_SIZE
+) -> dict:
+    """Create todos from an NDJSON or CSV upload, committing every batch_size rows.
+
+    Invalid records are skipped and reported; rows from batches that were
+    already committed stay imported if a later batch fails.
+    """
+    imported = 0
+    failed = 0
+    errors = []
+    batch: List[dict] = []
+    now = datetime.now()
+
+    for line_num, record in _parse_records(upload, fmt):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            todo_in = schemas.TodoImport.model_validate(record)
+        except (ValueError, ValidationError) as e:
+            failed += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_num, "error": str(e).splitlines()[0]})
+            continue
+
+        completed_at: Optional[datetime] = todo_in.completed_at
+        if todo_in.completed and completed_at is None:
+            completed_at = now
+        created_at = todo_in.created_at or now
+        batch.append({
+            "title": todo_in.title,
+            "description": todo_in.description,
+            "completed": todo_in.completed,
+            "completed_at": completed_at if todo_in.completed else None,
+            "created_at": created_at,
+            "updated_at": now,
+            "revision": 1,
+            "owner_id": owner_id,
+        })
+
+        if len(batch) >= batch_size:
+            _flush_batch(db, owner_id, batch)
+            imported += len(batch)
+            batch = []
+
+    if batch:
+        _flush_batch(db, owner_id, batch)
+        imported += len(batch)
+
+    return {"imported": imported, "failed": failed, "errors": errors}
@@ -1,9 +1,16 @@
-from sqlalchemy import create_engine
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
 
-SQLALCHEMY_DATABASE_URL = f"sqlite:///./{settings.DATABASE_NAME}"
+def sqlite_url(name: str) -> str:
+    """URL of a SQLite file, absolute or relative to the working directory"""
+    return f"sqlite:///{Path(name).resolve()}"
+
+SQLALCHEMY_DATABASE_URL = sqlite_url(settings.DATABASE_NAME)
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
@@ -13,9 +20,48 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Optional sharded mode (SHARD_COUNT > 0): the database above becomes the
+# global directory (users, auth) and todo data lives in one file per shard.
+shard_engines = [
+    create_engine(
+        sqlite_url(settings.SHARD_DATABASE_TEMPLATE.format(shard=shard)),
+        connect_args={"check_same_thread": False},
+    )
+    for shard in range(settings.SHARD_COUNT)
+]
+
+shard_sessions: List[sessionmaker] = [
+    sessionmaker(autocommit=False, autoflush=False, bind=shard_engine) for shard_engine in shard_engines
+]
+
+def add_missing_columns(connection, table: str, columns: Dict[str, str], backfill: Optional[Dict[str, str]] = None) -> None:
+    """ALTER TABLE ... ADD COLUMN for each of columns (name: SQL definition)
+    that a table created by an older version lacks, since create_all never
+    alters existing tables. backfill maps a new column to the SQL expression
+    filling it in existing rows."""
+    existing = {row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))}
+    if not existing:
+        return
+    for name, definition in columns.items():
+        if name not in existing:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {definition}"))
+            if backfill and name in backfill:
+                connection.execute(text(f"UPDATE {table} SET {name} = {backfill[name]}"))
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def sharding_enabled() -> bool:
+    return len(shard_sessions) > 0
+
+def shard_for_user_id(user_id: int, shard_count: int) -> int:
+    """Stable hash placement, the default shard for a user"""
+    return zlib.crc32(str(user_id).encode()) % shard_count
+
+def todo_sessionmakers() -> List[sessionmaker]:
+    """Every database holding todo data: the shards, or just the main database"""
+    return shard_sessions if sharding_enabled() else [SessionLocal]
\ No newline at end of file
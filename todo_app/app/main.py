@@ -1,12 +1,25 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, APIRouter
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.endpoints import auth, todos
+from app.api.endpoints import auth, metrics, todo_events, todos
 from app.config import settings
-from app.database import Base, engine
+from app.core import archive
+from app.database import Base, engine, shard_engines
+from app.middleware.query_stats import QueryStatsMiddleware
 
 Base.metadata.create_all(bind=engine)
+for shard_engine in shard_engines:
+    Base.metadata.create_all(bind=shard_engine)
 
-app = FastAPI(title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    archiver = asyncio.ensure_future(archive.run_periodically()) if settings.ARCHIVE_AFTER_DAYS > 0 else None
+    yield
+    if archiver is not None:
+        archiver.cancel()
+
+app = FastAPI(title=settings.PROJECT_NAME, openapi_url=f"{settings.API_V1_STR}/openapi.json", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,12 +27,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-DB-Query-Count", "X-DB-Time-Ms", "Server-Timing"],
 )
+app.add_middleware(QueryStatsMiddleware)
 
 api_router = APIRouter()
 
 api_router.include_router(auth.router, prefix="/auth", tags=["auth"])
+# before todos: its /{todo_id} route would otherwise swallow /events and /ws
+api_router.include_router(todo_events.router, prefix="/todos", tags=["todos"])
 api_router.include_router(todos.router, prefix="/todos", tags=["todos"])
+api_router.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
 
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
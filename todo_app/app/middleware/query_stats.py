@@ -0,0 +1,43 @@
+from app.core import instrumentation
+
+def route_template(scope) -> str:
+    """Request path with path parameters put back as {placeholders}, so metrics group per route"""
+    if "endpoint" not in scope:
+        return "unmatched"
+
+    segments = scope["path"].split("/")
+    by_value = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(f"{{{by_value[segment]}}}" if segment in by_value else segment for segment in segments)
+
+class QueryStatsMiddleware:
+    """Per-request SQL statistics, reported as response headers and folded into the aggregates.
+
+    Plain ASGI rather than BaseHTTPMiddleware so streaming responses pass
+    through untouched. Statements issued after the headers have gone out
+    (while a response is still streaming) count towards the aggregates only.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = instrumentation.start_tracking()
+
+        async def send_with_stats(message):
+            if message["type"] == "http.response.start":
+                db_time_ms = stats.total_time * 1000
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-query-count", str(stats.count).encode()))
+                headers.append((b"x-db-time-ms", f"{db_time_ms:.3f}".encode()))
+                headers.append((b"server-timing", f'db;dur={db_time_ms:.3f};desc="{stats.count} queries"'.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            instrumentation.finish_request(f"{scope['method']} {route_template(scope)}", stats)
@@ -1,2 +1,5 @@
 from app.models.user import User
-from app.models.todo import Todo
\ No newline at end of file
+from app.models.todo import Todo
+from app.models.change import TodoChange
+from app.models.stats import TodoStats, TodoCompletionDay
+from app.models.archive import ArchivedTodo
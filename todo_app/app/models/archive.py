@@ -0,0 +1,27 @@
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, Index
+from datetime import datetime
+from app.database import Base
+
+class ArchivedTodo(Base):
+    """Completed todo moved out of the hot todos table by app.core.archive.
+
+    Keeps the todo's id so it can be restored as is. Only indexed by owner and
+    id: archived rows are read per user in id order, never searched.
+    """
+    __tablename__ = "archived_todos"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(String)
+    description = Column(String)
+    completed = Column(Boolean, default=True)
+    completed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    revision = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_archived_todos_owner_id_id", "owner_id", "id"),
+    )
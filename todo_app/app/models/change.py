@@ -0,0 +1,21 @@
+from sqlalchemy import Boolean, Column, Integer, ForeignKey, DateTime, Index
+from datetime import datetime
+from app.database import Base
+
+class TodoChange(Base):
+    """Per-user change log. Only the latest entry per todo is kept, deletes leave a tombstone."""
+    __tablename__ = "todo_changes"
+
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    todo_id = Column(Integer, nullable=False)
+    revision = Column(Integer, nullable=False)
+    deleted = Column(Boolean, default=False, nullable=False)
+    changed_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_todo_changes_owner_id_id", "owner_id", "id"),
+        Index("ix_todo_changes_owner_id_todo_id", "owner_id", "todo_id"),
+        # cursors must never be reused after the newest entry is superseded
+        {"sqlite_autoincrement": True},
+    )
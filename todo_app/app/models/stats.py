@@ -0,0 +1,44 @@
+from sqlalchemy import Column, Integer, ForeignKey, Date, event, text
+from app.database import Base
+
+class TodoStats(Base):
+    """Running per-user counters, maintained by app.core.stats"""
+    __tablename__ = "todo_stats"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total = Column(Integer, default=0, nullable=False)
+    completed = Column(Integer, default=0, nullable=False)
+    # how many of total are in archived_todos
+    archived = Column(Integer, default=0, nullable=False)
+
+class TodoCompletionDay(Base):
+    """Number of a user's todos completed on a given day"""
+    __tablename__ = "todo_completion_days"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    count = Column(Integer, default=0, nullable=False)
+
+@event.listens_for(Base.metadata, "after_create")
+def seed_todo_stats(target, connection, **kw):
+    """Count the todos of a database that had some before the counters existed.
+
+    Counters are only ever bumped, so without this every user of an older
+    database would start at zero. Runs after the todos migration.
+    """
+    if connection.dialect.name != "sqlite":
+        return
+
+    if connection.execute(text("SELECT 1 FROM todo_stats LIMIT 1")).first() is not None:
+        return
+    connection.execute(text(
+        "INSERT INTO todo_stats (owner_id, total, completed, archived) "
+        "SELECT owner_id, COUNT(*), COALESCE(SUM(completed), 0), 0 FROM todos "
+        "WHERE owner_id IS NOT NULL GROUP BY owner_id"
+    ))
+    connection.execute(text(
+        "INSERT INTO todo_completion_days (owner_id, day, count) "
+        "SELECT owner_id, DATE(completed_at), COUNT(*) FROM todos "
+        "WHERE owner_id IS NOT NULL AND completed AND completed_at IS NOT NULL "
+        "GROUP BY owner_id, DATE(completed_at)"
+    ))
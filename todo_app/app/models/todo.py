@@ -1,7 +1,7 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, DateTime, Index, event, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from app.database import Base
+from app.database import Base, add_missing_columns
 
 class Todo(Base):
     __tablename__ = "todos"
@@ -10,8 +10,119 @@ class Todo(Base):
     title = Column(String, index=True)
     description = Column(String)
     completed = Column(Boolean, default=False)
+    completed_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    revision = Column(Integer, default=1, nullable=False)
 
     owner_id = Column(Integer, ForeignKey("users.id"))
 
-    owner = relationship("User", back_populates="todos")
\ No newline at end of file
+    owner = relationship("User", back_populates="todos")
+
+    __table_args__ = (
+        # the archiver's scan for old completed todos
+        Index("ix_todos_completed_at", "completed_at"),
+        # archived todos keep their ids, so ids must never be handed out twice
+        {"sqlite_autoincrement": True},
+    )
+
+@event.listens_for(Base.metadata, "after_create")
+def migrate_todos(target, connection, **kw):
+    """Bring a todos table from an older version up to date, before the search index sees it"""
+    if connection.dialect.name != "sqlite":
+        return
+
+    add_missing_columns(
+        connection,
+        "todos",
+        {
+            "updated_at": "DATETIME",
+            "revision": "INTEGER NOT NULL DEFAULT 1",
+            # unknown for todos completed before it existed, so they count in
+            # the totals but on no completion day
+            "completed_at": "DATETIME",
+        },
+        backfill={"updated_at": "created_at"},
+    )
+
+    table_sql = connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'todos'")
+    ).scalar()
+    if table_sql is not None and "AUTOINCREMENT" not in table_sql.upper():
+        _rebuild_todos(connection)
+
+def _rebuild_todos(connection):
+    """Recreate todos with AUTOINCREMENT, keeping rows and ids.
+
+    Without it SQLite hands out max(id) + 1, which reuses the id of an
+    archived todo once the newest todo is deleted. The sequence starts past
+    every id in todos and archived_todos. SQLite can't add AUTOINCREMENT in
+    place; the search triggers go with the old table and are recreated by
+    create_todos_fts, the rowids the index refers to don't change.
+    """
+    columns = ", ".join(column.name for column in Todo.__table__.columns)
+    for kind, name in connection.execute(text(
+        "SELECT type, name FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = 'todos' AND sql IS NOT NULL"
+    )).all():
+        connection.execute(text(f"DROP {kind.upper()} {name}"))
+    connection.execute(text("ALTER TABLE todos RENAME TO todos_old"))
+    Todo.__table__.create(connection)
+    connection.execute(text(f"INSERT INTO todos ({columns}) SELECT {columns} FROM todos_old"))
+    connection.execute(text("DROP TABLE todos_old"))
+
+    highest = connection.execute(text(
+        "SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM todos UNION ALL SELECT MAX(id) FROM archived_todos)"
+    )).scalar() or 0
+    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'todos'"))
+    connection.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('todos', :seq)"), {"seq": highest})
+
+# External-content FTS5 index over title/description. The triggers keep it in
+# sync with every insert, update and delete on todos, whatever code path
+# issues the write.
+TODOS_FTS_DDL = [
+    """
+    CREATE TRIGGER IF NOT EXISTS todos_fts_ai AFTER INSERT ON todos BEGIN
+        INSERT INTO todos_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS todos_fts_ad AFTER DELETE ON todos BEGIN
+        INSERT INTO todos_fts(todos_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS todos_fts_au AFTER UPDATE OF title, description ON todos BEGIN
+        INSERT INTO todos_fts(todos_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO todos_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+]
+
+@event.listens_for(Base.metadata, "after_create")
+def create_todos_fts(target, connection, **kw):
+    """Create the todo search index, backfilling it for pre-existing databases"""
+    if connection.dialect.name != "sqlite":
+        return
+
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'todos_fts'")
+    ).first()
+    if exists is None:
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE todos_fts USING fts5("
+            "title, description, content='todos', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        ))
+        connection.execute(text("INSERT INTO todos_fts(todos_fts) VALUES ('rebuild')"))
+
+    for statement in TODOS_FTS_DDL:
+        connection.execute(text(statement))
+
+@event.listens_for(Base.metadata, "before_drop")
+def drop_todos_fts(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        connection.execute(text("DROP TABLE IF EXISTS todos_fts"))
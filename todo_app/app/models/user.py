@@ -1,6 +1,6 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, event
 from sqlalchemy.orm import relationship
-from app.database import Base
+from app.database import Base, add_missing_columns
 
 class User(Base):
     __tablename__ = "users"
@@ -9,5 +9,16 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
+    # Shard holding this user's todos in sharded mode, set at registration
+    # and changed by the rebalancer
+    shard_id = Column(Integer, nullable=True)
 
-    todos = relationship("Todo", back_populates="owner", cascade="all, delete-orphan")
\ No newline at end of file
+    todos = relationship("Todo", back_populates="owner", cascade="all, delete-orphan")
+
+@event.listens_for(Base.metadata, "after_create")
+def migrate_users(target, connection, **kw):
+    """Bring a users table from an older version up to date"""
+    if connection.dialect.name != "sqlite":
+        return
+
+    add_missing_columns(connection, "users", {"shard_id": "INTEGER"})
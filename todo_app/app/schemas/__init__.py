@@ -1,2 +1,2 @@
 from app.schemas.user import Token, TokenData, User, UserCreate, UserInDB
-from app.schemas.todo import Todo, ToDoCreate, TodoUpdate
\ No newline at end of file
+from app.schemas.todo import Todo, ToDoCreate, TodoUpdate, TodoSearchResults, TodoChange, TodoChanges, TodoStats, TodoImport, TodoImportResult
\ No newline at end of file
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+from typing import List, Optional
+from datetime import date, datetime
 
 class TodoBase(BaseModel):
     title: str
@@ -14,14 +14,57 @@ class TodoUpdate(BaseModel):
     description: Optional[str] = None
     completed: Optional[bool] = None
 
+class TodoImport(TodoBase):
+    completed: bool = False
+    created_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
 class TodoInDBBase(TodoBase):
     id: int
     completed: bool
     created_at: datetime
+    updated_at: Optional[datetime] = None
+    revision: int = 1
     owner_id: int
 
     class Config:
         orm_mode = True
 
 class Todo(TodoInDBBase):
-    pass
\ No newline at end of file
+    pass
+
+class TodoSearchResults(BaseModel):
+    items: List[Todo]
+    next_cursor: Optional[str] = None
+
+class TodoChange(BaseModel):
+    id: int
+    revision: int
+    deleted: bool
+    changed_at: datetime
+    todo: Optional[Todo] = None
+
+class TodoChanges(BaseModel):
+    changes: List[TodoChange]
+    cursor: int
+    has_more: bool
+
+class CompletionDay(BaseModel):
+    day: date
+    count: int
+
+class TodoStats(BaseModel):
+    total: int
+    completed: int
+    open: int
+    archived: int = 0
+    completions_per_day: List[CompletionDay]
+
+class TodoImportError(BaseModel):
+    line: int
+    error: str
+
+class TodoImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[TodoImportError]
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""Micro-benchmark: list response serialization, ORM + pydantic vs column rows + direct JSON.
+
+Run from todo_app/:  python benchmarks/bench_serialization.py [--repeat N]
+"""
+import argparse
+import statistics
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import models, schemas
+from app.core import serialization
+from app.database import Base
+
+PAGE_SIZES = (100, 1_000, 10_000)
+
+todo_list = TypeAdapter(List[schemas.Todo])
+
+def seed(db, count):
+    user = models.User(email="bench@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    now = datetime.now()
+    db.bulk_insert_mappings(models.Todo, [
+        {
+            "title": f"todo {i}",
+            "description": f"description for todo number {i}",
+            "completed": i % 3 == 0,
+            "created_at": now,
+            "updated_at": now,
+            "revision": 1,
+            "owner_id": user.id,
+        }
+        for i in range(count)
+    ])
+    db.commit()
+    return user.id
+
+def pydantic_path(db, owner_id, limit):
+    """What FastAPI does for response_model=List[schemas.Todo] with ORM objects"""
+    todos = db.query(models.Todo).filter(models.Todo.owner_id == owner_id).order_by(models.Todo.id).limit(limit).all()
+    body = todo_list.dump_json(todo_list.validate_python(todos, from_attributes=True))
+    db.expunge_all()
+    return body
+
+def fast_path(db, owner_id, limit):
+    rows = (
+        db.query(*serialization.TODO_COLUMNS)
+        .filter(models.Todo.owner_id == owner_id)
+        .order_by(models.Todo.id)
+        .limit(limit)
+        .all()
+    )
+    return serialization.todo_rows_to_json(rows)
+
+def timeit(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    owner_id = seed(db, max(PAGE_SIZES))
+
+    encoder = "orjson" if serialization.orjson is not None else "json"
+    print(f"encoder: {encoder}, median of {args.repeat} runs")
+    print(f"{'page size':>10} {'pydantic ms':>12} {'fast ms':>10} {'speedup':>8}")
+    for size in PAGE_SIZES:
+        slow = timeit(lambda: pydantic_path(db, owner_id, size), args.repeat)
+        fast = timeit(lambda: fast_path(db, owner_id, size), args.repeat)
+        print(f"{size:>10} {slow * 1000:>12.2f} {fast * 1000:>10.2f} {slow / fast:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Write throughput versus shard count.
+
+Each writer thread plays one user and commits todos one at a time through the
+same write path as POST /todos/ (insert, change log, stats). Users are placed
+with the stable hash from app.database, so with more shards fewer writers
+contend for each SQLite write lock.
+
+Run from todo_app/:  python benchmarks/bench_sharding.py [--writers 16] [--todos 200]
+"""
+import argparse
+import json
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import models
+from app.core import changes, stats
+from app.database import Base, shard_for_user_id
+
+def run(shard_count, writers, todos_per_writer, directory):
+    engines = [
+        create_engine(
+            f"sqlite:///{directory}/shards{shard_count}_{shard}.db",
+            connect_args={"check_same_thread": False, "timeout": 60},
+        )
+        for shard in range(shard_count)
+    ]
+    for engine in engines:
+        Base.metadata.create_all(bind=engine)
+    sessions = [sessionmaker(autocommit=False, autoflush=False, bind=engine) for engine in engines]
+
+    def writer(user_id):
+        db = sessions[shard_for_user_id(user_id, shard_count)]()
+        try:
+            for i in range(todos_per_writer):
+                todo = models.Todo(title=f"todo {i}", owner_id=user_id)
+                db.add(todo)
+                db.flush()
+                stats.todo_created(db, todo)
+                changes.record_change(db, todo)
+                db.commit()
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=writer, args=(user_id,)) for user_id in range(1, writers + 1)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for engine in engines:
+        engine.dispose()
+
+    return {
+        "shards": shard_count,
+        "writers": writers,
+        "commits": writers * todos_per_writer,
+        "seconds": round(elapsed, 3),
+        "commits_per_second": round(writers * todos_per_writer / elapsed, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Write throughput versus shard count")
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--todos", type=int, default=200, help="Commits per writer")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--dir", default=None, help="Where to put the shard files (default: a temp dir)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        results = [run(count, args.writers, args.todos, directory) for count in args.shards]
+
+    baseline = results[0]["commits_per_second"]
+    for result in results:
+        result["speedup"] = round(result["commits_per_second"] / baseline, 2)
+        print(f"{result['shards']:>3} shards: {result['commits_per_second']:>8} commits/s ({result['speedup']}x)", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""Seeded load test for the todo API.
+
+Seeds a database with users whose todo counts follow a Zipf-like skew (a few
+power users own most of the rows), then drives login, shallow and deep list
+pages, create, toggle and delete at a given concurrency. Results go to stdout
+(or --output) as JSON so runs on different branches can be diffed.
+
+Run from todo_app/:
+
+    python benchmarks/load_test.py --users 1000 --todos 100000 --concurrency 8
+
+By default requests go through an in-process TestClient against a throwaway
+SQLite file. To measure a real server, seed first and point it at the file:
+
+    python benchmarks/load_test.py --seed-only --database bench.db
+    DATABASE_NAME=bench.db uvicorn app.main:app
+    python benchmarks/load_test.py --no-seed --database bench.db --base-url http://localhost:8000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+PASSWORD = "benchpass123"
+API = "/api/v1"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Seeded load test for the todo API")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--todos", type=int, default=100_000)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for todos per user")
+    parser.add_argument("--database", default="bench.db", help="SQLite file, absolute or relative to the working directory")
+    parser.add_argument("--base-url", default=None, help="Drive a running server instead of an in-process client")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=500, help="Requests per operation")
+    parser.add_argument("--logins", type=int, default=50, help="Users to log in (login is bcrypt bound)")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-seed", action="store_true", help="Reuse an already seeded database")
+    parser.add_argument("--seed-only", action="store_true")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+def todos_per_user(users, total, skew, rng):
+    """Split total todos across users following 1/rank^skew, shuffled so ids don't encode rank"""
+    weights = [1 / (rank ** skew) for rank in range(1, users + 1)]
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    for i in range(total - sum(counts)):
+        counts[i % users] += 1
+    rng.shuffle(counts)
+    return counts
+
+def seed(args, rng):
+    from app import models
+    from app.core import security
+    from app.core.stats import rebuild_stats
+    from app.database import Base, SessionLocal, engine
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    hashed = security.get_password_hash(PASSWORD)
+    counts = todos_per_user(args.users, args.todos, args.skew, rng)
+    start = datetime.now() - timedelta(days=365)
+
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(models.User, [
+            {"id": i + 1, "email": f"user{i + 1}@bench.example.com", "hashed_password": hashed}
+            for i in range(args.users)
+        ])
+
+        batch = []
+        for user_id, count in enumerate(counts, start=1):
+            for n in range(count):
+                created = start + timedelta(seconds=rng.randrange(365 * 86400))
+                completed = rng.random() < 0.6
+                batch.append({
+                    "title": f"todo {n} for user {user_id}",
+                    "description": rng.choice(["", "groceries and errands", "work report", "call back later"]),
+                    "completed": completed,
+                    "completed_at": created + timedelta(hours=rng.randrange(1, 240)) if completed else None,
+                    "created_at": created,
+                    "updated_at": created,
+                    "revision": 1,
+                    "owner_id": user_id,
+                })
+                if len(batch) >= 10_000:
+                    db.bulk_insert_mappings(models.Todo, batch)
+                    batch.clear()
+        if batch:
+            db.bulk_insert_mappings(models.Todo, batch)
+        db.commit()
+
+        rebuild_stats(db)
+    finally:
+        db.close()
+
+    return counts
+
+def load_counts(users):
+    from sqlalchemy import func
+    from app import models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        rows = dict(db.query(models.Todo.owner_id, func.count(models.Todo.id)).group_by(models.Todo.owner_id))
+    finally:
+        db.close()
+    return [rows.get(user_id, 0) for user_id in range(1, users + 1)]
+
+class QueryCounter:
+    """Counts statements on every engine in this process (in-process mode only)"""
+
+    def __init__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        self.count = 0
+        self.lock = threading.Lock()
+        event.listen(Engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        with self.lock:
+            self.count += 1
+
+class Driver:
+    """One HTTP client per worker thread, either in-process or against --base-url"""
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+        self.local = threading.local()
+        self.clients = []
+
+    def client(self):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            if self.base_url:
+                import httpx
+                client = httpx.Client(base_url=self.base_url, timeout=60)
+            else:
+                from fastapi.testclient import TestClient
+                from app.main import app
+                client = TestClient(app)
+                client.__enter__()
+            self.local.client = client
+            self.clients.append(client)
+        return client
+
+    def close(self):
+        for client in self.clients:
+            if self.base_url:
+                client.close()
+            else:
+                client.__exit__(None, None, None)
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def run_phase(driver, name, jobs, concurrency, counter=None):
+    """Run request callables at the given concurrency; returns the report for this operation"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run(job):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = job(driver.client())
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    queries_per_request = None
+    if counter is not None and jobs:
+        # Run the first few requests serially so statement counts aren't mixed
+        # across concurrent requests; they are not part of the timed run
+        size = min(10, max(1, len(jobs) // 10)) if len(jobs) > 1 else 0
+        calibration, jobs = jobs[:size], jobs[size:]
+        before = counter.count
+        for job in calibration:
+            job(driver.client())
+        if calibration:
+            queries_per_request = round((counter.count - before) / len(calibration), 2)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run, jobs))
+    wall = time.perf_counter() - start
+
+    result = {
+        "operation": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency_ms": {
+            "mean": round(statistics.mean(latencies) * 1000, 3),
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p90": round(percentile(latencies, 90) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round(max(latencies) * 1000, 3),
+        } if latencies else None,
+        "sql_queries_per_request": queries_per_request,
+    }
+    print(
+        f"{name:>12}: {result['throughput_rps']} req/s, p50 {result['latency_ms']['p50']}ms, "
+        f"p99 {result['latency_ms']['p99']}ms, errors {errors}, queries/req {queries_per_request}",
+        file=sys.stderr,
+    )
+    return result
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+def main():
+    args = parse_args()
+    os.environ["DATABASE_NAME"] = args.database
+    rng = random.Random(args.seed)
+
+    if args.no_seed:
+        counts = load_counts(args.users)
+    else:
+        seed_start = time.perf_counter()
+        counts = seed(args, rng)
+        print(f"seeded {args.users} users / {sum(counts)} todos in {time.perf_counter() - seed_start:.1f}s", file=sys.stderr)
+    if args.seed_only:
+        return
+
+    driver = Driver(args.base_url)
+    driver.client()  # app import and startup DDL shouldn't count towards the first phase
+    counter = None if args.base_url else QueryCounter()
+
+    # Log in a mix of the heaviest users and a random sample
+    by_size = sorted(range(1, args.users + 1), key=lambda user_id: counts[user_id - 1], reverse=True)
+    power_users = by_size[: max(1, args.logins // 5)]
+    sample = power_users + rng.sample(by_size[len(power_users):], min(args.logins - len(power_users), len(by_size) - len(power_users)))
+    tokens = {}
+
+    def login_job(user_id):
+        def job(client):
+            response = client.post(f"{API}/auth/login", data={"username": f"user{user_id}@bench.example.com", "password": PASSWORD})
+            if response.status_code == 200:
+                tokens[user_id] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+            return response.status_code == 200
+        return job
+
+    def list_job(user_id, skip):
+        def job(client):
+            response = client.get(f"{API}/todos/", headers=tokens[user_id], params={"skip": skip, "limit": args.page_size})
+            return response.status_code == 200
+        return job
+
+    created = []
+
+    def create_job(user_id):
+        def job(client):
+            response = client.post(f"{API}/todos/", headers=tokens[user_id], json={"title": "load test", "description": "created by load_test"})
+            if response.status_code == 201:
+                created.append((user_id, response.json()["id"]))
+            return response.status_code == 201
+        return job
+
+    def toggle_job(user_id, todo_id):
+        def job(client):
+            return client.patch(f"{API}/todos/{todo_id}/toggle", headers=tokens[user_id]).status_code == 200
+        return job
+
+    def delete_job(user_id, todo_id):
+        def job(client):
+            return client.delete(f"{API}/todos/{todo_id}", headers=tokens[user_id]).status_code == 204
+        return job
+
+    results = []
+    try:
+        results.append(run_phase(driver, "login", [login_job(user_id) for user_id in sample], args.concurrency, counter))
+
+        users = list(tokens)
+        power = [user_id for user_id in power_users if user_id in tokens] or users
+        pick = lambda pool: [rng.choice(pool) for _ in range(args.requests)]
+
+        results.append(run_phase(driver, "list_shallow", [list_job(u, 0) for u in pick(users)], args.concurrency, counter))
+        results.append(run_phase(
+            driver, "list_deep",
+            [list_job(u, max(0, counts[u - 1] - args.page_size)) for u in pick(power)],
+            args.concurrency, counter,
+        ))
+        results.append(run_phase(driver, "create", [create_job(u) for u in pick(users)], args.concurrency, counter))
+
+        rng.shuffle(created)
+        results.append(run_phase(driver, "toggle", [toggle_job(u, t) for u, t in created[: args.requests]], args.concurrency, counter))
+        results.append(run_phase(driver, "delete", [delete_job(u, t) for u, t in created], args.concurrency, counter))
+    finally:
+        driver.close()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mode": "http" if args.base_url else "in-process",
+        "config": {
+            "users": args.users,
+            "todos": sum(counts),
+            "skew": args.skew,
+            "concurrency": args.concurrency,
+            "requests_per_operation": args.requests,
+            "page_size": args.page_size,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+def query_count(response) -> int:
+    """SQL statements the request issued, as reported by QueryStatsMiddleware"""
+    return int(response.headers["x-db-query-count"])
+
+def assert_max_queries(response, max_queries: int) -> None:
+    """Fail when an endpoint issues more SQL statements than its budget"""
+    count = query_count(response)
+    request = response.request
+    assert count <= max_queries, (
+        f"{request.method} {request.url.path} issued {count} SQL queries, budget is {max_queries}"
+    )
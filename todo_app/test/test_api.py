@@ -193,4 +193,527 @@ def test_delete_todo(client, test_db):
         f"/api/v1/todos/{todo.id}",
         headers={"Authorization": f"Bearer {token}"}
     )
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+def login(client, test_db, email="search@example.com"):
+    from app.models.user import User
+
+    user = User(email=email, hashed_password=security.get_password_hash("password123"))
+    test_db.add(user)
+    test_db.commit()
+    test_db.refresh(user)
+
+    response = client.post(
+        "/api/v1/auth/login",
+        data={"username": email, "password": "password123"},
+    )
+    token = response.json()["access_token"]
+    return user, {"Authorization": f"Bearer {token}"}
+
+def test_search_todos_ranked_and_prefix(client, test_db):
+    user, headers = login(client, test_db)
+
+    client.post("/api/v1/todos/", headers=headers, json={"title": "Buy groceries", "description": "milk and eggs"})
+    client.post("/api/v1/todos/", headers=headers, json={"title": "Call mom", "description": "ask about groceries"})
+    client.post("/api/v1/todos/", headers=headers, json={"title": "Write report", "description": None})
+
+    response = client.get("/api/v1/todos/search", headers=headers, params={"q": "grocer"})
+    assert response.status_code == 200
+    titles = [item["title"] for item in response.json()["items"]]
+    assert titles == ["Buy groceries", "Call mom"]
+
+    response = client.get("/api/v1/todos/search", headers=headers, params={"q": "grocer", "prefix": False})
+    assert response.json()["items"] == []
+
+def test_search_todos_tracks_updates_deletes_and_filters(client, test_db):
+    user, headers = login(client, test_db)
+
+    first = client.post("/api/v1/todos/", headers=headers, json={"title": "alpha task"}).json()
+    second = client.post("/api/v1/todos/", headers=headers, json={"title": "alpha other"}).json()
+
+    client.put(f"/api/v1/todos/{first['id']}", headers=headers, json={"title": "beta task", "completed": True})
+    response = client.get("/api/v1/todos/search", headers=headers, params={"q": "alpha"})
+    assert [item["id"] for item in response.json()["items"]] == [second["id"]]
+
+    response = client.get("/api/v1/todos/search", headers=headers, params={"q": "task", "completed": True})
+    assert [item["id"] for item in response.json()["items"]] == [first["id"]]
+
+    client.delete(f"/api/v1/todos/{second['id']}", headers=headers)
+    response = client.get("/api/v1/todos/search", headers=headers, params={"q": "alpha"})
+    assert response.json()["items"] == []
+
+def test_search_todos_pagination(client, test_db):
+    user, headers = login(client, test_db)
+
+    for i in range(5):
+        client.post("/api/v1/todos/", headers=headers, json={"title": f"page item {i}"})
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"q": "page", "limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        data = client.get("/api/v1/todos/search", headers=headers, params=params).json()
+        seen.extend(item["id"] for item in data["items"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 5
+    assert len(set(seen)) == 5
+
+    # another user's inserts change the global bm25 statistics between pages
+    first_page = client.get("/api/v1/todos/search", headers=headers, params={"q": "page", "limit": 2}).json()
+    other, other_headers = login(client, test_db, email="other@example.com")
+    for i in range(20):
+        client.post("/api/v1/todos/", headers=other_headers, json={"title": f"page page other {i}"})
+    params = {"q": "page", "limit": 10, "cursor": first_page["next_cursor"]}
+    rest = client.get("/api/v1/todos/search", headers=headers, params=params).json()
+    assert [item["id"] for item in first_page["items"] + rest["items"]] == seen
+
+    response = client.get("/api/v1/todos/search", headers=headers, params={"q": "page", "cursor": "garbage"})
+    assert response.status_code == 400
+
+def test_changes_since_cursor_with_tombstones(client, test_db):
+    user, headers = login(client, test_db)
+
+    first = client.post("/api/v1/todos/", headers=headers, json={"title": "first"}).json()
+    second = client.post("/api/v1/todos/", headers=headers, json={"title": "second"}).json()
+
+    data = client.get("/api/v1/todos/changes", headers=headers).json()
+    assert [change["id"] for change in data["changes"]] == [first["id"], second["id"]]
+    assert data["has_more"] is False
+    cursor = data["cursor"]
+
+    data = client.get("/api/v1/todos/changes", headers=headers, params={"since": cursor}).json()
+    assert data["changes"] == []
+    assert data["cursor"] == cursor
+
+    client.patch(f"/api/v1/todos/{first['id']}/toggle", headers=headers)
+    client.delete(f"/api/v1/todos/{second['id']}", headers=headers)
+
+    data = client.get("/api/v1/todos/changes", headers=headers, params={"since": cursor}).json()
+    toggled, deleted = data["changes"]
+    assert toggled["id"] == first["id"]
+    assert toggled["revision"] == 2
+    assert toggled["todo"]["completed"] is True
+    assert deleted["id"] == second["id"]
+    assert deleted["deleted"] is True
+    assert deleted["todo"] is None
+
+def test_conditional_get_returns_304(client, test_db):
+    user, headers = login(client, test_db)
+
+    todo = client.post("/api/v1/todos/", headers=headers, json={"title": "cached"}).json()
+
+    response = client.get("/api/v1/todos/", headers=headers)
+    etag = response.headers["etag"]
+    response = client.get("/api/v1/todos/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+    response = client.get(f"/api/v1/todos/{todo['id']}", headers=headers)
+    item_etag = response.headers["etag"]
+    response = client.get(f"/api/v1/todos/{todo['id']}", headers={**headers, "If-None-Match": item_etag})
+    assert response.status_code == 304
+
+    client.put(f"/api/v1/todos/{todo['id']}", headers=headers, json={"title": "changed"})
+
+    response = client.get("/api/v1/todos/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()[0]["title"] == "changed"
+    response = client.get(f"/api/v1/todos/{todo['id']}", headers={**headers, "If-None-Match": item_etag})
+    assert response.status_code == 200
+
+def test_list_fast_path_matches_schema(client, test_db):
+    from app import schemas
+    from app.models.todo import Todo
+
+    user, headers = login(client, test_db)
+
+    client.post("/api/v1/todos/", headers=headers, json={"title": "one", "description": "with text"})
+    client.post("/api/v1/todos/", headers=headers, json={"title": "two"})
+
+    response = client.get("/api/v1/todos/", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+
+    todos = test_db.query(Todo).order_by(Todo.id).all()
+    expected = [schemas.Todo.model_validate(todo, from_attributes=True).model_dump(mode="json") for todo in todos]
+    assert response.json() == expected
+
+def test_stats_maintained_incrementally(client, test_db):
+    from app.core.stats import check_stats
+
+    user, headers = login(client, test_db)
+
+    ids = [client.post("/api/v1/todos/", headers=headers, json={"title": f"t{i}"}).json()["id"] for i in range(4)]
+    client.patch(f"/api/v1/todos/{ids[0]}/toggle", headers=headers)
+    client.put(f"/api/v1/todos/{ids[1]}", headers=headers, json={"completed": True})
+    client.patch(f"/api/v1/todos/{ids[2]}/toggle", headers=headers)
+    client.patch(f"/api/v1/todos/{ids[2]}/toggle", headers=headers)
+    client.delete(f"/api/v1/todos/{ids[1]}", headers=headers)
+    client.delete(f"/api/v1/todos/{ids[3]}", headers=headers)
+
+    data = client.get("/api/v1/todos/stats", headers=headers).json()
+    assert data["total"] == 2
+    assert data["completed"] == 1
+    assert data["open"] == 1
+    assert [day["count"] for day in data["completions_per_day"]] == [1]
+
+    assert check_stats(test_db) == []
+
+def test_stats_rebuild(client, test_db):
+    from app.core.stats import check_stats, rebuild_stats
+    from app.models.todo import Todo
+
+    user, headers = login(client, test_db)
+    test_db.add(Todo(title="imported", owner_id=user.id))
+    test_db.commit()
+
+    assert check_stats(test_db) != []
+    rebuild_stats(test_db)
+    assert check_stats(test_db) == []
+    assert client.get("/api/v1/todos/stats", headers=headers).json()["total"] == 1
+
+def test_export_streams_ndjson_and_csv(client, test_db):
+    import csv
+    import io
+    import json
+
+    user, headers = login(client, test_db)
+    for i in range(3):
+        client.post("/api/v1/todos/", headers=headers, json={"title": f"export {i}", "description": "a, \"quoted\" one"})
+
+    response = client.get("/api/v1/todos/export", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["title"] for line in lines] == ["export 0", "export 1", "export 2"]
+    assert lines == client.get("/api/v1/todos/", headers=headers).json()
+
+    response = client.get("/api/v1/todos/export", headers=headers, params={"format": "csv"})
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["title"] for row in rows] == ["export 0", "export 1", "export 2"]
+    assert rows[0]["description"] == "a, \"quoted\" one"
+    assert rows[0]["completed"] == "false"
+
+def test_import_batches_and_reports_errors(client, test_db):
+    import json
+    from app.core.stats import check_stats
+
+    user, headers = login(client, test_db)
+
+    records = [json.dumps({"title": f"imported {i}", "completed": i % 2 == 0}) for i in range(5)]
+    records.insert(2, "{not json")
+    records.append(json.dumps({"description": "missing title"}))
+    body = ("\n".join(records) + "\n").encode()
+
+    response = client.post("/api/v1/todos/import", headers=headers, files={"file": ("todos.ndjson", body)})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["imported"] == 5
+    assert data["failed"] == 2
+    assert [error["line"] for error in data["errors"]] == [3, 7]
+
+    csv_body = b"title,description,completed\ncsv one,,true\ncsv two,desc,false\n"
+    response = client.post(
+        "/api/v1/todos/import", headers=headers, params={"format": "csv"}, files={"file": ("todos.csv", csv_body)}
+    )
+    assert response.json()["imported"] == 2
+
+    stats = client.get("/api/v1/todos/stats", headers=headers).json()
+    assert stats["total"] == 7
+    assert stats["completed"] == 4
+    assert check_stats(test_db) == []
+    assert len(client.get("/api/v1/todos/changes", headers=headers).json()["changes"]) == 7
+
+def test_query_budgets(client, test_db):
+    from test.helpers import assert_max_queries
+
+    user, headers = login(client, test_db)
+
+    response = client.post("/api/v1/todos/", headers=headers, json={"title": "budget"})
+    assert_max_queries(response, 7)
+    todo_id = response.json()["id"]
+
+    for i in range(10):
+        client.post("/api/v1/todos/", headers=headers, json={"title": f"more {i}"})
+
+    assert_max_queries(client.get("/api/v1/todos/", headers=headers), 3)
+    assert_max_queries(client.get(f"/api/v1/todos/{todo_id}", headers=headers), 2)
+    assert_max_queries(client.patch(f"/api/v1/todos/{todo_id}/toggle", headers=headers), 8)
+    assert_max_queries(client.get("/api/v1/todos/stats", headers=headers), 3)
+
+def test_query_stats_headers_and_metrics(client, test_db, monkeypatch):
+    from app.config import settings
+    from app.core import instrumentation
+
+    user, headers = login(client, test_db)
+    instrumentation.metrics.reset()
+
+    response = client.get("/api/v1/todos/", headers=headers)
+    assert int(response.headers["x-db-query-count"]) > 0
+    assert float(response.headers["x-db-time-ms"]) >= 0
+    assert response.headers["server-timing"].startswith("db;dur=")
+
+    assert client.get("/api/v1/metrics/db", headers=headers).status_code == 404
+    monkeypatch.setattr(settings, "DB_METRICS_ENABLED", True)
+    assert client.get("/api/v1/metrics/db").status_code == 401
+    routes = client.get("/api/v1/metrics/db", headers=headers).json()["routes"]
+    assert routes["GET /api/v1/todos/"]["requests"] == 1
+    assert routes["GET /api/v1/todos/"]["slowest_statement"].startswith("SELECT")
+    assert routes["GET /api/v1/todos/"]["slowest_statement_ms"] >= 0
+
+    stats = instrumentation.QueryStats()
+    for _ in range(5):
+        stats.record("SELECT * FROM users WHERE id = ?", 0.001)
+    assert stats.repeated_statements(5) == {"SELECT * FROM users WHERE id = ?": 5}
+
+def test_websocket_pushes_changes_and_resumes(client, test_db):
+    user, headers = login(client, test_db)
+    token = headers["Authorization"].split()[1]
+
+    first = client.post("/api/v1/todos/", headers=headers, json={"title": "before connect"}).json()
+
+    with client.websocket_connect(f"/api/v1/todos/ws?token={token}&last_event_id=0") as ws:
+        replayed = ws.receive_json()
+        assert replayed["type"] == "create"
+        assert replayed["todo_id"] == first["id"]
+
+        second = client.post("/api/v1/todos/", headers=headers, json={"title": "live"}).json()
+        event = ws.receive_json()
+        assert event["type"] == "create"
+        assert event["todo"]["title"] == "live"
+        assert event["id"] > replayed["id"]
+
+        client.patch(f"/api/v1/todos/{second['id']}/toggle", headers=headers)
+        toggled = ws.receive_json()
+        assert toggled["type"] == "toggle"
+        assert toggled["todo"]["completed"] is True
+
+        client.delete(f"/api/v1/todos/{first['id']}", headers=headers)
+        deleted = ws.receive_json()
+        assert deleted["type"] == "delete"
+        assert deleted["todo"] is None
+        last_seen = deleted["id"]
+
+    client.put(f"/api/v1/todos/{second['id']}", headers=headers, json={"title": "while offline"})
+
+    with client.websocket_connect(f"/api/v1/todos/ws?token={token}&last_event_id={last_seen}") as ws:
+        missed = ws.receive_json()
+        assert missed["type"] == "update"
+        assert missed["todo"]["title"] == "while offline"
+
+def test_websocket_without_last_event_id_only_gets_new_changes(client, test_db):
+    user, headers = login(client, test_db)
+    token = headers["Authorization"].split()[1]
+
+    old = client.post("/api/v1/todos/", headers=headers, json={"title": "old"}).json()
+    client.patch(f"/api/v1/todos/{old['id']}/toggle", headers=headers)
+
+    with client.websocket_connect(f"/api/v1/todos/ws?token={token}") as ws:
+        client.post("/api/v1/todos/", headers=headers, json={"title": "new"})
+        event = ws.receive_json()
+        assert event["type"] == "create"
+        assert event["todo"]["title"] == "new"
+
+def test_events_published_out_of_order_are_delivered_in_order(client, test_db):
+    from app.core import changes, events
+    from app.models.todo import Todo
+
+    user, headers = login(client, test_db)
+    token = headers["Authorization"].split()[1]
+
+    with client.websocket_connect(f"/api/v1/todos/ws?token={token}&last_event_id=0") as ws:
+        # once this arrives, the replay on connect is over
+        client.post("/api/v1/todos/", headers=headers, json={"title": "zero"})
+        assert ws.receive_json()["todo"]["title"] == "zero"
+
+        # two writers commit in change id order but publish the other way round
+        published = []
+        for title in ("first", "second"):
+            todo = Todo(title=title, owner_id=user.id)
+            test_db.add(todo)
+            test_db.flush()
+            published.append(events.todo_event("create", changes.record_change(test_db, todo), todo))
+        test_db.commit()
+        events.publish(published[1])
+        events.publish(published[0])
+
+        received = [ws.receive_json(), ws.receive_json()]
+        assert [event["id"] for event in received] == [event["id"] for event in published]
+        assert [event["todo"]["title"] for event in received] == ["first", "second"]
+
+        client.post("/api/v1/todos/", headers=headers, json={"title": "third"})
+        assert ws.receive_json()["todo"]["title"] == "third"
+
+def test_websocket_rejects_bad_token(client, test_db):
+    from starlette.websockets import WebSocketDisconnect
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect("/api/v1/todos/ws?token=nope") as ws:
+            ws.receive_json()
+
+@pytest.fixture
+def shards(monkeypatch, tmp_path):
+    from app import database
+
+    engines = [
+        create_engine(f"sqlite:///{tmp_path / f'test_shard_{shard}.db'}", connect_args={"check_same_thread": False})
+        for shard in range(2)
+    ]
+    for shard_engine in engines:
+        Base.metadata.create_all(bind=shard_engine)
+    monkeypatch.setattr(database, "shard_sessions", [
+        sessionmaker(autocommit=False, autoflush=False, bind=shard_engine) for shard_engine in engines
+    ])
+
+    yield database.shard_sessions
+
+    for shard_engine in engines:
+        Base.metadata.drop_all(bind=shard_engine)
+        shard_engine.dispose()
+
+def test_sharded_mode_routes_todos_by_user(client, test_db, shards):
+    from app.models.todo import Todo
+
+    for i in range(6):
+        user, headers = login(client, test_db, email=f"shard{i}@example.com")
+        response = client.post("/api/v1/todos/", headers=headers, json={"title": f"owned by {i}"})
+        assert response.status_code == 201
+        assert [todo["title"] for todo in client.get("/api/v1/todos/", headers=headers).json()] == [f"owned by {i}"]
+
+    assert test_db.query(Todo).count() == 0
+    per_shard = []
+    for make_session in shards:
+        shard_db = make_session()
+        per_shard.append({todo.owner_id for todo in shard_db.query(Todo)})
+        shard_db.close()
+    assert per_shard[0] and per_shard[1]
+    assert not per_shard[0] & per_shard[1]
+
+def test_rebalance_moves_user_between_shards(client, test_db, shards):
+    from app.core import sharding
+    from app.core.stats import check_stats
+    from app.models.user import User
+
+    user, headers = login(client, test_db, email="mover@example.com")
+    ids = [client.post("/api/v1/todos/", headers=headers, json={"title": f"move {i}"}).json()["id"] for i in range(3)]
+    client.patch(f"/api/v1/todos/{ids[0]}/toggle", headers=headers)
+    cursor = client.get("/api/v1/todos/changes", headers=headers).json()["cursor"]
+
+    source = sharding.resolve_shard(user)
+    target = 1 - source
+    assert sharding.move_user(test_db, user.id, target) == 3
+    moved = test_db.get(User, user.id)
+    assert moved.shard_id == target
+    assert moved.is_active
+
+    todos = client.get("/api/v1/todos/", headers=headers).json()
+    assert [todo["title"] for todo in todos] == ["move 0", "move 1", "move 2"]
+    assert todos[0]["completed"] is True
+    assert client.get("/api/v1/todos/stats", headers=headers).json()["total"] == 3
+
+    changes = client.get("/api/v1/todos/changes", headers=headers, params={"since": cursor}).json()["changes"]
+    live = {change["id"] for change in changes if not change["deleted"]}
+    assert live == {todo["id"] for todo in todos}
+
+    for make_session in shards:
+        shard_db = make_session()
+        assert check_stats(shard_db) == []
+        shard_db.close()
+
+def test_archive_completed_todos_and_restore(client, test_db):
+    from datetime import datetime, timedelta
+    from app.core import archive
+    from app.core.stats import check_stats, rebuild_stats
+    from app.models.todo import Todo
+
+    user, headers = login(client, test_db)
+    ids = [client.post("/api/v1/todos/", headers=headers, json={"title": f"a{i}"}).json()["id"] for i in range(4)]
+    for todo_id in ids:
+        client.patch(f"/api/v1/todos/{todo_id}/toggle", headers=headers)
+    old = test_db.get(Todo, ids[0])
+    old.completed_at = datetime.now() - timedelta(days=40)
+    test_db.commit()
+    rebuild_stats(test_db)
+    etag = client.get("/api/v1/todos/", headers=headers).headers["etag"]
+
+    assert archive.archive_completed(test_db, timedelta(days=30)) == 1
+    client.patch(f"/api/v1/todos/{ids[3]}/toggle", headers=headers)
+    assert archive.archive_completed(test_db, timedelta(days=0)) == 2
+
+    response = client.get("/api/v1/todos/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert [todo["id"] for todo in response.json()] == [ids[3]]
+    everything = client.get("/api/v1/todos/", headers=headers, params={"include_archived": True}).json()
+    assert [todo["id"] for todo in everything] == ids
+    assert client.get(f"/api/v1/todos/{ids[0]}", headers=headers).status_code == 404
+    assert client.get(f"/api/v1/todos/{ids[0]}", headers=headers, params={"include_archived": True}).status_code == 200
+
+    data = client.get("/api/v1/todos/stats", headers=headers).json()
+    assert (data["total"], data["completed"], data["archived"]) == (4, 3, 3)
+    assert check_stats(test_db) == []
+    changes = client.get("/api/v1/todos/changes", headers=headers).json()["changes"]
+    assert all(change["todo"] is not None for change in changes)
+
+    response = client.patch(f"/api/v1/todos/{ids[0]}/toggle", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["completed"] is False
+    assert [todo["id"] for todo in client.get("/api/v1/todos/", headers=headers).json()] == [ids[0], ids[3]]
+    assert client.get("/api/v1/todos/stats", headers=headers).json()["archived"] == 2
+    assert check_stats(test_db) == []
+
+    export = client.get("/api/v1/todos/export", headers=headers).text.splitlines()
+    assert len(export) == 4
+
+def test_archive_skips_todos_changed_after_selecting_them(client, test_db, monkeypatch):
+    from datetime import timedelta
+    from app.core import archive
+    from app.core.stats import check_stats
+
+    user, headers = login(client, test_db)
+    ids = [client.post("/api/v1/todos/", headers=headers, json={"title": f"c{i}"}).json()["id"] for i in range(3)]
+    for todo_id in ids:
+        client.patch(f"/api/v1/todos/{todo_id}/toggle", headers=headers)
+
+    real_insert = archive.insert
+
+    def insert_after_concurrent_writes(table):
+        # another request reopens one todo and deletes another between the select and the move
+        client.patch(f"/api/v1/todos/{ids[0]}/toggle", headers=headers)
+        client.delete(f"/api/v1/todos/{ids[1]}", headers=headers)
+        return real_insert(table)
+
+    monkeypatch.setattr(archive, "insert", insert_after_concurrent_writes)
+    assert archive.archive_completed(test_db, timedelta(days=0)) == 1
+
+    todos = client.get("/api/v1/todos/", headers=headers).json()
+    assert [(todo["id"], todo["completed"]) for todo in todos] == [(ids[0], False)]
+    data = client.get("/api/v1/todos/stats", headers=headers).json()
+    assert (data["total"], data["completed"], data["archived"]) == (2, 1, 1)
+    assert check_stats(test_db) == []
+
+def test_archived_ids_are_never_reused(client, test_db):
+    from datetime import timedelta
+    from app.core import archive
+
+    user, headers = login(client, test_db)
+    archived_id, newest_id = [
+        client.post("/api/v1/todos/", headers=headers, json={"title": title}).json()["id"] for title in ("old", "new")
+    ]
+    client.patch(f"/api/v1/todos/{archived_id}/toggle", headers=headers)
+    assert archive.archive_completed(test_db, timedelta(days=0)) == 1
+
+    # with max(id) + 1 allocation, deleting the newest todo frees the archived id
+    client.delete(f"/api/v1/todos/{newest_id}", headers=headers)
+    other, other_headers = login(client, test_db, email="other@example.com")
+    created = client.post("/api/v1/todos/", headers=other_headers, json={"title": "someone else's"}).json()
+    assert created["id"] > newest_id
+
+    response = client.patch(f"/api/v1/todos/{archived_id}/toggle", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["title"] == "old"
+    changes = client.get("/api/v1/todos/changes", headers=headers).json()["changes"]
+    assert {change["todo"]["title"] for change in changes if change["todo"]} == {"old"}